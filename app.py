@@ -1,22 +1,81 @@
+import contextlib
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import time
 import hashlib
 import hmac
 import secrets
+import json
 import logging
-
-DB_PATH = "data/database.db"
+import re
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: the in-process lock still applies
+    fcntl = None
+
+import compression
+import metrics
+import shared
+import storage
+import tracing
+
+DB_PATH = os.environ.get("DB_PATH", "data/database.db")
+# WAL lets readers (and online backups) run alongside the writer. The mode is
+# persistent in the database file; set to "delete" to go back to a rollback journal.
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "wal").strip().lower()
+# Tombstones older than this are compacted once every active device has synced past them.
+TOMBSTONE_MIN_AGE_DAYS = float(os.environ.get("TOMBSTONE_MIN_AGE_DAYS", "30"))
+# Devices that have not synced for this long stop holding tombstones back.
+SYNC_DEVICE_TTL_DAYS = float(os.environ.get("SYNC_DEVICE_TTL_DAYS", "90"))
+# Optional sharding: each owner's documents, highlights, tombstones and search
+# index live in one of DB_SHARDS files under SHARD_DIR (0 keeps everything in
+# DB_PATH). DB_PATH stays the catalog: accounts, shard assignments, maintenance
+# state, the audio cache, and documents without an owner.
+DB_SHARDS = max(0, int(os.environ.get("DB_SHARDS", "0")))
+SHARD_DIR = os.environ.get("SHARD_DIR") or os.path.join(os.path.dirname(DB_PATH) or ".", "shards")
+# Shard files kept open between calls, least recently used closed first.
+DB_SHARD_OPEN_MAX = max(1, int(os.environ.get("DB_SHARD_OPEN_MAX", "64")))
 
 logger = logging.getLogger("localreader.app")
+position_logger = logging.getLogger("localreader.app.position")
+
+DB_CALL_SECONDS = metrics.histogram(
+    "localreader_db_call_seconds",
+    "Wall time of app.py database functions.",
+    ("function",),
+)
+DB_LOCK_RETRIES = metrics.counter(
+    "localreader_db_lock_retries_total",
+    "Retries after 'database is locked' errors.",
+    ("operation",),
+)
+_db_timer = metrics.timed(DB_CALL_SECONDS)
+
+
+def _db_timed(fn):
+    """Time a database function for /api/metrics and the current request trace."""
+    timed = _db_timer(fn)
+    span_name = "db." + fn.__name__.lstrip("_")
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with tracing.span(span_name):
+            return timed(*args, **kwargs)
+
+    return wrapper
 
 
 class FileDeletedError(RuntimeError):
     pass
 
 
-def _extract_actual_filename(file_id: str) -> str:
+def extract_actual_filename(file_id: str) -> str:
+    """The document name in a ``file::<name>::...`` id (other ids are returned as is)."""
     if not isinstance(file_id, str):
         return ""
     if not file_id.startswith("file::"):
@@ -25,15 +84,16 @@ def _extract_actual_filename(file_id: str) -> str:
     return parts[1] if len(parts) >= 2 else file_id
 
 
-def init_db():
-    """Initialize database and create tables if they don't exist."""
-    # Ensure the data directory exists
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    logger.info("init_db: path=%s", DB_PATH)
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+def _ensure_column(conn, table_name: str, column_name: str, column_def: str):
+    cols = {row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")}  # row[1] is column name
+    if column_name not in cols:
+        logger.info("Schema migration: add column %s.%s", table_name, column_name)
+        conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_def}")
+
+
+def _migration_base_schema(conn):
+    """Create tables, and add columns that older (pre-versioning) DBs may lack."""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS files (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
@@ -46,7 +106,7 @@ def init_db():
         )
     """)
     
-    cursor.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS highlights (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             file_id TEXT NOT NULL,
@@ -59,7 +119,7 @@ def init_db():
         )
     """)
 
-    cursor.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -72,7 +132,7 @@ def init_db():
         """
     )
 
-    cursor.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS password_resets (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -85,28 +145,18 @@ def init_db():
         )
         """
     )
-    
-    conn.commit()
-
-    # Lightweight schema migrations for older DBs
-    def _ensure_column(table_name: str, column_name: str, column_def: str):
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        cols = {row[1] for row in cursor.fetchall()}  # row[1] is column name
-        if column_name not in cols:
-            logger.info("Schema migration: add column %s.%s", table_name, column_name)
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_def}")
 
-    _ensure_column("files", "updated_at", "TEXT")
-    _ensure_column("files", "position_updated_at", "TEXT")
-    _ensure_column("files", "highlights_updated_at", "TEXT")
-    _ensure_column("files", "voice_updated_at", "TEXT")
-    _ensure_column("files", "owner_email", "TEXT")
-    _ensure_column("files", "actual_filename", "TEXT")
+    _ensure_column(conn, "files", "updated_at", "TEXT")
+    _ensure_column(conn, "files", "position_updated_at", "TEXT")
+    _ensure_column(conn, "files", "highlights_updated_at", "TEXT")
+    _ensure_column(conn, "files", "voice_updated_at", "TEXT")
+    _ensure_column(conn, "files", "owner_email", "TEXT")
+    _ensure_column(conn, "files", "actual_filename", "TEXT")
 
-    _ensure_column("highlights", "owner_email", "TEXT")
-    _ensure_column("highlights", "comment", "TEXT")
+    _ensure_column(conn, "highlights", "owner_email", "TEXT")
+    _ensure_column(conn, "highlights", "comment", "TEXT")
 
-    cursor.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS deleted_files (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -118,8 +168,10 @@ def init_db():
         """
     )
 
-    # Backfill any NULL timestamps for existing rows
-    cursor.execute(
+
+def _migration_backfill(conn):
+    """Fill NULL timestamps and actual_filename left by older versions, set-based."""
+    conn.execute(
         """
         UPDATE files
         SET
@@ -133,27 +185,533 @@ def init_db():
            OR voice_updated_at IS NULL
         """
     )
-    # Backfill ownership for older DBs (single-user legacy): keep NULL if unknown.
-
-    # Backfill actual_filename for older rows.
-    cursor.execute(
+    # Same rule as extract_actual_filename: "file::<name>::..." -> "<name>".
+    conn.execute(
         """
-        SELECT id, filename
-        FROM files
+        UPDATE files
+        SET actual_filename = CASE
+            WHEN substr(filename, 1, 6) != 'file::' THEN filename
+            WHEN instr(substr(filename, 7), '::') > 0
+                THEN substr(substr(filename, 7), 1, instr(substr(filename, 7), '::') - 1)
+            ELSE substr(filename, 7)
+        END
         WHERE actual_filename IS NULL
         """
     )
-    rows = cursor.fetchall()
-    for file_row_id, filename in rows:
-        actual = _extract_actual_filename(filename)
-        cursor.execute(
-            "UPDATE files SET actual_filename = ? WHERE id = ?",
-            (actual, file_row_id),
+
+
+def _migration_lookup_indexes(conn):
+    """Index the (owner, filename) lookups every sync request makes."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_owner_filename ON files(owner_email, filename)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_owner_actual ON files(owner_email, actual_filename)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_owner_created ON files(owner_email, created_at)")
+
+
+def _fts5_available(conn) -> bool:
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp._fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _migration_highlights_fts(conn):
+    """Full-text index over highlight text and comments, maintained by triggers.
+
+    The index reads from a view that adds ``owner_key = hex(owner_email)`` so the
+    owner becomes a single exact token: scoping a search to one user is an
+    index lookup instead of a phrase match over common email tokens.
+    """
+    if not _fts5_available(conn):
+        logger.warning("Schema migration: SQLite built without FTS5; highlight search disabled")
+        return
+    conn.execute(
+        """
+        CREATE VIEW IF NOT EXISTS highlights_fts_source AS
+        SELECT id, text, comment, hex(owner_email) AS owner_key
+        FROM highlights
+        """
+    )
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS highlights_fts USING fts5(
+            text, comment, owner_key,
+            content='highlights_fts_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
         )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS highlights_fts_ai AFTER INSERT ON highlights BEGIN
+            INSERT INTO highlights_fts(rowid, text, comment, owner_key)
+            VALUES (new.id, new.text, new.comment, hex(new.owner_email));
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS highlights_fts_ad AFTER DELETE ON highlights BEGIN
+            INSERT INTO highlights_fts(highlights_fts, rowid, text, comment, owner_key)
+            VALUES ('delete', old.id, old.text, old.comment, hex(old.owner_email));
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS highlights_fts_au AFTER UPDATE ON highlights BEGIN
+            INSERT INTO highlights_fts(highlights_fts, rowid, text, comment, owner_key)
+            VALUES ('delete', old.id, old.text, old.comment, hex(old.owner_email));
+            INSERT INTO highlights_fts(rowid, text, comment, owner_key)
+            VALUES (new.id, new.text, new.comment, hex(new.owner_email));
+        END
+        """
+    )
+    conn.execute("INSERT INTO highlights_fts(highlights_fts) VALUES ('rebuild')")
 
-    conn.commit()
-    conn.close()
-    logger.info("init_db: done")
+
+def _migration_content_index(conn):
+    """EPUB chapter text for library search, with per-file indexing state.
+
+    ``files.content_hash`` (sha256 of file_data) lets the indexer skip blobs it
+    has already seen; ``content_index_state`` records the hash each file was last
+    indexed (or failed) at, so indexing resumes where it stopped after a restart.
+    """
+    _ensure_column(conn, "files", "content_hash", "TEXT")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS content_index_state (
+            file_id INTEGER PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            status TEXT NOT NULL,
+            chapters INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            indexed_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS book_chapters (
+            id INTEGER PRIMARY KEY,
+            file_id INTEGER NOT NULL,
+            owner_email TEXT,
+            chapter_index INTEGER NOT NULL,
+            href TEXT,
+            title TEXT,
+            text TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_book_chapters_file ON book_chapters(file_id)")
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS files_content_index_ad AFTER DELETE ON files BEGIN
+            DELETE FROM book_chapters WHERE file_id = old.id;
+            DELETE FROM content_index_state WHERE file_id = old.id;
+        END
+        """
+    )
+
+    if not _fts5_available(conn):
+        logger.warning("Schema migration: SQLite built without FTS5; library search disabled")
+        return
+    conn.execute(
+        """
+        CREATE VIEW IF NOT EXISTS book_chapters_fts_source AS
+        SELECT id, title, text, hex(owner_email) AS owner_key
+        FROM book_chapters
+        """
+    )
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS book_chapters_fts USING fts5(
+            title, text, owner_key,
+            content='book_chapters_fts_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS book_chapters_fts_ai AFTER INSERT ON book_chapters BEGIN
+            INSERT INTO book_chapters_fts(rowid, title, text, owner_key)
+            VALUES (new.id, new.title, new.text, hex(new.owner_email));
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS book_chapters_fts_ad AFTER DELETE ON book_chapters BEGIN
+            INSERT INTO book_chapters_fts(book_chapters_fts, rowid, title, text, owner_key)
+            VALUES ('delete', old.id, old.title, old.text, hex(old.owner_email));
+        END
+        """
+    )
+
+
+def _migration_file_metadata(conn):
+    """Per-file EPUB metadata and downscaled cover, written by the content indexer."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS file_metadata (
+            file_id INTEGER PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            title TEXT,
+            authors TEXT,
+            language TEXT,
+            publisher TEXT,
+            published TEXT,
+            description TEXT,
+            toc TEXT,
+            cover BLOB,
+            cover_type TEXT,
+            extracted_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS files_metadata_ad AFTER DELETE ON files BEGIN
+            DELETE FROM file_metadata WHERE file_id = old.id;
+        END
+        """
+    )
+
+
+def _migration_tombstone_sync(conn):
+    """Incremental tombstone sync: deleted_files.id is the change sequence, acked per device."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_deleted_files_owner_seq ON deleted_files(owner_email, id)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_devices (
+            owner_email TEXT NOT NULL,
+            device_id TEXT NOT NULL,
+            acked_seq INTEGER NOT NULL,
+            last_seen_at TEXT NOT NULL,
+            PRIMARY KEY (owner_email, device_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _migration_maintenance_state(conn):
+    """Last run time of each maintenance task, so restarts don't repeat daily work."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_state (
+            task TEXT PRIMARY KEY,
+            last_run_at REAL NOT NULL
+        )
+        """
+    )
+
+
+def _migration_content_hash_index(conn):
+    """Signed download URLs look documents up by content hash."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash)")
+
+
+def _migration_tts_audio(conn):
+    """Shared cache of synthesized sentence audio (bytes live on disk, see ttscache)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tts_audio (
+            voice TEXT NOT NULL,
+            speed TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            owner_email TEXT NOT NULL,
+            audio_hash TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            last_used_at REAL NOT NULL,
+            PRIMARY KEY (voice, speed, text_hash, owner_email)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tts_audio_owner_used ON tts_audio(owner_email, last_used_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tts_audio_used ON tts_audio(last_used_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tts_audio_hash ON tts_audio(audio_hash)")
+
+
+def _migration_owner_shards(conn):
+    """Which shard file holds each owner's data (only used with DB_SHARDS)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS owner_shards (
+            owner_email TEXT PRIMARY KEY,
+            shard INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _migration_blob_store(conn):
+    """Documents kept in the blob store (see storage.py) instead of ``file_data``.
+
+    ``blob_store`` names the store (NULL: the bytes are in ``file_data``) and
+    ``blob_size`` is the document's size, ``file_data`` being empty.
+    ``blob_orphans`` records since when stored objects no file references have
+    been unreferenced, for the maintenance sweep.
+    """
+    _ensure_column(conn, "files", "blob_store", "TEXT")
+    _ensure_column(conn, "files", "blob_size", "INTEGER")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blob_orphans (
+            content_hash TEXT PRIMARY KEY,
+            since REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _migration_codec(conn):
+    """Documents stored compressed (see compression.py).
+
+    ``codec`` is NULL for documents stored as they are, else ``gzip`` or
+    ``xz``; ``blob_size`` then holds the original size. Compressed objects
+    in the blob store are keyed ``<content_hash>.gz`` / ``.xz``, and
+    ``blob_orphans.content_hash`` holds such keys too.
+    """
+    _ensure_column(conn, "files", "codec", "TEXT")
+
+
+# Ordered schema migrations; entry N brings PRAGMA user_version from N-1 to N.
+# Append only: never edit or reorder a migration that has shipped.
+MIGRATIONS = (
+    _migration_base_schema,
+    _migration_backfill,
+    _migration_lookup_indexes,
+    _migration_highlights_fts,
+    _migration_content_index,
+    _migration_file_metadata,
+    _migration_tombstone_sync,
+    _migration_maintenance_state,
+    _migration_content_hash_index,
+    _migration_tts_audio,
+    _migration_owner_shards,
+    _migration_blob_store,
+    _migration_codec,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _migrate(conn) -> int:
+    """Apply pending migrations, each in its own transaction. Returns the final version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read under the write lock: another process may have migrated meanwhile.
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current < number:
+                logger.info("Schema migration %d: %s", number, migration.__name__.removeprefix("_migration_"))
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        version = number
+    return version
+
+
+def _apply_journal_mode(conn) -> None:
+    if DB_JOURNAL_MODE not in {"wal", "delete", "truncate", "persist"}:
+        if DB_JOURNAL_MODE:
+            logger.warning("init_db: ignoring unsupported DB_JOURNAL_MODE=%s", DB_JOURNAL_MODE)
+        return
+    current = conn.execute("PRAGMA journal_mode").fetchone()[0].lower()
+    if current == DB_JOURNAL_MODE:
+        return
+    try:
+        mode = conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}").fetchone()[0].lower()
+    except sqlite3.OperationalError as e:
+        logger.warning("init_db: cannot switch journal mode %s -> %s: %s", current, DB_JOURNAL_MODE, e)
+        return
+    if mode != DB_JOURNAL_MODE:
+        logger.warning("init_db: journal mode %s requested, database uses %s", DB_JOURNAL_MODE, mode)
+    else:
+        logger.info("init_db: journal mode %s -> %s", current, mode)
+
+
+def _init_database(path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    logger.info("init_db: path=%s", path)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+            # Only possible before the first table exists; lets maintenance
+            # return freed pages to the filesystem without a full VACUUM.
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        _apply_journal_mode(conn)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            logger.info("init_db: schema up to date (version %d)", version)
+            return
+        version = _migrate(conn)
+    finally:
+        conn.close()
+    logger.info("init_db: done (version %d)", version)
+
+
+@_db_timed
+def init_db():
+    """Initialize the database (and existing shards), applying any pending schema migrations.
+
+    An up-to-date database costs three small queries per file: an empty-schema
+    probe, the ``PRAGMA journal_mode`` check (DB_JOURNAL_MODE may have changed
+    since the last start) and the ``PRAGMA user_version`` read.
+    """
+    storage.store()  # fail at startup on a bad BLOB_STORE setting
+    _init_database(DB_PATH)
+    if not DB_SHARDS:
+        with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            split = conn.execute("SELECT COUNT(*) FROM owner_shards").fetchone()[0]
+        if split:
+            logger.error("init_db: %d owners have their data in %s, but DB_SHARDS is not set", split, SHARD_DIR)
+        return
+    for path in shard_paths():
+        _init_database(path)
+        _shard_ready.add(path)
+
+
+# ---- Shards -----------------------------------------------------------------
+# An owner is assigned a shard (a hash bucket of DB_SHARDS) the first time
+# they are seen, recorded in owner_shards so changing DB_SHARDS later only
+# affects new owners. Each shard has its own write gate, so writes for owners
+# in different shards run in parallel.
+
+_owner_shards: dict[str, int] = {}
+# Shards migrated by this process, and the ones currently held open.
+_shard_ready: set[str] = set()
+_shard_handles: OrderedDict[str, sqlite3.Connection] = OrderedDict()
+_shard_lock = threading.Lock()
+
+
+def _shard_path(shard: int) -> str:
+    return os.path.join(SHARD_DIR, f"shard-{shard:03d}.db")
+
+
+def shard_paths() -> list[str]:
+    """Shard files that exist on disk, in shard order."""
+    try:
+        names = os.listdir(SHARD_DIR)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(SHARD_DIR, n) for n in sorted(names) if n.startswith("shard-") and n.endswith(".db")]
+
+
+def database_paths() -> list[str]:
+    """Every database file: the catalog first, then the shards."""
+    return [DB_PATH, *shard_paths()] if DB_SHARDS else [DB_PATH]
+
+
+def _owner_shard(owner_n: str) -> int:
+    shard = _owner_shards.get(owner_n)
+    if shard is not None:
+        return shard
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        row = conn.execute("SELECT shard FROM owner_shards WHERE owner_email = ?", (owner_n,)).fetchone()
+    if row is None:
+        bucket = int.from_bytes(hashlib.sha256(owner_n.encode("utf-8")).digest()[:8], "big") % DB_SHARDS
+        with write_gate(), sqlite3.connect(DB_PATH, timeout=30) as conn:
+            conn.execute("INSERT OR IGNORE INTO owner_shards (owner_email, shard) VALUES (?, ?)", (owner_n, bucket))
+            row = conn.execute("SELECT shard FROM owner_shards WHERE owner_email = ?", (owner_n,)).fetchone()
+        logger.info("Owner assigned to shard: owner=%s shard=%d", owner_n, row[0])
+    _owner_shards[owner_n] = row[0]
+    return row[0]
+
+
+def _open_shard(path: str) -> None:
+    """Migrate a shard on first use and keep a connection to it open.
+
+    The idle connection keeps the shard's WAL in place: when a file's last
+    connection closes, SQLite checkpoints and deletes the WAL, which the
+    per-call connections would otherwise trigger on every request.
+    """
+    with _shard_lock:
+        if path in _shard_handles:
+            _shard_handles.move_to_end(path)
+            return
+        if path not in _shard_ready:
+            _init_database(path)
+            _shard_ready.add(path)
+        _shard_handles[path] = sqlite3.connect(path, check_same_thread=False)
+        while len(_shard_handles) > DB_SHARD_OPEN_MAX:
+            _, conn = _shard_handles.popitem(last=False)
+            conn.close()
+
+
+def _db_path(owner_email=None) -> str:
+    """Database file holding ``owner_email``'s data: their shard, or DB_PATH."""
+    owner_n = _normalize_email(owner_email) if owner_email else ""
+    if not DB_SHARDS or not owner_n:
+        return DB_PATH
+    path = _shard_path(_owner_shard(owner_n))
+    _open_shard(path)
+    return path
+
+
+def _connect(owner_email=None, timeout=30, **kwargs):
+    return sqlite3.connect(_db_path(owner_email), timeout=timeout, **kwargs)
+
+
+# Per-owner sets of tombstoned actual filenames, so upload/download checks do
+# not open a connection. Deletions and compaction in this process invalidate
+# the owner's entry; the generation stops a slow load from caching a set that
+# was invalidated while it was being read. Other worker processes announce
+# their changes through a shared token, which drops this process's whole cache.
+TOMBSTONE_CACHE_OWNERS = 1024
+_tombstone_cache: OrderedDict[str, frozenset] = OrderedDict()
+_tombstone_generation = 0
+_tombstone_token = 0
+_tombstone_lock = threading.Lock()
+
+
+def _forget_tombstones(owner_n: str | None = None) -> None:
+    """Drop the cached tombstones of one owner (all owners if None), here and in other workers."""
+    global _tombstone_generation, _tombstone_token
+    token = shared.new_token()
+    with _tombstone_lock:
+        _tombstone_generation += 1
+        _tombstone_token = token
+        shared.write("tombstones", token)
+        if owner_n is None:
+            _tombstone_cache.clear()
+        else:
+            _tombstone_cache.pop(owner_n, None)
+
+
+def _sync_tombstone_token() -> None:
+    global _tombstone_generation, _tombstone_token
+    token = shared.read("tombstones")
+    if token != _tombstone_token:
+        with _tombstone_lock:
+            if token != _tombstone_token:
+                _tombstone_generation += 1
+                _tombstone_token = token
+                _tombstone_cache.clear()
+
+
+@_db_timed
+def _load_tombstones(owner_n: str) -> frozenset:
+    with _tombstone_lock:
+        generation = _tombstone_generation
+    with _connect(owner_n) as conn:
+        names = frozenset(
+            r[0] for r in conn.execute("SELECT actual_filename FROM deleted_files WHERE owner_email = ?", (owner_n,))
+        )
+    with _tombstone_lock:
+        if generation == _tombstone_generation:
+            _tombstone_cache[owner_n] = names
+            while len(_tombstone_cache) > TOMBSTONE_CACHE_OWNERS:
+                _tombstone_cache.popitem(last=False)
+    return names
 
 
 def _is_actual_filename_deleted(actual_filename: str, owner_email: str | None) -> bool:
@@ -163,43 +721,129 @@ def _is_actual_filename_deleted(actual_filename: str, owner_email: str | None) -
     actual = (actual_filename or "").strip()
     if not actual:
         return False
-    with sqlite3.connect(DB_PATH, timeout=30) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM deleted_files WHERE owner_email = ? AND actual_filename = ?",
-            (owner_n, actual),
-        )
-        return cursor.fetchone() is not None
+    _sync_tombstone_token()
+    with _tombstone_lock:
+        names = _tombstone_cache.get(owner_n)
+        if names is not None:
+            _tombstone_cache.move_to_end(owner_n)
+    if names is None:
+        names = _load_tombstones(owner_n)
+    return actual in names
+
 
+@_db_timed
+def get_deleted_files(owner_email: str | None = None, since: int = 0):
+    """Tombstones of an owner, newest first.
 
-def get_deleted_files(owner_email: str | None = None):
+    Args:
+        since: Only return tombstones with a change_seq above this (the
+            ``tombstone_seq`` a client received on its previous sync)
+
+    Returns:
+        List of dicts with actual_filename, deleted_at and change_seq
+    """
     owner_n = _normalize_email(owner_email) if owner_email else None
     if not owner_n:
         return []
-    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+    with _connect(owner_n) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         cursor.execute(
             """
-            SELECT actual_filename, deleted_at
+            SELECT actual_filename, deleted_at, id AS change_seq
             FROM deleted_files
-            WHERE owner_email = ?
-            ORDER BY deleted_at DESC
+            WHERE owner_email = ? AND id > ?
+            ORDER BY id DESC
             """,
-            (owner_n,),
+            (owner_n, int(since)),
         )
         rows = cursor.fetchall()
     return [dict(r) for r in rows]
 
 
+# (owner, device) -> (acked_seq, day) last written, to skip no-op upserts.
+_device_acks: dict[tuple[str, str], tuple[int, str]] = {}
+
+
+@_db_timed
+def record_device_ack(owner_email: str, device_id: str, acked_seq: int) -> None:
+    """Record that a device has applied every tombstone up to ``acked_seq``.
+
+    Written at most once a day per device unless the acknowledged sequence moves.
+    """
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    if not owner_n or not device_id:
+        return
+    now = datetime.utcnow()
+    key, value = (owner_n, device_id), (int(acked_seq), now.date().isoformat())
+    if _device_acks.get(key) == value:
+        return
+    for attempt in range(4):
+        try:
+            with write_gate(owner_n), _connect(owner_n) as conn:
+                conn.execute(
+                    """
+                    INSERT INTO sync_devices (owner_email, device_id, acked_seq, last_seen_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(owner_email, device_id)
+                    DO UPDATE SET acked_seq = MAX(acked_seq, excluded.acked_seq), last_seen_at = excluded.last_seen_at
+                    """,
+                    (owner_n, device_id, int(acked_seq), now.isoformat()),
+                )
+            break
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e).lower() and attempt < 3:
+                _sleep_on_lock(attempt, "device_ack")
+                continue
+            raise
+    _device_acks[key] = value
+
+
+@_db_timed
+def compact_tombstones(min_age_days: float = TOMBSTONE_MIN_AGE_DAYS, device_ttl_days: float = SYNC_DEVICE_TTL_DAYS) -> int:
+    """Delete tombstones every active device of their owner has acknowledged.
+
+    A tombstone goes once it is older than ``min_age_days`` and its change_seq
+    is at or below the lowest ``acked_seq`` among the owner's devices seen in
+    the last ``device_ttl_days``; devices idle for longer are forgotten first.
+    Owners without any registered device keep all their tombstones, since
+    older clients do not acknowledge. Returns the number of tombstones deleted.
+    """
+    now = datetime.utcnow()
+    age_cutoff = (now - timedelta(days=min_age_days)).isoformat()
+    seen_cutoff = (now - timedelta(days=device_ttl_days)).isoformat()
+    removed = forgotten = 0
+    owners = []
+    for path in database_paths():
+        with sqlite3.connect(path, timeout=30) as conn:
+            forgotten += conn.execute("DELETE FROM sync_devices WHERE last_seen_at < ?", (seen_cutoff,)).rowcount
+            for owner_n, min_ack in conn.execute(
+                "SELECT owner_email, MIN(acked_seq) FROM sync_devices GROUP BY owner_email"
+            ).fetchall():
+                n = conn.execute(
+                    "DELETE FROM deleted_files WHERE owner_email = ? AND id <= ? AND deleted_at < ?",
+                    (owner_n, min_ack, age_cutoff),
+                ).rowcount
+                if n:
+                    removed += n
+                    owners.append(owner_n)
+    for owner_n in owners:
+        _forget_tombstones(owner_n)
+    if forgotten:
+        _device_acks.clear()
+    logger.info("compact_tombstones: removed=%d owners=%d devices_forgotten=%d", removed, len(owners), forgotten)
+    return removed
+
+
 def is_file_deleted(file_id: str, owner_email: str | None = None) -> bool:
     owner_n = _normalize_email(owner_email) if owner_email else None
     if not owner_n:
         return False
-    actual = _extract_actual_filename((file_id or "").strip())
+    actual = extract_actual_filename((file_id or "").strip())
     return _is_actual_filename_deleted(actual, owner_n)
 
 
+@_db_timed
 def mark_file_deleted(file_id: str, owner_email: str | None = None) -> bool:
     owner_n = _normalize_email(owner_email) if owner_email else None
     if not owner_n:
@@ -209,7 +853,7 @@ def mark_file_deleted(file_id: str, owner_email: str | None = None) -> bool:
     if not target:
         return False
 
-    actual = _extract_actual_filename(target)
+    actual = extract_actual_filename(target)
     if not actual:
         return False
 
@@ -219,7 +863,7 @@ def mark_file_deleted(file_id: str, owner_email: str | None = None) -> bool:
 
     for attempt in range(4):
         try:
-            with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            with write_gate(owner_n), _connect(owner_n) as conn:
                 cursor = conn.cursor()
 
                 # Resolve all stored variants for this document.
@@ -243,22 +887,22 @@ def mark_file_deleted(file_id: str, owner_email: str | None = None) -> bool:
                     (owner_n, actual),
                 )
 
-                # Insert/update tombstone.
+                # Insert/update tombstone. REPLACE gives it a new id, i.e. a new
+                # change_seq, so devices that already synced see it again.
                 cursor.execute(
                     """
-                    INSERT INTO deleted_files (owner_email, actual_filename, deleted_at)
+                    INSERT OR REPLACE INTO deleted_files (owner_email, actual_filename, deleted_at)
                     VALUES (?, ?, ?)
-                    ON CONFLICT(owner_email, actual_filename)
-                    DO UPDATE SET deleted_at = excluded.deleted_at
                     """,
                     (owner_n, actual, now),
                 )
 
+            _forget_tombstones(owner_n)
             return True
         except sqlite3.OperationalError as e:
             if "locked" in str(e).lower() and attempt < 3:
                 logger.warning("DB locked on delete (attempt %d): owner=%s actual=%s", attempt + 1, owner_n, actual)
-                _sleep_on_lock(attempt)
+                _sleep_on_lock(attempt, "delete")
                 continue
             raise
 
@@ -279,6 +923,7 @@ def _hash_password(password: str, salt_hex: str) -> str:
     return dk.hex()
 
 
+@_db_timed
 def create_user(email: str, password: str) -> bool:
     email_n = _normalize_email(email)
     if not email_n or "@" not in email_n:
@@ -307,6 +952,7 @@ def create_user(email: str, password: str) -> bool:
         return False
 
 
+@_db_timed
 def verify_user(email: str, password: str) -> bool:
     email_n = _normalize_email(email)
     if not email_n or not isinstance(password, str):
@@ -330,6 +976,7 @@ def verify_user(email: str, password: str) -> bool:
     return ok
 
 
+@_db_timed
 def set_user_password(email: str, new_password: str) -> bool:
     email_n = _normalize_email(email)
     if not email_n or not isinstance(new_password, str) or len(new_password) < 8:
@@ -354,6 +1001,7 @@ def set_user_password(email: str, new_password: str) -> bool:
         return ok
 
 
+@_db_timed
 def user_exists(email: str) -> bool:
     email_n = _normalize_email(email)
     if not email_n:
@@ -364,6 +1012,7 @@ def user_exists(email: str) -> bool:
         return cursor.fetchone() is not None
 
 
+@_db_timed
 def create_password_reset(email: str, token_plain: str, expires_at_iso: str) -> bool:
     email_n = _normalize_email(email)
     if not email_n or not token_plain:
@@ -388,6 +1037,7 @@ def create_password_reset(email: str, token_plain: str, expires_at_iso: str) ->
         return False
 
 
+@_db_timed
 def consume_password_reset(email: str, token_plain: str) -> bool:
     """Mark a reset token as used if valid and unexpired."""
     email_n = _normalize_email(email)
@@ -431,11 +1081,228 @@ def consume_password_reset(email: str, token_plain: str) -> bool:
         return ok
 
 
-def _sleep_on_lock(attempt: int) -> None:
+# Sync writes queue here instead of in SQLite's busy handler, which polls with
+# growing sleeps and lets a writer starve under bursts. There is one gate per
+# database file (shard). The flock extends the queue across worker processes;
+# it is opened per process, since an inherited descriptor would share one lock
+# between all of them.
+_write_locks: dict[str, threading.Lock] = {}
+_write_gate_files: dict[str, tuple] = {}
+
+
+@contextlib.contextmanager
+def write_gate(owner_email=None, db=None):
+    """Hold the process-wide (and, on POSIX, cross-process) write lock of the
+    database holding ``owner_email``'s data (or of the file ``db``)."""
+    path = db or _db_path(owner_email)
+    with _write_locks.setdefault(path, threading.Lock()):
+        if fcntl is None:
+            yield
+            return
+        entry = _write_gate_files.get(path)
+        if entry is None or entry[0] != os.getpid():
+            entry = _write_gate_files[path] = (os.getpid(), open(path + ".write-lock", "a+b"))
+        fd = entry[1].fileno()
+        with tracing.span("db.write_gate"):
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _sleep_on_lock(attempt: int, operation: str = "") -> None:
     # Small exponential backoff to reduce lock contention during rapid sync bursts.
-    time.sleep(0.05 * (2**attempt))
+    DB_LOCK_RETRIES.inc(operation or "unknown")
+    with tracing.span("db.lock_wait"):
+        time.sleep(0.05 * (2**attempt))
+
+
+# ---- Blob store ---------------------------------------------------------------
+# With BLOB_STORE set, document bytes are written to the store (outside any
+# database transaction) before the row that references them commits. Objects
+# are shared by key (content hash and codec), so deleting one is coordinated
+# with uploads of the same content through blob_orphans, under the catalog
+# write gate. With BLOB_COMPRESSION set, documents worth it are compressed
+# first, wherever they are stored.
+
+
+def _object_key(content_hash, codec):
+    return content_hash + compression.SUFFIXES.get(codec, "")
+
+
+def _stored_file_data(data, content_hash, fmt=None):
+    """``(file_data, blob_store, blob_size, codec)`` column values for a document's bytes."""
+    if not data:
+        return data, None, None, None
+    stored, codec = compression.encode(data, fmt)
+    return _store_encoded(stored, codec, len(data), content_hash)
+
+
+def _store_encoded(stored, codec, size, content_hash):
+    """Like :func:`_stored_file_data`, for bytes already encoded with ``codec``."""
+    store = storage.store()
+    if store is None:
+        return stored, None, (size if codec else None), codec
+    key = _object_key(content_hash, codec)
+    with write_gate(), sqlite3.connect(DB_PATH, timeout=30) as conn:
+        # Claimed by a file again: the sweep must not delete it now.
+        conn.execute("DELETE FROM blob_orphans WHERE content_hash = ?", (key,))
+    # Outside the gate (the store may be a network away): once the claim has
+    # committed, the sweep no longer deletes the object, and if it already
+    # did, exists() says so and it is stored again.
+    if not store.exists(key):
+        with tracing.span("blob_store.put"):
+            store.put(key, stored)
+    return b"", store.name, size, codec
+
+
+def _blob_store(name):
+    """The store holding documents whose ``blob_store`` column is ``name``."""
+    store = storage.store()
+    if store is None or store.name != name:
+        raise storage.StorageError(f"Document is in the {name!r} blob store, but BLOB_STORE={storage.BLOB_STORE!r}")
+    return store
+
+
+def _read_document(file_data, name, content_hash, codec):
+    """A document's original bytes from its ``files`` columns."""
+    if name:
+        file_data = _blob_store(name).get(_object_key(content_hash, codec))
+    return compression.decode(file_data, codec)
+
+
+@contextlib.contextmanager
+def _open_document(conn, rowid, name, content_hash, codec, size):
+    """Open a document for reading its original bytes, from ``file_data`` or the blob store."""
+    if name:
+        # Stored objects are immutable: as consistent as the snapshot.
+        raw = _blob_store(name).open(_object_key(content_hash, codec))
+    else:
+        raw = conn.blobopen("files", "file_data", rowid, readonly=True)
+    with raw:
+        yield compression.DecodedFile(raw, codec, size) if codec else raw
+
+
+@_db_timed
+def move_to_blob_store(limit=20, db=None):
+    """Move up to ``limit`` documents from ``file_data`` to the blob store. Returns their sizes."""
+    path = db or DB_PATH
+    with sqlite3.connect(path, timeout=30) as conn:
+        ids = [
+            r[0]
+            for r in conn.execute(
+                "SELECT id FROM files WHERE blob_store IS NULL AND content_hash IS NOT NULL AND length(file_data) > 0 LIMIT ?",
+                (int(limit),),
+            )
+        ]
+    sizes = []
+    for rowid in ids:
+        with sqlite3.connect(path, timeout=30) as conn:
+            row = conn.execute("SELECT file_data, content_hash, codec FROM files WHERE id = ?", (rowid,)).fetchone()
+        if row is None:
+            continue
+        stored, content_hash, codec = row
+        data = compression.decode(stored, codec)
+        if hashlib.sha256(data).hexdigest() != content_hash:
+            logger.error("move_to_blob_store: content hash mismatch, left in SQLite: db=%s id=%s", path, rowid)
+            continue
+        # Moved in its stored form: "compression.py --compress" changes the codec.
+        file_data, name, size, codec = _store_encoded(stored, codec, len(data), content_hash)
+        with write_gate(db=path), sqlite3.connect(path, timeout=30) as conn:
+            # Skipped if the file was re-uploaded meanwhile.
+            conn.execute(
+                """
+                UPDATE files SET file_data = ?, blob_store = ?, blob_size = ?, codec = ?
+                WHERE id = ? AND content_hash = ? AND blob_store IS NULL
+                """,
+                (file_data, name, size, codec, rowid, content_hash),
+            )
+        sizes.append(size)
+    if ids:
+        logger.info("move_to_blob_store: db=%s count=%d", path, len(sizes))
+    return sizes
+
+
+@_db_timed
+def recompress_documents(after_id=0, limit=20, db=None):
+    """Store documents with ``id > after_id`` again under the current BLOB_COMPRESSION setting.
+
+    Looks at up to ``limit`` documents; those whose codec would not change are
+    left alone. Returns ``(last id looked at, or None when done, [(original
+    size, stored size)] of the documents stored again)``.
+    """
+    path = db or DB_PATH
+    with sqlite3.connect(path, timeout=30) as conn:
+        ids = [
+            r[0]
+            for r in conn.execute(
+                "SELECT id FROM files WHERE id > ? AND content_hash IS NOT NULL ORDER BY id LIMIT ?",
+                (int(after_id), int(limit)),
+            )
+        ]
+    done = []
+    for rowid in ids:
+        with sqlite3.connect(path, timeout=30) as conn:
+            row = conn.execute(
+                "SELECT file_data, blob_store, content_hash, codec, format FROM files WHERE id = ?", (rowid,)
+            ).fetchone()
+        if row is None:
+            continue
+        file_data, name, content_hash, codec, fmt = row
+        data = _read_document(file_data, name, content_hash, codec)
+        if compression.choose(data, fmt) == codec:
+            continue
+        if hashlib.sha256(data).hexdigest() != content_hash:
+            logger.error("recompress_documents: content hash mismatch, left as is: db=%s id=%s", path, rowid)
+            continue
+        stored, new_codec = compression.encode(data, fmt)
+        if new_codec == codec:
+            continue
+        file_data, name, size, _ = _store_encoded(stored, new_codec, len(data), content_hash)
+        with write_gate(db=path), sqlite3.connect(path, timeout=30) as conn:
+            # Skipped if the file was re-uploaded meanwhile. The old object, if
+            # any, is left to the maintenance sweep.
+            conn.execute(
+                "UPDATE files SET file_data = ?, blob_store = ?, blob_size = ?, codec = ? WHERE id = ? AND content_hash = ?",
+                (file_data, name, size, new_codec, rowid, content_hash),
+            )
+        done.append((len(data), len(stored)))
+    if done:
+        logger.info("recompress_documents: db=%s count=%d", path, len(done))
+    return (ids[-1] if ids else None), done
+
+
+@_db_timed
+def expire_blob_orphans(unreferenced, grace_seconds):
+    """Record since when each stored object in ``unreferenced`` has had no file.
+
+    Returns the ones unreferenced for at least ``grace_seconds``.
+    """
+    now = time.time()
+    with write_gate(), sqlite3.connect(DB_PATH, timeout=30) as conn:
+        known = dict(conn.execute("SELECT content_hash, since FROM blob_orphans"))
+        conn.executemany("DELETE FROM blob_orphans WHERE content_hash = ?", [(h,) for h in known if h not in unreferenced])
+        conn.executemany(
+            "INSERT INTO blob_orphans (content_hash, since) VALUES (?, ?)", [(h, now) for h in unreferenced if h not in known]
+        )
+    return {h for h, since in known.items() if h in unreferenced and now - since >= grace_seconds}
+
 
+@_db_timed
+def delete_orphan_blob(key, grace_seconds):
+    """Delete a stored object if it is still an expired orphan. Returns whether it was deleted."""
+    store = storage.store()
+    with write_gate(), sqlite3.connect(DB_PATH, timeout=30) as conn:
+        claimed = conn.execute(
+            "DELETE FROM blob_orphans WHERE content_hash = ? AND since <= ?", (key, time.time() - grace_seconds)
+        ).rowcount
+        if claimed and store is not None:
+            store.delete(key)
+    return bool(claimed and store is not None)
 
+
+@_db_timed
 def add_file(title, filename, format, voice=None):
     """Add a new file to the database.
     
@@ -479,6 +1346,7 @@ def add_file(title, filename, format, voice=None):
     return file_id
 
 
+@_db_timed
 def update_position(file_id, position):
     """Update the reading position for a file.
     
@@ -505,13 +1373,14 @@ def update_position(file_id, position):
     return rows_affected > 0
 
 
+@_db_timed
 def get_files(owner_email=None):
     """Get all files from the database (without file data).
     
     Returns:
         List of dictionaries containing file information (excluding file_data)
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(owner_email)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -520,15 +1389,19 @@ def get_files(owner_email=None):
         cursor.execute(
             """
             SELECT
-                filename, title, format, reading_position, voice,
-                created_at,
-                COALESCE(updated_at, created_at) AS updated_at,
-                COALESCE(position_updated_at, created_at) AS position_updated_at,
-                COALESCE(highlights_updated_at, created_at) AS highlights_updated_at,
-                COALESCE(voice_updated_at, created_at) AS voice_updated_at
-            FROM files
-            WHERE owner_email = ?
-            ORDER BY created_at DESC
+                f.filename, f.title, f.format, f.reading_position, f.voice,
+                f.created_at,
+                COALESCE(f.updated_at, f.created_at) AS updated_at,
+                COALESCE(f.position_updated_at, f.created_at) AS position_updated_at,
+                COALESCE(f.highlights_updated_at, f.created_at) AS highlights_updated_at,
+                COALESCE(f.voice_updated_at, f.created_at) AS voice_updated_at,
+                f.content_hash,
+                m.authors, m.language,
+                m.cover IS NOT NULL AS has_cover
+            FROM files f
+            LEFT JOIN file_metadata m ON m.file_id = f.id AND m.content_hash = f.content_hash
+            WHERE f.owner_email = ?
+            ORDER BY f.created_at DESC
             """,
             (owner_n,),
         )
@@ -536,25 +1409,35 @@ def get_files(owner_email=None):
         cursor.execute(
             """
             SELECT
-                filename, title, format, reading_position, voice,
-                created_at,
-                COALESCE(updated_at, created_at) AS updated_at,
-                COALESCE(position_updated_at, created_at) AS position_updated_at,
-                COALESCE(highlights_updated_at, created_at) AS highlights_updated_at,
-                COALESCE(voice_updated_at, created_at) AS voice_updated_at
-            FROM files
-            ORDER BY created_at DESC
+                f.filename, f.title, f.format, f.reading_position, f.voice,
+                f.created_at,
+                COALESCE(f.updated_at, f.created_at) AS updated_at,
+                COALESCE(f.position_updated_at, f.created_at) AS position_updated_at,
+                COALESCE(f.highlights_updated_at, f.created_at) AS highlights_updated_at,
+                COALESCE(f.voice_updated_at, f.created_at) AS voice_updated_at,
+                f.content_hash,
+                m.authors, m.language,
+                m.cover IS NOT NULL AS has_cover
+            FROM files f
+            LEFT JOIN file_metadata m ON m.file_id = f.id AND m.content_hash = f.content_hash
+            ORDER BY f.created_at DESC
             """
         )
     
     rows = cursor.fetchall()
     conn.close()
     
-    files = [dict(row) for row in rows]
+    files = []
+    for row in rows:
+        item = dict(row)
+        item["authors"] = json.loads(item["authors"]) if item["authors"] else []
+        item["has_cover"] = bool(item["has_cover"])
+        files.append(item)
     logger.info("get_files: owner=%s count=%d", owner_n or "*", len(files))
     return files
 
 
+@_db_timed
 def get_file_blob(file_id, owner_email=None):
     """Get the file blob data for a specific file by file_id.
     
@@ -564,14 +1447,14 @@ def get_file_blob(file_id, owner_email=None):
     Returns:
         Binary file data or None if not found
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(owner_email)
     cursor = conn.cursor()
     
     owner_n = _normalize_email(owner_email) if owner_email else None
     if owner_n:
         cursor.execute(
             """
-            SELECT file_data
+            SELECT file_data, blob_store, content_hash, codec
             FROM files
             WHERE filename = ? AND owner_email = ?
             """,
@@ -580,7 +1463,7 @@ def get_file_blob(file_id, owner_email=None):
     else:
         cursor.execute(
             """
-            SELECT file_data
+            SELECT file_data, blob_store, content_hash, codec
             FROM files
             WHERE filename = ?
             """,
@@ -590,9 +1473,10 @@ def get_file_blob(file_id, owner_email=None):
     row = cursor.fetchone()
     conn.close()
     logger.info("get_file_blob: owner=%s file_id=%s hit=%s", owner_n or "*", file_id, bool(row))
-    return row[0] if row else None
+    return _read_document(*row) if row else None
 
 
+@_db_timed
 def get_file_data(file_id, owner_email=None):
     """Get file metadata by filename (file_id).
 
@@ -602,7 +1486,7 @@ def get_file_data(file_id, owner_email=None):
     Returns:
         Dict-like row with metadata, or None.
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(owner_email)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
 
@@ -644,6 +1528,7 @@ def get_file_data(file_id, owner_email=None):
     return dict(row) if row else None
 
 
+@_db_timed
 def file_exists(file_id, owner_email=None):
     """Check if a file exists by file_id (filename).
     
@@ -653,7 +1538,7 @@ def file_exists(file_id, owner_email=None):
     Returns:
         True if file exists, False otherwise
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(owner_email)
     cursor = conn.cursor()
     
     owner_n = _normalize_email(owner_email) if owner_email else None
@@ -674,6 +1559,7 @@ def file_exists(file_id, owner_email=None):
     return count > 0
 
 
+@_db_timed
 def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=None):
     """Add or update a file in the database.
     
@@ -689,9 +1575,10 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
     """
     created_at = datetime.utcnow().isoformat()
     updated_at = created_at
+    content_hash = hashlib.sha256(file_data).hexdigest() if file_data else None
 
     owner_n = _normalize_email(owner_email) if owner_email else None
-    actual_filename = _extract_actual_filename(file_id)
+    actual_filename = extract_actual_filename(file_id)
 
     if owner_n and _is_actual_filename_deleted(actual_filename, owner_n):
         logger.info("add_file_with_id: rejected (tombstoned) owner=%s actual=%s", owner_n, actual_filename)
@@ -705,10 +1592,11 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
         (len(file_data) if file_data else 0),
         format,
     )
-    
+    file_data, blob_store, blob_size, codec = _stored_file_data(file_data, content_hash, format)
+
     for attempt in range(4):
         try:
-            with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            with write_gate(owner_email), _connect(owner_email) as conn:
                 cursor = conn.cursor()
 
                 # Check if file already exists
@@ -729,6 +1617,10 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
                             SET
                                 title = ?,
                                 file_data = ?,
+                                content_hash = ?,
+                                blob_store = ?,
+                                blob_size = ?,
+                                codec = ?,
                                 format = ?,
                                 actual_filename = ?,
                                 voice = COALESCE(?, voice),
@@ -736,7 +1628,10 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
                                 voice_updated_at = CASE WHEN ? IS NOT NULL THEN ? ELSE voice_updated_at END
                             WHERE filename = ? AND owner_email = ?
                             """,
-                            (title, file_data, format, actual_filename, voice, updated_at, voice, updated_at, file_id, owner_n),
+                            (
+                                title, file_data, content_hash, blob_store, blob_size, codec, format, actual_filename,
+                                voice, updated_at, voice, updated_at, file_id, owner_n,
+                            ),
                         )
                     else:
                         cursor.execute(
@@ -745,6 +1640,10 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
                         SET
                             title = ?,
                             file_data = ?,
+                            content_hash = ?,
+                            blob_store = ?,
+                            blob_size = ?,
+                            codec = ?,
                             format = ?,
                             actual_filename = ?,
                             voice = COALESCE(?, voice),
@@ -752,7 +1651,10 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
                             voice_updated_at = CASE WHEN ? IS NOT NULL THEN ? ELSE voice_updated_at END
                         WHERE filename = ?
                         """,
-                        (title, file_data, format, actual_filename, voice, updated_at, voice, updated_at, file_id),
+                        (
+                            title, file_data, content_hash, blob_store, blob_size, codec, format, actual_filename,
+                            voice, updated_at, voice, updated_at, file_id,
+                        ),
                     )
                 else:
                     logger.info("add_file_with_id: insert owner=%s file_id=%s", owner_n or "*", file_id)
@@ -762,9 +1664,9 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
                         INSERT INTO files (
                             title, filename, format, file_data, reading_position, voice,
                             created_at, updated_at, position_updated_at, highlights_updated_at, voice_updated_at,
-                            owner_email, actual_filename
+                            owner_email, actual_filename, content_hash, blob_store, blob_size, codec
                         )
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                         """,
                         (
                             title,
@@ -780,6 +1682,10 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
                             updated_at,
                             owner_n,
                             actual_filename,
+                            content_hash,
+                            blob_store,
+                            blob_size,
+                            codec,
                         ),
                     )
 
@@ -787,13 +1693,14 @@ def add_file_with_id(file_id, title, file_data, format, voice=None, owner_email=
         except sqlite3.OperationalError as e:
             if "locked" in str(e).lower() and attempt < 3:
                 logger.warning("DB locked on upsert (attempt %d): owner=%s file_id=%s", attempt + 1, owner_n or "*", file_id)
-                _sleep_on_lock(attempt)
+                _sleep_on_lock(attempt, "upsert")
                 continue
             raise
     
     return file_id
 
 
+@_db_timed
 def update_position_by_file_id(file_id, position, owner_email=None):
     """Update the reading position for a file by file_id.
     
@@ -808,7 +1715,7 @@ def update_position_by_file_id(file_id, position, owner_email=None):
 
     for attempt in range(4):
         try:
-            with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            with write_gate(owner_email), _connect(owner_email) as conn:
                 cursor = conn.cursor()
                 owner_n = _normalize_email(owner_email) if owner_email else None
                 if owner_n:
@@ -831,16 +1738,17 @@ def update_position_by_file_id(file_id, position, owner_email=None):
                     )
                 rows_affected = cursor.rowcount
             ok = rows_affected > 0
-            logger.info("update_position: owner=%s file_id=%s ok=%s", owner_n or "*", file_id, ok)
+            position_logger.info("update_position: owner=%s file_id=%s ok=%s", owner_n or "*", file_id, ok)
             return ok
         except sqlite3.OperationalError as e:
             if "locked" in str(e).lower() and attempt < 3:
                 logger.warning("DB locked on update_position (attempt %d): owner=%s file_id=%s", attempt + 1, owner_n or "*", file_id)
-                _sleep_on_lock(attempt)
+                _sleep_on_lock(attempt, "update_position")
                 continue
             raise
 
 
+@_db_timed
 def update_voice_by_file_id(file_id, voice, owner_email=None):
     """Update the voice for a file by file_id.
     
@@ -855,7 +1763,7 @@ def update_voice_by_file_id(file_id, voice, owner_email=None):
 
     for attempt in range(4):
         try:
-            with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            with write_gate(owner_email), _connect(owner_email) as conn:
                 cursor = conn.cursor()
                 owner_n = _normalize_email(owner_email) if owner_email else None
                 if owner_n:
@@ -883,11 +1791,26 @@ def update_voice_by_file_id(file_id, voice, owner_email=None):
         except sqlite3.OperationalError as e:
             if "locked" in str(e).lower() and attempt < 3:
                 logger.warning("DB locked on update_voice (attempt %d): owner=%s file_id=%s", attempt + 1, owner_n or "*", file_id)
-                _sleep_on_lock(attempt)
+                _sleep_on_lock(attempt, "update_voice")
                 continue
             raise
 
 
+def _coerce_sentence_index(h):
+    if not isinstance(h, dict):
+        return None
+    idx = h.get("sentenceIndex")
+    if idx is None:
+        idx = h.get("sentence_index")
+    if idx is None:
+        return None
+    try:
+        return int(idx)
+    except (TypeError, ValueError):
+        return None
+
+
+@_db_timed
 def update_highlights(file_id, highlights, owner_email=None):
     """Update highlights for a file.
     
@@ -900,22 +1823,9 @@ def update_highlights(file_id, highlights, owner_email=None):
     """
     created_at = datetime.utcnow().isoformat()
 
-    def _coerce_sentence_index(h):
-        if not isinstance(h, dict):
-            return None
-        idx = h.get("sentenceIndex")
-        if idx is None:
-            idx = h.get("sentence_index")
-        if idx is None:
-            return None
-        try:
-            return int(idx)
-        except (TypeError, ValueError):
-            return None
-
     for attempt in range(4):
         try:
-            with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            with write_gate(owner_email), _connect(owner_email) as conn:
                 cursor = conn.cursor()
 
                 owner_n = _normalize_email(owner_email) if owner_email else None
@@ -979,11 +1889,12 @@ def update_highlights(file_id, highlights, owner_email=None):
             if "locked" in str(e).lower() and attempt < 3:
                 owner_n = _normalize_email(owner_email) if owner_email else None
                 logger.warning("DB locked on update_highlights (attempt %d): owner=%s file_id=%s", attempt + 1, owner_n or "*", file_id)
-                _sleep_on_lock(attempt)
+                _sleep_on_lock(attempt, "update_highlights")
                 continue
             raise
 
 
+@_db_timed
 def get_highlights(file_id, owner_email=None):
     """Get highlights for a file.
     
@@ -993,7 +1904,7 @@ def get_highlights(file_id, owner_email=None):
     Returns:
         List of highlight dictionaries
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(owner_email)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -1028,11 +1939,738 @@ def get_highlights(file_id, owner_email=None):
     return out
 
 
-if __name__ == "__main__":
-    log_level = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
-    logging.basicConfig(
-        level=getattr(logging, log_level, logging.INFO),
-        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+@_db_timed
+def get_file_content_info(file_id, owner_email=None):
+    """Return (content_hash, size in bytes) of a stored document, or None."""
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    with _connect(owner_n) as conn:
+        if owner_n:
+            row = conn.execute(
+                "SELECT content_hash, COALESCE(blob_size, length(file_data)) FROM files WHERE filename = ? AND owner_email = ?",
+                (file_id, owner_n),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT content_hash, COALESCE(blob_size, length(file_data)) FROM files WHERE filename = ?", (file_id,)
+            ).fetchone()
+    return (row[0], row[1] or 0) if row else None
+
+
+@_db_timed
+def referenced_content_hashes():
+    """Every content_hash still used by a stored file."""
+    hashes = set()
+    for path in database_paths():
+        with sqlite3.connect(path, timeout=30) as conn:
+            hashes.update(r[0] for r in conn.execute("SELECT DISTINCT content_hash FROM files WHERE content_hash IS NOT NULL"))
+    return hashes
+
+
+@_db_timed
+def referenced_object_keys():
+    """Every blob store object key (see :func:`_object_key`) still used by a stored file."""
+    keys = set()
+    for path in database_paths():
+        with sqlite3.connect(path, timeout=30) as conn:
+            keys.update(
+                _object_key(content_hash, codec)
+                for content_hash, codec in conn.execute(
+                    "SELECT DISTINCT content_hash, codec FROM files WHERE blob_store IS NOT NULL AND content_hash IS NOT NULL"
+                )
+            )
+    return keys
+
+
+# Lookups refresh an entry's LRU position at most this often.
+TTS_AUDIO_TOUCH_SECONDS = 3600
+
+
+@_db_timed
+def store_tts_audio(owner_email: str, voice: str, speed: str, text_hash: str, audio_hash: str, size: int) -> None:
+    owner_n = _normalize_email(owner_email)
+    now = time.time()
+    with write_gate(), sqlite3.connect(DB_PATH, timeout=30) as conn:
+        conn.execute(
+            """
+            INSERT INTO tts_audio (voice, speed, text_hash, owner_email, audio_hash, size, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(voice, speed, text_hash, owner_email)
+            DO UPDATE SET audio_hash = excluded.audio_hash, size = excluded.size, last_used_at = excluded.last_used_at
+            """,
+            (voice, speed, text_hash, owner_n, audio_hash, int(size), datetime.utcnow().isoformat(), now),
+        )
+
+
+@_db_timed
+def lookup_tts_audio(owner_email: str | None, voice: str, speed: str, text_hashes: list[str]) -> dict:
+    """``{text_hash: (audio_hash, size)}`` for the cached ones; ``owner_email=None`` searches every user's audio."""
+    if not text_hashes:
+        return {}
+    where = f"voice = ? AND speed = ? AND text_hash IN ({','.join('?' * len(text_hashes))})"
+    params = [voice, speed, *text_hashes]
+    if owner_email is not None:
+        where += " AND owner_email = ?"
+        params.append(_normalize_email(owner_email))
+    now = time.time()
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        found, stale = {}, False
+        # Most recently used last, so that copy wins when several users cached one sentence.
+        for text_hash, audio_hash, size, last_used_at in conn.execute(
+            f"SELECT text_hash, audio_hash, size, last_used_at FROM tts_audio WHERE {where} ORDER BY last_used_at",
+            params,
+        ):
+            found[text_hash] = (audio_hash, size)
+            stale = stale or last_used_at < now - TTS_AUDIO_TOUCH_SECONDS
+        if stale:
+            # Coarse LRU: no write when the entries were used recently.
+            with write_gate():
+                conn.execute(
+                    f"UPDATE tts_audio SET last_used_at = ? WHERE {where} AND last_used_at < ?",
+                    [now, *params, now - TTS_AUDIO_TOUCH_SECONDS],
+                )
+                conn.commit()
+    return found
+
+
+def _evict_rows(conn, where: str, params: tuple, excess: int, dropped: set) -> None:
+    """Delete least recently used ``tts_audio`` rows matching ``where`` until ``excess`` bytes are gone."""
+    freed, rowids = 0, []
+    for rowid, size, audio_hash in conn.execute(
+        f"SELECT rowid, size, audio_hash FROM tts_audio WHERE {where} ORDER BY last_used_at", params
+    ):
+        if freed >= excess:
+            break
+        rowids.append((rowid,))
+        dropped.add(audio_hash)
+        freed += size
+    conn.executemany("DELETE FROM tts_audio WHERE rowid = ?", rowids)
+
+
+@_db_timed
+def evict_tts_audio(max_bytes: int, user_max_bytes: int) -> set[str]:
+    """Trim the audio cache to the per-user and global limits, least recently used first.
+
+    Each bound is trimmed to 90% so the next eviction isn't due right away.
+    Returns the audio hashes no entry refers to any more (their files can go).
+    """
+    dropped = set()
+    with write_gate(), sqlite3.connect(DB_PATH, timeout=30) as conn:
+        if user_max_bytes > 0:
+            over = conn.execute(
+                "SELECT owner_email, SUM(size) FROM tts_audio GROUP BY owner_email HAVING SUM(size) > ?",
+                (user_max_bytes,),
+            ).fetchall()
+            for owner_n, total in over:
+                _evict_rows(conn, "owner_email = ?", (owner_n,), total - int(user_max_bytes * 0.9), dropped)
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM tts_audio").fetchone()[0]
+        if max_bytes > 0 and total > max_bytes:
+            _evict_rows(conn, "1", (), total - int(max_bytes * 0.9), dropped)
+        # Audio is deduplicated across users: keep files another entry still uses.
+        return {
+            h for h in dropped
+            if conn.execute("SELECT 1 FROM tts_audio WHERE audio_hash = ? LIMIT 1", (h,)).fetchone() is None
+        }
+
+
+def referenced_tts_audio() -> set[str]:
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        return {r[0] for r in conn.execute("SELECT DISTINCT audio_hash FROM tts_audio")}
+
+
+# The _open_document arguments of a files row.
+_DOCUMENT_COLUMNS = "id, blob_store, content_hash, codec, COALESCE(blob_size, length(file_data))"
+
+
+@contextlib.contextmanager
+def _open_blob(log_name, query, params, path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        row = conn.execute(query, params).fetchone()
+        logger.info("%s: %s hit=%s", log_name, params, bool(row))
+        if row is None:
+            yield None
+            return
+        with _open_document(conn, *row) as blob:
+            yield blob
+    finally:
+        conn.close()
+
+
+def open_file_blob(file_id, owner_email=None):
+    """Open a stored document for reading in chunks instead of loading it whole.
+
+    Yields a read-only ``sqlite3.Blob`` (``len(blob)`` is its size), or None if
+    the file does not exist. The handle reads from one snapshot: a concurrent
+    re-upload does not change the bytes mid-stream. Compressed documents come
+    as a :class:`compression.DecodedFile`, which reads the original bytes.
+    """
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    if owner_n:
+        return _open_blob(
+            "open_file_blob",
+            f"SELECT {_DOCUMENT_COLUMNS} FROM files WHERE filename = ? AND owner_email = ?",
+            (file_id, owner_n),
+            _db_path(owner_n),
+        )
+    return _open_blob(
+        "open_file_blob", f"SELECT {_DOCUMENT_COLUMNS} FROM files WHERE filename = ?", (file_id,), DB_PATH
     )
+
+
+def open_blob_by_hash(content_hash):
+    """Like :func:`open_file_blob`, for any stored file with this content_hash."""
+    query = f"SELECT {_DOCUMENT_COLUMNS} FROM files WHERE content_hash = ? LIMIT 1"
+    paths = database_paths()
+    for path in paths[:-1]:
+        with sqlite3.connect(path, timeout=30) as conn:
+            if conn.execute(query, (content_hash,)).fetchone():
+                return _open_blob("open_blob_by_hash", query, (content_hash,), path)
+    return _open_blob("open_blob_by_hash", query, (content_hash,), paths[-1])
+
+
+@contextlib.contextmanager
+def library_snapshot(owner_email):
+    """Pin a read snapshot of one owner's library for export.
+
+    Yields ``(files, read_blob)``: ``files`` has the :func:`get_files` fields of
+    every document plus ``rowid``, ``size`` and its ``highlights``, and
+    ``read_blob(rowid, chunk_size)`` iterates over a document's bytes from the
+    same snapshot, so the archive matches its manifest.
+    """
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    conn = _connect(owner_n, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("BEGIN")
+        rows = conn.execute(
+            """
+            SELECT
+                f.id AS rowid, f.filename, f.title, f.format, f.reading_position, f.voice,
+                f.created_at,
+                COALESCE(f.updated_at, f.created_at) AS updated_at,
+                COALESCE(f.position_updated_at, f.created_at) AS position_updated_at,
+                COALESCE(f.highlights_updated_at, f.created_at) AS highlights_updated_at,
+                COALESCE(f.voice_updated_at, f.created_at) AS voice_updated_at,
+                f.content_hash,
+                m.authors, m.language,
+                COALESCE(f.blob_size, length(f.file_data)) AS size
+            FROM files f
+            LEFT JOIN file_metadata m ON m.file_id = f.id AND m.content_hash = f.content_hash
+            WHERE f.owner_email IS ?
+            ORDER BY f.created_at
+            """,
+            (owner_n,),
+        ).fetchall()
+        files = []
+        by_scoped_id = {}
+        for row in rows:
+            item = dict(row)
+            item["authors"] = json.loads(item["authors"]) if item["authors"] else []
+            item["highlights"] = []
+            files.append(item)
+            by_scoped_id[f"{owner_n}::{item['filename']}" if owner_n else item["filename"]] = item
+
+        for h in conn.execute(
+            """
+            SELECT file_id, sentence_index, color, text, comment
+            FROM highlights
+            WHERE owner_email IS ?
+            ORDER BY file_id, sentence_index
+            """,
+            (owner_n,),
+        ):
+            item = by_scoped_id.get(h["file_id"])
+            if item is not None:
+                item["highlights"].append(
+                    {"sentence_index": h["sentence_index"], "color": h["color"], "text": h["text"], "comment": h["comment"]}
+                )
+        logger.info("library_snapshot: owner=%s files=%d", owner_n or "*", len(files))
+
+        def read_blob(rowid, chunk_size=256 * 1024):
+            row = conn.execute(f"SELECT {_DOCUMENT_COLUMNS} FROM files WHERE id = ?", (rowid,)).fetchone()
+            if row[1] and not row[3]:
+                yield from _blob_store(row[1]).stream(row[2], chunk_size=chunk_size)
+                return
+            with _open_document(conn, *row) as blob:
+                while True:
+                    chunk = blob.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        yield files, read_blob
+    finally:
+        conn.close()
+
+
+@_db_timed
+def import_files(entries, owner_email=None, replace=False):
+    """Store a batch of documents with their positions and highlights in one transaction.
+
+    Args:
+        entries: Dicts with file_id, title, format and file_data, and optionally
+            voice, reading_position, highlights and the *_at timestamps
+        replace: Overwrite documents that already exist instead of skipping them
+
+    Returns:
+        Counts: imported, replaced, skipped (already present), deleted (tombstoned)
+    """
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    now = datetime.utcnow().isoformat()
+
+    def _stamp(entry, key):
+        value = entry.get(key)
+        return value if isinstance(value, str) and value else now
+
+    # (content_hash, file_data, blob_store, blob_size, codec) per entry, stored before the transaction.
+    stored = []
+    for entry in entries:
+        content_hash = hashlib.sha256(entry["file_data"]).hexdigest()
+        stored.append((content_hash, *_stored_file_data(entry["file_data"], content_hash, entry["format"])))
+
+    for attempt in range(4):
+        counts = {"imported": 0, "replaced": 0, "skipped": 0, "deleted": 0}
+        try:
+            with write_gate(owner_n), _connect(owner_n) as conn:
+                cursor = conn.cursor()
+                for entry, (content_hash, file_data, blob_store, blob_size, codec) in zip(entries, stored):
+                    file_id = entry["file_id"]
+                    actual = extract_actual_filename(file_id)
+                    if _is_actual_filename_deleted(actual, owner_n):
+                        counts["deleted"] += 1
+                        continue
+
+                    existing = cursor.execute(
+                        "SELECT id FROM files WHERE filename = ? AND owner_email IS ?", (file_id, owner_n)
+                    ).fetchone()
+                    if existing and not replace:
+                        counts["skipped"] += 1
+                        continue
+
+                    values = (
+                        entry["title"],
+                        entry["format"],
+                        file_data,
+                        content_hash,
+                        blob_store,
+                        blob_size,
+                        codec,
+                        actual,
+                        entry.get("reading_position"),
+                        entry.get("voice"),
+                        _stamp(entry, "updated_at"),
+                        _stamp(entry, "position_updated_at"),
+                        _stamp(entry, "highlights_updated_at"),
+                        _stamp(entry, "voice_updated_at"),
+                    )
+                    if existing:
+                        cursor.execute(
+                            """
+                            UPDATE files
+                            SET title = ?, format = ?, file_data = ?, content_hash = ?, blob_store = ?, blob_size = ?,
+                                codec = ?, actual_filename = ?,
+                                reading_position = ?, voice = ?, updated_at = ?, position_updated_at = ?,
+                                highlights_updated_at = ?, voice_updated_at = ?
+                            WHERE id = ?
+                            """,
+                            values + (existing[0],),
+                        )
+                        counts["replaced"] += 1
+                    else:
+                        cursor.execute(
+                            """
+                            INSERT INTO files (
+                                title, format, file_data, content_hash, blob_store, blob_size, codec, actual_filename,
+                                reading_position, voice, updated_at, position_updated_at,
+                                highlights_updated_at, voice_updated_at,
+                                filename, owner_email, created_at
+                            )
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            """,
+                            values + (file_id, owner_n, _stamp(entry, "created_at")),
+                        )
+                        counts["imported"] += 1
+
+                    scoped_file_id = f"{owner_n}::{file_id}" if owner_n else file_id
+                    cursor.execute(
+                        "DELETE FROM highlights WHERE file_id = ? AND owner_email IS ?", (scoped_file_id, owner_n)
+                    )
+                    rows = []
+                    for h in entry.get("highlights") or ():
+                        sentence_index = _coerce_sentence_index(h)
+                        if sentence_index is None:
+                            continue
+                        rows.append(
+                            (
+                                scoped_file_id,
+                                sentence_index,
+                                h.get("color") or "#ffda76",
+                                h.get("text") or "",
+                                h.get("comment") or "",
+                                now,
+                                owner_n,
+                            )
+                        )
+                    cursor.executemany(
+                        """
+                        INSERT INTO highlights (file_id, sentence_index, color, text, comment, created_at, owner_email)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        rows,
+                    )
+            logger.info("import_files: owner=%s %s", owner_n or "*", counts)
+            return counts
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e).lower() and attempt < 3:
+                logger.warning("DB locked on import (attempt %d): owner=%s", attempt + 1, owner_n or "*")
+                _sleep_on_lock(attempt, "import")
+                continue
+            raise
+
+
+class SearchUnavailable(RuntimeError):
+    pass
+
+
+_FTS_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _fts_match_expression(query: str, owner_n: str, columns: str) -> str | None:
+    """Turn free text into a safe FTS5 expression scoped to one owner.
+
+    Every word must match in ``columns``, the last one as a prefix.
+    """
+    terms = _FTS_TERM_RE.findall(query or "")[:16]
+    if not terms:
+        return None
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    owner_key = owner_n.encode("utf-8").hex().upper()
+    return f"owner_key : {owner_key} AND {{{columns}}} : (" + " AND ".join(quoted) + ")"
+
+
+@_db_timed
+def search_highlights(query, owner_email, file_id=None, limit=20, offset=0):
+    """Ranked full-text search over an owner's highlight text and comments.
+
+    Args:
+        query: Free text; each word must match, the last one as a prefix
+        owner_email: Owner to scope the search to (required)
+        file_id: Optional file identifier (filename) to restrict results to
+        limit: Page size
+        offset: Number of results to skip
+
+    Returns:
+        (results, has_more) where results is a list of highlight dicts with a
+        ``snippet`` (matches wrapped in <mark></mark>) and ``score`` (lower is better)
+    """
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    match = _fts_match_expression(query, owner_n, "text comment") if owner_n else None
+    if not match:
+        return [], False
+
+    params = [match, owner_n]
+    file_clause = ""
+    if file_id:
+        file_clause = "AND h.file_id = ?"
+        params.append(f"{owner_n}::{file_id}")
+    params.extend([int(limit) + 1, int(offset)])
+
+    with _connect(owner_n) as conn:
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(
+                f"""
+                SELECT
+                    h.file_id, h.sentence_index, h.color, h.text, h.comment, h.created_at,
+                    snippet(highlights_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet,
+                    bm25(highlights_fts, 1.0, 0.5, 0.0) AS score
+                FROM highlights_fts
+                JOIN highlights h ON h.id = highlights_fts.rowid
+                WHERE highlights_fts MATCH ? AND h.owner_email = ? {file_clause}
+                ORDER BY score
+                LIMIT ? OFFSET ?
+                """,
+                params,
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" in str(e).lower():
+                raise SearchUnavailable("Highlight search index not available") from e
+            raise
+
+    prefix = f"{owner_n}::"
+    results = []
+    for row in rows[: int(limit)]:
+        item = dict(row)
+        if item["file_id"].startswith(prefix):
+            item["file_id"] = item["file_id"][len(prefix) :]
+        results.append(item)
+    has_more = len(rows) > int(limit)
+    logger.info("search_highlights: owner=%s file_id=%s count=%d", owner_n, file_id or "*", len(results))
+    return results, has_more
+
+
+@_db_timed
+def fill_missing_content_hashes(limit=20, db=None):
+    """Compute files.content_hash for rows stored before it existed. Returns rows updated.
+
+    ``db`` (here and in the other content index functions) is the database file
+    to work on, one of :func:`database_paths`; rowids are only unique within one.
+    """
+    with sqlite3.connect(db or DB_PATH, timeout=30) as conn:
+        ids = [r[0] for r in conn.execute("SELECT id FROM files WHERE content_hash IS NULL LIMIT ?", (int(limit),))]
+        for rowid in ids:
+            row = conn.execute("SELECT file_data FROM files WHERE id = ?", (rowid,)).fetchone()
+            if row is None:
+                continue
+            digest = hashlib.sha256(row[0] or b"").hexdigest()
+            conn.execute("UPDATE files SET content_hash = ? WHERE id = ? AND content_hash IS NULL", (digest, rowid))
+    if ids:
+        logger.info("fill_missing_content_hashes: count=%d", len(ids))
+    return len(ids)
+
+
+@_db_timed
+def pending_content_index(limit=20, db=None):
+    """EPUB files whose current content has not been indexed (or failed) yet.
+
+    Returns:
+        List of (file rowid, content_hash), oldest first
+    """
+    with sqlite3.connect(db or DB_PATH, timeout=30) as conn:
+        rows = conn.execute(
+            """
+            SELECT f.id, f.content_hash
+            FROM files f
+            LEFT JOIN content_index_state s ON s.file_id = f.id
+            LEFT JOIN file_metadata m ON m.file_id = f.id
+            WHERE f.format = 'epub'
+              AND f.content_hash IS NOT NULL
+              AND (s.file_id IS NULL OR s.content_hash != f.content_hash OR m.file_id IS NULL)
+            ORDER BY f.id
+            LIMIT ?
+            """,
+            (int(limit),),
+        ).fetchall()
+    return [(r[0], r[1]) for r in rows]
+
+
+@_db_timed
+def get_file_blob_by_rowid(rowid, db=None):
+    """Return (file_data, content_hash) for a files.id, or None."""
+    with sqlite3.connect(db or DB_PATH, timeout=30) as conn:
+        row = conn.execute("SELECT file_data, blob_store, content_hash, codec FROM files WHERE id = ?", (rowid,)).fetchone()
+    return (_read_document(*row), row[2]) if row else None
+
+
+@_db_timed
+def store_content_index(rowid, content_hash, chapters, error=None, metadata=None, db=None):
+    """Replace the indexed chapters and metadata of one file and record its indexing state.
+
+    ``metadata`` is the dict from ``epub.extract_metadata`` with ``cover``
+    already downscaled (or None).
+
+    Nothing is written if the file was deleted or re-uploaded with different
+    content since it was read; the new content is picked up on the next pass.
+
+    Returns:
+        True if stored
+    """
+    now = datetime.utcnow().isoformat()
+    for attempt in range(4):
+        try:
+            with write_gate(db=db or DB_PATH), sqlite3.connect(db or DB_PATH, timeout=30) as conn:
+                row = conn.execute("SELECT owner_email, content_hash FROM files WHERE id = ?", (rowid,)).fetchone()
+                if row is None or row[1] != content_hash:
+                    return False
+                owner_n = row[0]
+                conn.execute("DELETE FROM book_chapters WHERE file_id = ?", (rowid,))
+                conn.executemany(
+                    """
+                    INSERT INTO book_chapters (file_id, owner_email, chapter_index, href, title, text)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (rowid, owner_n, idx, ch.get("href"), ch.get("title"), ch["text"])
+                        for idx, ch in enumerate(chapters or ())
+                    ],
+                )
+                conn.execute(
+                    """
+                    INSERT INTO content_index_state (file_id, content_hash, status, chapters, error, indexed_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(file_id) DO UPDATE SET
+                        content_hash = excluded.content_hash,
+                        status = excluded.status,
+                        chapters = excluded.chapters,
+                        error = excluded.error,
+                        indexed_at = excluded.indexed_at
+                    """,
+                    (rowid, content_hash, "error" if error else "indexed", len(chapters or ()), error, now),
+                )
+                meta = metadata or {}
+                cover = meta.get("cover")
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO file_metadata (
+                        file_id, content_hash, title, authors, language, publisher, published,
+                        description, toc, cover, cover_type, extracted_at
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        rowid,
+                        content_hash,
+                        meta.get("title"),
+                        json.dumps(meta.get("authors") or []),
+                        meta.get("language"),
+                        meta.get("publisher"),
+                        meta.get("published"),
+                        meta.get("description"),
+                        json.dumps(meta.get("toc") or []),
+                        cover[0] if cover else None,
+                        cover[1] if cover else None,
+                        now,
+                    ),
+                )
+            logger.info(
+                "store_content_index: file=%s owner=%s chapters=%d error=%s",
+                rowid, owner_n or "*", len(chapters or ()), error or "-",
+            )
+            return True
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e).lower() and attempt < 3:
+                logger.warning("DB locked on content index (attempt %d): file=%s", attempt + 1, rowid)
+                _sleep_on_lock(attempt, "content_index")
+                continue
+            raise
+
+
+def _metadata_row(conn, file_id, owner_n, columns):
+    """file_metadata row for the file's current content, or None."""
+    where = "f.filename = ? AND f.owner_email = ?" if owner_n else "f.filename = ?"
+    params = (file_id, owner_n) if owner_n else (file_id,)
+    return conn.execute(
+        f"""
+        SELECT f.content_hash, {columns}
+        FROM files f
+        JOIN file_metadata m ON m.file_id = f.id AND m.content_hash = f.content_hash
+        WHERE {where}
+        """,
+        params,
+    ).fetchone()
+
+
+@_db_timed
+def get_file_metadata(file_id, owner_email=None):
+    """Extracted EPUB metadata for a file (without the cover bytes).
+
+    Returns:
+        Dict with content_hash, title, authors, language, publisher, published,
+        description, toc and has_cover; None if not (yet) extracted
+    """
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    with _connect(owner_n) as conn:
+        conn.row_factory = sqlite3.Row
+        row = _metadata_row(
+            conn,
+            file_id,
+            owner_n,
+            "m.title, m.authors, m.language, m.publisher, m.published, m.description, m.toc, "
+            "m.cover IS NOT NULL AS has_cover",
+        )
+    if row is None:
+        return None
+    meta = dict(row)
+    meta["authors"] = json.loads(meta["authors"] or "[]")
+    meta["toc"] = json.loads(meta["toc"] or "[]")
+    meta["has_cover"] = bool(meta["has_cover"])
+    return meta
+
+
+@_db_timed
+def get_file_cover(file_id, owner_email=None):
+    """Return (cover bytes, media type, content_hash) or None."""
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    with _connect(owner_n) as conn:
+        row = _metadata_row(conn, file_id, owner_n, "m.cover, m.cover_type")
+    if row is None or row[1] is None:
+        return None
+    return row[1], row[2] or "application/octet-stream", row[0]
+
+
+@_db_timed
+def content_index_status(owner_email):
+    """Counts of the owner's EPUBs by indexing state: indexed, error, pending."""
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    with _connect(owner_n) as conn:
+        rows = conn.execute(
+            """
+            SELECT
+                CASE
+                    WHEN s.file_id IS NULL OR f.content_hash IS NULL OR s.content_hash != f.content_hash THEN 'pending'
+                    ELSE s.status
+                END AS state,
+                COUNT(*)
+            FROM files f
+            LEFT JOIN content_index_state s ON s.file_id = f.id
+            WHERE f.format = 'epub' AND f.owner_email = ?
+            GROUP BY state
+            """,
+            (owner_n,),
+        ).fetchall()
+    counts = {"indexed": 0, "error": 0, "pending": 0}
+    counts.update({state: count for state, count in rows})
+    return counts
+
+
+@_db_timed
+def search_library(query, owner_email, limit=20, offset=0):
+    """Ranked full-text search over the text of an owner's EPUB chapters.
+
+    Returns:
+        (results, has_more) where each result names the file (filename, title),
+        the chapter (index, href, title) and a ``snippet`` with <mark></mark> matches
+    """
+    owner_n = _normalize_email(owner_email) if owner_email else None
+    match = _fts_match_expression(query, owner_n, "title text") if owner_n else None
+    if not match:
+        return [], False
+
+    with _connect(owner_n) as conn:
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(
+                """
+                SELECT
+                    f.filename AS file_id, f.title AS book_title,
+                    c.chapter_index, c.href, c.title AS chapter_title,
+                    snippet(book_chapters_fts, 1, '<mark>', '</mark>', '…', 24) AS snippet,
+                    bm25(book_chapters_fts, 2.0, 1.0, 0.0) AS score
+                FROM book_chapters_fts
+                JOIN book_chapters c ON c.id = book_chapters_fts.rowid
+                JOIN files f ON f.id = c.file_id
+                WHERE book_chapters_fts MATCH ? AND c.owner_email = ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+                """,
+                (match, owner_n, int(limit) + 1, int(offset)),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" in str(e).lower():
+                raise SearchUnavailable("Library search index not available") from e
+            raise
+
+    results = [dict(row) for row in rows[: int(limit)]]
+    has_more = len(rows) > int(limit)
+    logger.info("search_library: owner=%s count=%d", owner_n, len(results))
+    return results, has_more
+
+
+if __name__ == "__main__":
+    import logconfig
+
+    logconfig.configure_logging()
     init_db()
     print("Database initialized successfully")
@@ -0,0 +1,200 @@
+"""ZIP export and import of one user's library.
+
+:func:`write_export` streams an archive straight to a writable file object,
+typically the HTTP response: ``manifest.json`` (the :func:`app.get_files`
+listing with each document's highlights) followed by every document, read from
+the database in ``CHUNK_SIZE`` pieces. Nothing is buffered beyond one chunk and
+the output never needs to seek, so exports of any size run in constant memory.
+
+:func:`import_archive` reads such an archive back and stores it with
+:func:`app.import_files`, a batch of documents per transaction.
+"""
+import hashlib
+import json
+import logging
+import re
+import zipfile
+from datetime import datetime, timezone
+
+import app
+
+logger = logging.getLogger("localreader.archive")
+
+FORMAT = "localreader-library"
+VERSION = 1
+MANIFEST_NAME = "manifest.json"
+CHUNK_SIZE = 256 * 1024
+# An import transaction holds the write lock: keep each one short.
+IMPORT_BATCH_FILES = 50
+IMPORT_BATCH_BYTES = 32 * 1024 * 1024
+MAX_IMPORT_FILE_BYTES = 1024 * 1024 * 1024
+FORMATS = {"pdf", "epub"}
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class _ChunkedWriter:
+    """Coalesce zipfile's small header writes into CHUNK_SIZE socket writes."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._buf = bytearray()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self._buf += data
+        self.bytes_written += len(data)
+        if len(self._buf) >= CHUNK_SIZE:
+            self._raw.write(self._buf)
+            self._buf.clear()
+        return len(data)
+
+    def flush(self):
+        if self._buf:
+            self._raw.write(self._buf)
+            self._buf.clear()
+        self._raw.flush()
+
+
+def _member_name(index: int, filename: str, fmt: str) -> str:
+    name = re.sub(r"[^\w.-]+", "_", app.extract_actual_filename(filename)).strip("._") or "document"
+    if not name.lower().endswith("." + fmt):
+        name += "." + fmt
+    return f"files/{index:04d}-{name[:120]}"
+
+
+def _zip_time(iso: str | None) -> tuple:
+    try:
+        dt = datetime.fromisoformat(iso)
+    except (TypeError, ValueError):
+        dt = datetime.now(timezone.utc)
+    return max(dt.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def write_export(out, owner_email) -> dict:
+    """Write ``owner_email``'s library to ``out`` as a ZIP. Returns {"files", "bytes"}."""
+    writer = _ChunkedWriter(out)
+    with app.library_snapshot(owner_email) as (files, read_blob):
+        entries = []
+        for index, f in enumerate(files, 1):
+            entry = {k: v for k, v in f.items() if k != "rowid"}
+            entry["path"] = _member_name(index, f["filename"], f["format"])
+            entries.append(entry)
+        manifest = {
+            "format": FORMAT,
+            "version": VERSION,
+            "exported_at": datetime.utcnow().isoformat(),
+            "owner": owner_email,
+            "files": entries,
+        }
+
+        with zipfile.ZipFile(writer, "w", allowZip64=True) as zf:
+            zf.writestr(
+                zipfile.ZipInfo(MANIFEST_NAME, _zip_time(None)),
+                json.dumps(manifest, ensure_ascii=False, indent=1),
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+            for f, entry in zip(files, entries):
+                info = zipfile.ZipInfo(entry["path"], _zip_time(f["updated_at"]))
+                # PDF and EPUB are already compressed.
+                info.compress_type = zipfile.ZIP_STORED
+                info.file_size = f["size"] or 0
+                with zf.open(info, "w") as dst:
+                    for chunk in read_blob(f["rowid"], CHUNK_SIZE):
+                        dst.write(chunk)
+    writer.flush()
+    logger.info("Export written: owner=%s files=%d bytes=%d", owner_email, len(files), writer.bytes_written)
+    return {"files": len(files), "bytes": writer.bytes_written}
+
+
+def _read_manifest(zf: zipfile.ZipFile) -> list:
+    try:
+        manifest = json.loads(zf.read(MANIFEST_NAME))
+    except KeyError:
+        raise ArchiveError("Missing manifest.json") from None
+    except ValueError as e:
+        raise ArchiveError(f"Invalid manifest.json: {e}") from None
+    if not isinstance(manifest, dict) or manifest.get("format") != FORMAT:
+        raise ArchiveError("Not a LocalReader library export")
+    if not isinstance(manifest.get("version"), int) or manifest["version"] > VERSION:
+        raise ArchiveError(f"Unsupported export version: {manifest.get('version')!r}")
+    files = manifest.get("files")
+    if not isinstance(files, list):
+        raise ArchiveError("manifest.json has no 'files' list")
+    return files
+
+
+def _read_entry(zf: zipfile.ZipFile, item) -> dict | None:
+    """Validate one manifest entry and load its document, or return None."""
+    if not isinstance(item, dict):
+        return None
+    file_id, path, fmt = item.get("filename"), item.get("path"), item.get("format")
+    if not (isinstance(file_id, str) and file_id.strip() and isinstance(path, str) and fmt in FORMATS):
+        return None
+    try:
+        info = zf.getinfo(path)
+    except KeyError:
+        return None
+    if info.file_size > MAX_IMPORT_FILE_BYTES:
+        return None
+    try:
+        data = zf.read(info)
+    except (zipfile.BadZipFile, OSError, EOFError):
+        return None
+    if not data:
+        return None
+    expected = item.get("content_hash")
+    if expected and hashlib.sha256(data).hexdigest() != expected:
+        return None
+    entry = {
+        "file_id": file_id.strip(),
+        "title": item.get("title") or file_id,
+        "format": fmt,
+        "file_data": data,
+        "highlights": item.get("highlights") if isinstance(item.get("highlights"), list) else [],
+    }
+    for key in ("reading_position", "voice", "created_at", "updated_at", "position_updated_at",
+                "highlights_updated_at", "voice_updated_at"):
+        value = item.get(key)
+        entry[key] = value if isinstance(value, str) else None
+    if not isinstance(entry["title"], str):
+        entry["title"] = file_id
+    return entry
+
+
+def import_archive(fp, owner_email, replace: bool = False) -> dict:
+    """Import an archive written by :func:`write_export` from a seekable file.
+
+    Returns counts: imported, replaced, skipped (already present), deleted
+    (tombstoned on this server) and invalid (bad entry or checksum).
+    """
+    try:
+        zf = zipfile.ZipFile(fp)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ArchiveError(f"Not a ZIP archive: {e}") from None
+
+    totals = {"imported": 0, "replaced": 0, "skipped": 0, "deleted": 0, "invalid": 0}
+
+    def flush(batch):
+        for key, n in app.import_files(batch, owner_email=owner_email, replace=replace).items():
+            totals[key] += n
+
+    with zf:
+        batch, batch_bytes = [], 0
+        for item in _read_manifest(zf):
+            entry = _read_entry(zf, item)
+            if entry is None:
+                totals["invalid"] += 1
+                continue
+            batch.append(entry)
+            batch_bytes += len(entry["file_data"])
+            if len(batch) >= IMPORT_BATCH_FILES or batch_bytes >= IMPORT_BATCH_BYTES:
+                flush(batch)
+                batch, batch_bytes = [], 0
+        if batch:
+            flush(batch)
+
+    logger.info("Import finished: owner=%s %s", owner_email, totals)
+    return totals
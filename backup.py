@@ -0,0 +1,478 @@
+"""Online backups of the SQLite database while the server keeps serving.
+
+:func:`run_backup` copies the live database with SQLite's backup API,
+``BACKUP_PAGES_PER_STEP`` pages at a time with a ``BACKUP_STEP_SLEEP_MS`` pause
+between steps, so the copy never monopolises the disk. In WAL mode the copy
+holds one read transaction: writers keep committing and every step sees the
+same snapshot. With a rollback journal, holding the snapshot would block
+writers for the whole copy, so steps run unpinned; a write from another
+connection then restarts the copy, and after ``MAX_RESTARTS`` it finishes in a
+single step instead.
+
+The copy is checked with ``PRAGMA integrity_check`` and then either kept as a
+standalone file (``backup-<time>.db``) or, for incremental snapshots, split
+into content-addressed chunks under ``BACKUP_DIR/chunks`` so each snapshot only
+stores the chunks that changed since the previous one. ``BACKUP_KEEP`` of each
+kind are retained.
+
+Usable from the command line (``python backup.py --help``) and from
+``POST /api/admin/backup``.
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: the in-process lock still applies
+    fcntl = None
+
+import app
+import metrics
+
+logger = logging.getLogger("localreader.backup")
+
+BACKUP_DIR = os.environ.get("BACKUP_DIR") or os.path.join(os.path.dirname(app.DB_PATH) or ".", "backups")
+BACKUP_PAGES_PER_STEP = max(1, int(os.environ.get("BACKUP_PAGES_PER_STEP", "128")))
+BACKUP_STEP_SLEEP_MS = float(os.environ.get("BACKUP_STEP_SLEEP_MS", "10"))
+BACKUP_KEEP = max(1, int(os.environ.get("BACKUP_KEEP", "7")))
+MAX_RESTARTS = 3
+# Multiple of every SQLite page size, so unchanged pages map to unchanged chunks.
+CHUNK_SIZE = 256 * 1024
+
+BACKUPS = metrics.counter(
+    "localreader_backups_total",
+    "Backups by kind (full, snapshot) and result.",
+    ("kind", "result"),
+)
+BACKUP_SECONDS = metrics.histogram(
+    "localreader_backup_duration_seconds",
+    "Wall time of a backup including verification.",
+    ("kind",),
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+LAST_SUCCESS = metrics.gauge(
+    "localreader_backup_last_success_timestamp_seconds",
+    "Unix time of the last successful backup.",
+    ("kind",),
+)
+
+
+class BackupError(RuntimeError):
+    pass
+
+
+class BackupBusy(BackupError):
+    pass
+
+
+class _Restart(Exception):
+    pass
+
+
+_local_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _exclusive():
+    """One backup at a time, across threads and processes (CLI vs server)."""
+    if not _local_lock.acquire(blocking=False):
+        raise BackupBusy("A backup is already running")
+    try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        with open(os.path.join(BACKUP_DIR, ".lock"), "w") as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise BackupBusy("A backup is already running in another process") from None
+            yield
+    finally:
+        _local_lock.release()
+
+
+def _timestamp() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def _copy(dest_path: str, pages: int, sleep: float, source: str | None = None) -> dict:
+    """Copy the live database (or the shard ``source``) to ``dest_path`` with the backup API."""
+    src = sqlite3.connect(source or app.DB_PATH, timeout=30, isolation_level=None)
+    dst = sqlite3.connect(dest_path, isolation_level=None)
+    stats = {"steps": 0, "restarts": 0, "single_step": False}
+    try:
+        # The copy is thrown away if we crash, so skip its journal and fsyncs;
+        # the file is fsynced once at the end instead.
+        dst.execute("PRAGMA journal_mode = OFF")
+        dst.execute("PRAGMA synchronous = OFF")
+        wal = src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+        stats["journal_mode"] = "wal" if wal else "rollback"
+
+        last_remaining = None
+
+        def progress(status, remaining, total):
+            nonlocal last_remaining
+            stats["steps"] += 1
+            stats["pages"] = total
+            # Each successful step lowers ``remaining``; anything else is a restart.
+            if last_remaining is not None and remaining >= last_remaining:
+                stats["restarts"] += 1
+            last_remaining = remaining
+            if stats["restarts"] >= MAX_RESTARTS or stats["steps"] > 2 * (total // pages + 1) + 10:
+                raise _Restart()
+            if sleep and remaining:
+                time.sleep(sleep)
+
+        if wal:
+            # Pin one snapshot: later writes go to the WAL and cannot restart the copy.
+            src.execute("BEGIN")
+            src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        except _Restart:
+            logger.warning("Backup restarted %d times under writes; finishing in one step", stats["restarts"])
+            stats["single_step"] = True
+            src.backup(dst, pages=-1)
+        finally:
+            if wal:
+                src.execute("COMMIT")
+        # The copy inherits the WAL flag; a backup should be one standalone file.
+        dst.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+    with open(dest_path, "rb+") as fh:
+        os.fsync(fh.fileno())
+    stats["bytes"] = os.path.getsize(dest_path)
+    return stats
+
+
+def verify(path: str) -> str:
+    """Run ``PRAGMA integrity_check`` on a database file; returns "ok" or the first problems."""
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check(20)").fetchall()
+    finally:
+        conn.close()
+    return "; ".join(r[0] for r in rows)
+
+
+def _chunk_path(digest: str) -> str:
+    return os.path.join(BACKUP_DIR, "chunks", digest[:2], digest)
+
+
+def _store_chunks(path: str) -> tuple[list[str], int, int]:
+    """Split ``path`` into content-addressed chunks. Returns (hashes, new chunks, new bytes)."""
+    hashes = []
+    new_chunks = new_bytes = 0
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest = hashlib.sha256(chunk).hexdigest()
+            hashes.append(digest)
+            target = _chunk_path(digest)
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f"{target}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as out:
+                out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, target)
+            new_chunks += 1
+            new_bytes += len(chunk)
+    return hashes, new_chunks, new_bytes
+
+
+def _list(prefix: str, suffix: str) -> list[str]:
+    try:
+        names = os.listdir(BACKUP_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names if n.startswith(prefix) and n.endswith(suffix))
+
+
+def list_backups() -> list[dict]:
+    items = []
+    for name in _list("backup-", ".db"):
+        path = os.path.join(BACKUP_DIR, name)
+        items.append({"kind": "full", "name": name, "bytes": os.path.getsize(path)})
+    for name in _list("snapshot-", ".json"):
+        try:
+            with open(os.path.join(BACKUP_DIR, name)) as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        items.append(
+            {
+                "kind": "snapshot",
+                "name": name,
+                "bytes": manifest.get("bytes"),
+                "new_bytes": manifest.get("new_bytes"),
+                "created_at": manifest.get("created_at"),
+            }
+        )
+    return items
+
+
+def _prune() -> None:
+    for name in _list("backup-", ".db")[:-BACKUP_KEEP]:
+        os.remove(os.path.join(BACKUP_DIR, name))
+        shutil.rmtree(os.path.join(BACKUP_DIR, name[: -len(".db")] + ".shards"), ignore_errors=True)
+        logger.info("Backup pruned: %s", name)
+
+    manifests = _list("snapshot-", ".json")
+    expired = manifests[:-BACKUP_KEEP]
+    if not expired:
+        return
+    for name in expired:
+        os.remove(os.path.join(BACKUP_DIR, name))
+        logger.info("Snapshot pruned: %s", name)
+    live = set()
+    for name in manifests[-BACKUP_KEEP:]:
+        with open(os.path.join(BACKUP_DIR, name)) as fh:
+            manifest = json.load(fh)
+        live.update(manifest["chunks"])
+        for shard in manifest.get("shards", {}).values():
+            live.update(shard["chunks"])
+    chunk_root = os.path.join(BACKUP_DIR, "chunks")
+    removed = 0
+    for dirpath, _, filenames in os.walk(chunk_root):
+        for filename in filenames:
+            if filename not in live:
+                os.remove(os.path.join(dirpath, filename))
+                removed += 1
+    if removed:
+        logger.info("Snapshot chunks pruned: %d", removed)
+
+
+def _copy_verified(dest_path: str, pages: int, sleep: float, check: bool, source: str | None = None) -> dict:
+    report = _copy(dest_path, pages, sleep, source)
+    report["integrity"] = verify(dest_path) if check else "skipped"
+    if report["integrity"] not in ("ok", "skipped"):
+        raise BackupError(f"Backup of {source or app.DB_PATH} failed integrity check: {report['integrity']}")
+    return report
+
+
+def run_backup(incremental: bool = False, output: str | None = None, check: bool = True,
+               pages: int | None = None, sleep_ms: float | None = None) -> dict:
+    """Back up the live database; returns a report dict.
+
+    Args:
+        incremental: store a chunked snapshot instead of a standalone copy
+        output: explicit destination file for a full backup (not pruned)
+        check: run ``PRAGMA integrity_check`` on the copy
+
+    Raises:
+        BackupBusy: if another backup is running
+        BackupError: if the copy fails verification
+    """
+    kind = "snapshot" if incremental else "full"
+    pages = pages or BACKUP_PAGES_PER_STEP
+    sleep = (BACKUP_STEP_SLEEP_MS if sleep_ms is None else sleep_ms) / 1000.0
+    start = time.perf_counter()
+    with _exclusive():
+        stamp = _timestamp()
+        if output and not incremental:
+            final_path = output
+        else:
+            final_path = os.path.join(BACKUP_DIR, f"backup-{stamp}.db")
+        tmp_path = f"{final_path}.tmp"
+        # With app.DB_SHARDS, each shard is copied the same way after the catalog
+        # (one snapshot per file, not a single point in time across them).
+        shards_dir = final_path[: -len(".db")] + ".shards" if final_path.endswith(".db") else final_path + ".shards"
+        shards_tmp = f"{shards_dir}.tmp"
+        logger.info("Backup started: kind=%s source=%s shards=%d", kind, app.DB_PATH, len(app.database_paths()) - 1)
+        try:
+            report = _copy_verified(tmp_path, pages, sleep, check)
+            shard_reports = {}
+            for source in app.database_paths()[1:]:
+                os.makedirs(shards_tmp, exist_ok=True)
+                name = os.path.basename(source)
+                shard_reports[name] = _copy_verified(os.path.join(shards_tmp, name), pages, sleep, check, source)
+                report["bytes"] += shard_reports[name]["bytes"]
+                report["restarts"] += shard_reports[name]["restarts"]
+
+            if incremental:
+                hashes, new_chunks, new_bytes = _store_chunks(tmp_path)
+                manifest = {
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "source": app.DB_PATH,
+                    "bytes": report["bytes"],
+                    "chunk_size": CHUNK_SIZE,
+                    "chunks": hashes,
+                    "new_chunks": new_chunks,
+                    "new_bytes": new_bytes,
+                    "integrity": report["integrity"],
+                }
+                if shard_reports:
+                    manifest["shards"] = {}
+                    for name, shard_report in shard_reports.items():
+                        shard_hashes, n, b = _store_chunks(os.path.join(shards_tmp, name))
+                        manifest["shards"][name] = {"bytes": shard_report["bytes"], "chunks": shard_hashes}
+                        manifest["new_chunks"] += n
+                        manifest["new_bytes"] += b
+                    shutil.rmtree(shards_tmp)
+                final_path = os.path.join(BACKUP_DIR, f"snapshot-{stamp}.json")
+                with open(f"{final_path}.tmp", "w") as fh:
+                    json.dump(manifest, fh)
+                os.replace(f"{final_path}.tmp", final_path)
+                os.remove(tmp_path)
+                # Like bytes, new_chunks and new_bytes, the count covers the shards too.
+                chunks = len(hashes) + sum(len(shard["chunks"]) for shard in manifest.get("shards", {}).values())
+                report.update(chunks=chunks, new_chunks=manifest["new_chunks"], new_bytes=manifest["new_bytes"])
+            else:
+                if shard_reports:
+                    os.replace(shards_tmp, shards_dir)
+                os.replace(tmp_path, final_path)
+            if shard_reports:
+                report["shards"] = len(shard_reports)
+            if not output:
+                _prune()
+        except BaseException:
+            BACKUPS.inc(kind, "error")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            shutil.rmtree(shards_tmp, ignore_errors=True)
+            raise
+
+    seconds = time.perf_counter() - start
+    BACKUPS.inc(kind, "ok")
+    BACKUP_SECONDS.observe(seconds, kind)
+    LAST_SUCCESS.set(time.time(), kind)
+    report.update(kind=kind, path=final_path, seconds=round(seconds, 3))
+    logger.info(
+        "Backup done: kind=%s path=%s bytes=%d seconds=%.2f restarts=%d integrity=%s",
+        kind, final_path, report["bytes"], seconds, report["restarts"], report["integrity"],
+    )
+    return report
+
+
+def restore_snapshot(manifest_path: str, dest_path: str) -> dict:
+    """Rebuild a database file from a snapshot manifest and verify it.
+
+    Shards in the snapshot are restored to ``shards/`` next to ``dest_path``
+    (the default ``SHARD_DIR`` for a ``DB_PATH`` of ``dest_path``).
+    """
+    with open(manifest_path) as fh:
+        manifest = json.load(fh)
+    shard_dir = os.path.join(os.path.dirname(dest_path) or ".", "shards")
+    targets = [(manifest["chunks"], dest_path)] + [
+        (shard["chunks"], os.path.join(shard_dir, name)) for name, shard in manifest.get("shards", {}).items()
+    ]
+    for _, path in targets:
+        if os.path.exists(path):
+            raise BackupError(f"Refusing to overwrite {path}")
+    if len(targets) > 1:
+        os.makedirs(shard_dir, exist_ok=True)
+    for chunks, path in targets[1:]:
+        _restore_file(chunks, path)
+    result = _restore_file(manifest["chunks"], dest_path)
+    if len(targets) > 1:
+        result["shards"] = len(targets) - 1
+    return result
+
+
+def _restore_file(chunks: list[str], dest_path: str) -> dict:
+    tmp = f"{dest_path}.tmp"
+    with open(tmp, "wb") as out:
+        for digest in chunks:
+            with open(_chunk_path(digest), "rb") as fh:
+                chunk = fh.read()
+            if hashlib.sha256(chunk).hexdigest() != digest:
+                os.remove(tmp)
+                raise BackupError(f"Chunk {digest} is corrupt")
+            out.write(chunk)
+        out.flush()
+        os.fsync(out.fileno())
+    integrity = verify(tmp)
+    if integrity != "ok":
+        os.remove(tmp)
+        raise BackupError(f"Restored database failed integrity check: {integrity}")
+    os.replace(tmp, dest_path)
+    return {"path": dest_path, "bytes": os.path.getsize(dest_path), "integrity": integrity}
+
+
+def _lower_priority() -> None:
+    """Run the calling thread at nice 10 (Linux applies nice per thread)."""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+class _Job:
+    """Background backup started from the admin API."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last = None
+
+    def start(self, incremental: bool) -> bool:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self._run, args=(incremental,), name="backup", daemon=True)
+            self._thread.start()
+            return True
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self, incremental):
+        _lower_priority()
+        started_at = datetime.now(timezone.utc).isoformat()
+        try:
+            self.last = {"ok": True, "started_at": started_at, **run_backup(incremental=incremental)}
+        except Exception as e:
+            logger.exception("Backup failed")
+            self.last = {"ok": False, "started_at": started_at, "error": str(e)}
+
+
+job = _Job()
+
+
+def main(argv=None):
+    import logconfig
+
+    parser = argparse.ArgumentParser(description="Online backup of the LocalReader database (safe while server.py runs).")
+    parser.add_argument("--incremental", action="store_true", help="store a deduplicated chunk snapshot")
+    parser.add_argument("--output", help="write a full backup to this file (not subject to BACKUP_KEEP)")
+    parser.add_argument("--no-verify", action="store_true", help="skip PRAGMA integrity_check on the copy")
+    parser.add_argument("--list", action="store_true", help="list backups in BACKUP_DIR")
+    parser.add_argument("--restore", metavar="SNAPSHOT", help="rebuild a database from a snapshot-*.json")
+    parser.add_argument("--to", metavar="PATH", help="destination for --restore")
+    parser.add_argument("--check", metavar="DB", help="only run an integrity check on DB")
+    args = parser.parse_args(argv)
+
+    logconfig.configure_logging()
+    _lower_priority()
+    if args.list:
+        result = list_backups()
+    elif args.check:
+        result = {"path": args.check, "integrity": verify(args.check)}
+    elif args.restore:
+        if not args.to:
+            parser.error("--restore needs --to")
+        result = restore_snapshot(args.restore, args.to)
+    else:
+        result = run_backup(incremental=args.incremental, output=args.output, check=not args.no_verify)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""On-disk copies of documents, served with ``os.sendfile``.
+
+For documents stored in SQLite (see :mod:`storage` for the alternative) or
+compressed (see :mod:`compression`), whose stored form stays the source of
+truth (backups, export and the indexer read it), downloads are served from
+files under ``BLOB_DIR`` named by the document's ``content_hash``, holding
+its original bytes: a copy is made on the first download and then
+sent by the kernel straight from the page cache to the socket, with an
+``mmap`` fallback where ``sendfile`` is unavailable. Copies are immutable
+(same hash, same bytes), evicted least-recently-served first once the
+directory exceeds ``BLOB_CACHE_MAX_BYTES``, and removed by :func:`sweep` once
+no file references them.
+"""
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import threading
+import time
+
+import app
+import metrics
+import storage
+
+logger = logging.getLogger("localreader.blobstore")
+
+BLOB_DIR = os.environ.get("BLOB_DIR") or os.path.join(os.path.dirname(app.DB_PATH) or ".", "blobs")
+# 0 disables the on-disk copies: downloads are streamed from SQLite.
+BLOB_CACHE_MAX_BYTES = int(os.environ.get("BLOB_CACHE_MAX_BYTES", str(4 * 1024**3)))
+COPY_CHUNK = 1024 * 1024
+SENDFILE_CHUNK = 16 * 1024 * 1024
+# Serving refreshes a copy's mtime (its LRU position) at most this often.
+TOUCH_INTERVAL = 3600
+
+SERVED = metrics.counter(
+    "localreader_blob_served_bytes_total",
+    "Document bytes sent to clients by method (sendfile, mmap, sqlite).",
+    ("method",),
+)
+CACHE_BYTES = metrics.gauge(
+    "localreader_blob_cache_bytes",
+    "Size of the on-disk document copies.",
+)
+EVICTED = metrics.counter(
+    "localreader_blob_cache_evictions_total",
+    "Document copies removed by LRU eviction or sweep.",
+)
+
+_lock = threading.Lock()
+_total_bytes = None  # computed on first use
+
+
+def enabled() -> bool:
+    return BLOB_CACHE_MAX_BYTES > 0
+
+
+def _path(content_hash: str) -> str:
+    return os.path.join(BLOB_DIR, content_hash[:2], content_hash)
+
+
+def _valid_hash(content_hash) -> bool:
+    return isinstance(content_hash, str) and len(content_hash) == 64 and all(c in "0123456789abcdef" for c in content_hash)
+
+
+def _scan():
+    """Yield (path, size, mtime) of every stored copy."""
+    try:
+        prefixes = os.listdir(BLOB_DIR)
+    except FileNotFoundError:
+        return
+    for prefix in prefixes:
+        d = os.path.join(BLOB_DIR, prefix)
+        if len(prefix) != 2 or not os.path.isdir(d):
+            continue
+        for name in os.listdir(d):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(d, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, st.st_size, st.st_mtime
+
+
+def _add_bytes(n: int) -> int:
+    global _total_bytes
+    with _lock:
+        if _total_bytes is None:
+            _total_bytes = sum(size for _, size, _ in _scan())
+        _total_bytes += n
+        CACHE_BYTES.set(_total_bytes)
+        return _total_bytes
+
+
+def open_copy(content_hash):
+    """Open the stored copy of ``content_hash`` for reading, or return None."""
+    if not enabled() or not _valid_hash(content_hash):
+        return None
+    path = _path(content_hash)
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    try:
+        if time.time() - os.fstat(f.fileno()).st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+    except OSError:
+        pass
+    return f
+
+
+def store_copy(content_hash):
+    """Copy a document out of SQLite (or out of its compressed form) into BLOB_DIR and open it.
+
+    Returns None if no file has this content, or it is stored as is in the blob store.
+    """
+    if not enabled() or not _valid_hash(content_hash):
+        return None
+    path = _path(content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    with app.open_blob_by_hash(content_hash) as blob:
+        if blob is None or isinstance(blob, storage.BlobFile):
+            # Stored as is in the blob store, which keeps its own local files.
+            return None
+        with open(tmp, "wb") as out:
+            while chunk := blob.read(COPY_CHUNK):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    if digest.hexdigest() != content_hash:
+        # Should not happen (content_hash is computed on upload); never serve it.
+        logger.error("Content hash mismatch for stored file: expected=%s got=%s", content_hash, digest.hexdigest())
+        os.unlink(tmp)
+        return None
+    os.replace(tmp, path)
+    logger.info("Stored document copy: hash=%s bytes=%d", content_hash[:16], size)
+    if _add_bytes(size) > BLOB_CACHE_MAX_BYTES:
+        evict()
+    return open(path, "rb")
+
+
+def evict() -> int:
+    """Delete least-recently-served copies until the directory fits the cap. Returns bytes freed."""
+    global _total_bytes
+    entries = sorted(_scan(), key=lambda e: e[2])
+    total = sum(size for _, size, _ in entries)
+    # Keep headroom so the next few copies don't trigger another full scan.
+    target = BLOB_CACHE_MAX_BYTES * 0.9
+    freed = 0
+    for path, size, _ in entries:
+        if total - freed <= target:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        freed += size
+        EVICTED.inc()
+    with _lock:
+        _total_bytes = total - freed
+        CACHE_BYTES.set(_total_bytes)
+    if freed:
+        logger.info("Evicted document copies: bytes=%d remaining=%d", freed, total - freed)
+    return freed
+
+
+def sweep(referenced: set[str]) -> int:
+    """Delete copies whose hash no stored file has any more. Returns bytes freed."""
+    global _total_bytes
+    freed = 0
+    for path, size, _ in list(_scan()):
+        if os.path.basename(path) in referenced:
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        freed += size
+        EVICTED.inc()
+    with _lock:
+        _total_bytes = None
+    return freed
+
+
+def sendfile(sock, f, offset: int, count: int, record: bool = True) -> int:
+    """Send ``count`` bytes of ``f`` from ``offset`` to ``sock``. Returns bytes sent.
+
+    ``record=False`` leaves the bytes out of the document-bytes metric.
+    """
+    sent = 0
+    try:
+        out_fd, in_fd = sock.fileno(), f.fileno()
+        while sent < count:
+            n = os.sendfile(out_fd, in_fd, offset + sent, min(count - sent, SENDFILE_CHUNK))
+            if n == 0:
+                break
+            sent += n
+        if record:
+            SERVED.inc("sendfile", amount=sent)
+        return sent
+    except (AttributeError, OSError) as e:
+        # No sendfile on this platform/socket (e.g. TLS-wrapped): nothing went
+        # out yet, so the mmap path can take over from the same offset.
+        if sent or (isinstance(e, OSError) and e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP)):
+            raise
+    return _send_mmap(sock, f, offset, count, record)
+
+
+def _send_mmap(sock, f, offset: int, count: int, record: bool = True) -> int:
+    if count <= 0:
+        return 0
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        view = memoryview(m)
+        try:
+            end = offset + count
+            pos = offset
+            while pos < end:
+                step = min(end - pos, COPY_CHUNK)
+                sock.sendall(view[pos : pos + step])
+                pos += step
+        finally:
+            view.release()
+    if record:
+        SERVED.inc("mmap", amount=count)
+    return count
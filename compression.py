@@ -0,0 +1,291 @@
+"""Transparent compression of stored documents.
+
+Many PDFs carry uncompressed or weakly compressed streams. With
+``BLOB_COMPRESSION`` set, each document is compressed when it is stored, in
+SQLite or in the blob store (:mod:`storage`), if a quick test on three
+samples of it (start, middle, end) saves at least ``BLOB_COMPRESSION_MIN_SAVING``;
+EPUBs (ZIP archives, already deflated) and documents made mostly of JPEG
+images fail the test and are stored as they are. The codec used is recorded
+per document (``files.codec``):
+
+* ``gzip`` (zlib, gzip framing): sent as is to clients that accept
+  ``Content-Encoding: gzip``, decompressed on the fly for the others;
+* ``xz`` (lzma): smaller, slower, always decompressed on the fly;
+* ``auto``: ``xz`` where it beats ``gzip`` by ``XZ_MIN_GAIN`` on the samples.
+
+``content_hash`` stays the hash of the original bytes. ``python compression.py
+--report`` shows the space saved and what compressing the rest would save;
+``--compress`` applies the current setting to documents already stored.
+"""
+import argparse
+import json
+import logging
+import lzma
+import os
+import sqlite3
+import time
+import zlib
+
+import metrics
+import storage
+
+logger = logging.getLogger("localreader.compression")
+
+# "" (off), "gzip", "xz" or "auto".
+BLOB_COMPRESSION = os.environ.get("BLOB_COMPRESSION", "").strip().lower()
+BLOB_COMPRESSION_MIN_SAVING = float(os.environ.get("BLOB_COMPRESSION_MIN_SAVING", "0.1"))
+GZIP_LEVEL = 6
+XZ_PRESET = 6
+# With "auto", xz is used when the samples come out this much smaller than with gzip.
+XZ_MIN_GAIN = 0.2
+MIN_SIZE = 4096
+SAMPLE_SIZE = 64 * 1024
+CHUNK = 256 * 1024
+SUFFIXES = {"gzip": ".gz", "xz": ".xz"}
+
+STORED = metrics.counter(
+    "localreader_blob_compression_bytes_total",
+    "Document bytes stored by codec (identity, gzip, xz), before and after compression.",
+    ("codec", "stage"),
+)
+SERVED = metrics.counter(
+    "localreader_blob_compression_served_bytes_total",
+    "Compressed document bytes served: as stored (gzip) or decompressed on the fly (decoded).",
+    ("mode",),
+)
+
+
+def enabled() -> bool:
+    return BLOB_COMPRESSION in ("gzip", "xz", "auto")
+
+
+def _sample(data: bytes) -> bytes:
+    if len(data) <= 3 * SAMPLE_SIZE:
+        return data
+    middle = len(data) // 2 - SAMPLE_SIZE // 2
+    return data[:SAMPLE_SIZE] + data[middle : middle + SAMPLE_SIZE] + data[-SAMPLE_SIZE:]
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip framing, no name or mtime
+        return c.compress(data) + c.flush()
+    if codec == "xz":
+        return lzma.compress(data, preset=XZ_PRESET)
+    raise ValueError(f"Unknown codec {codec!r}")
+
+
+def choose(data: bytes, fmt=None, setting=None) -> str | None:
+    """The codec worth using for ``data`` under ``setting`` (default BLOB_COMPRESSION), or None."""
+    setting = BLOB_COMPRESSION if setting is None else setting
+    if setting not in ("gzip", "xz", "auto") or len(data) < MIN_SIZE:
+        return None
+    if fmt == "epub" or data[:4] == b"PK\x03\x04":
+        return None
+    sample = _sample(data)
+    gzipped = len(compress(sample, "gzip"))
+    if gzipped > len(sample) * (1 - BLOB_COMPRESSION_MIN_SAVING):
+        return None
+    if setting == "auto":
+        return "xz" if len(compress(sample, "xz")) < gzipped * (1 - XZ_MIN_GAIN) else "gzip"
+    return setting
+
+
+def encode(data: bytes, fmt=None) -> tuple[bytes, str | None]:
+    """``(stored bytes, codec)`` for a document; codec None means stored as is."""
+    codec = choose(data, fmt)
+    stored = data
+    if codec is not None:
+        started = time.perf_counter()
+        stored = compress(data, codec)
+        if len(stored) > len(data) * (1 - BLOB_COMPRESSION_MIN_SAVING):
+            # The samples were not representative.
+            codec, stored = None, data
+        else:
+            logger.info(
+                "Document compressed: codec=%s bytes=%d stored=%d seconds=%.2f",
+                codec, len(data), len(stored), time.perf_counter() - started,
+            )
+    STORED.inc(codec or "identity", "original", amount=len(data))
+    STORED.inc(codec or "identity", "stored", amount=len(stored))
+    return stored, codec
+
+
+def _decompressor(codec):
+    if codec == "gzip":
+        return zlib.decompressobj(31)
+    if codec == "xz":
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unknown codec {codec!r}")
+
+
+def decode(stored: bytes, codec) -> bytes:
+    if codec is None:
+        return stored
+    if codec == "gzip":
+        return zlib.decompress(stored, 31)
+    return lzma.decompress(stored)
+
+
+class DecodedFile:
+    """Reads the original bytes of a compressed document from its stored form.
+
+    ``raw`` is the stored (compressed) handle, e.g. a ``sqlite3.Blob``; like
+    it, ``len()`` is the size, here of the original. Reads decompress as they
+    go; seeking forward decompresses and discards, seeking back starts over.
+    """
+
+    def __init__(self, raw, codec: str, size: int):
+        self.raw = raw
+        self.codec = codec
+        self._size = size
+        self._rewind()
+
+    def _rewind(self):
+        self.raw.seek(0)
+        self._dec = _decompressor(self.codec)
+        self._pos = 0
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _more(self, n: int) -> bytes:
+        """Up to ``n`` more decompressed bytes; empty only at the end."""
+        while not self._dec.eof:
+            if self.codec == "gzip":
+                data = self._dec.unconsumed_tail or self.raw.read(CHUNK)
+            else:
+                data = self.raw.read(CHUNK) if self._dec.needs_input else b""
+            if not data and (self.codec == "gzip" or self._dec.needs_input):
+                raise ValueError("Compressed document is truncated")
+            out = self._dec.decompress(data, n)
+            if out:
+                return out
+        return b""
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            n = self._size - self._pos
+        parts = []
+        while n > 0:
+            chunk = self._more(min(n, CHUNK))
+            if not chunk:
+                break
+            parts.append(chunk)
+            n -= len(chunk)
+            self._pos += len(chunk)
+        return b"".join(parts)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        target = {0: 0, 1: self._pos, 2: self._size}[whence] + offset
+        if target < self._pos:
+            self._rewind()
+        while self._pos < target and self.read(min(target - self._pos, CHUNK)):
+            pass
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        self.raw.close()
+
+
+def report(estimate: bool = True) -> dict:
+    """Space saved by compression so far, and (``estimate``) what compressing the rest would save."""
+    import app  # not at the top: app imports this module
+
+    store = storage.store()
+    object_sizes = {key: size for key, size, _ in store.list()} if store is not None else {}
+    by_codec = {}
+    candidates = {"gzip": [0, 0, 0], "xz": [0, 0, 0]}  # documents, original bytes, stored bytes
+    for path in app.database_paths():
+        with sqlite3.connect(path, timeout=30) as conn:
+            rows = conn.execute(
+                """
+                SELECT id, format, content_hash, codec, blob_store,
+                       COALESCE(blob_size, length(file_data)), length(file_data)
+                FROM files WHERE content_hash IS NOT NULL
+                """
+            ).fetchall()
+        for rowid, fmt, content_hash, codec, name, size, stored in rows:
+            if name:
+                stored = object_sizes.get(app._object_key(content_hash, codec), size)
+            entry = by_codec.setdefault(codec or "identity", {"files": 0, "bytes": 0, "stored_bytes": 0})
+            entry["files"] += 1
+            entry["bytes"] += size
+            entry["stored_bytes"] += stored
+            if not estimate or codec is not None:
+                continue
+            found = app.get_file_blob_by_rowid(rowid, path)
+            if found is None:
+                continue
+            data = found[0]
+            for candidate, totals in candidates.items():
+                chosen = choose(data, fmt, candidate)
+                totals[0] += 1
+                totals[1] += len(data)
+                totals[2] += len(compress(data, chosen)) if chosen else len(data)
+    for entry in by_codec.values():
+        entry["saved_bytes"] = entry["bytes"] - entry["stored_bytes"]
+    out = {"setting": BLOB_COMPRESSION or "off", "stored": by_codec}
+    if estimate:
+        out["uncompressed_estimate"] = {
+            codec: {
+                "files": n,
+                "bytes": original,
+                "stored_bytes": stored,
+                "saved_bytes": original - stored,
+                "saved_percent": round(100 * (original - stored) / original, 1) if original else 0.0,
+            }
+            for codec, (n, original, stored) in candidates.items()
+        }
+    return out
+
+
+def compress_existing(batch: int = 20) -> dict:
+    """Store every document again under the current BLOB_COMPRESSION setting. Returns counts."""
+    import app
+
+    if not enabled():
+        raise SystemExit("Set BLOB_COMPRESSION first (gzip, xz or auto)")
+    app.init_db()
+    start = time.perf_counter()
+    files = original = stored = 0
+    for path in app.database_paths():
+        after = 0
+        while after is not None:
+            after, done = app.recompress_documents(after, batch, db=path)
+            files += len(done)
+            original += sum(size for size, _ in done)
+            stored += sum(size for _, size in done)
+    result = {"files": files, "bytes": original, "stored_bytes": stored, "seconds": round(time.perf_counter() - start, 3)}
+    logger.info("Compression done: files=%d bytes=%d stored=%d", files, original, stored)
+    return result
+
+
+def main(argv=None):
+    import logconfig
+
+    parser = argparse.ArgumentParser(description="Report or apply LocalReader document compression (BLOB_COMPRESSION).")
+    parser.add_argument("--report", action="store_true", help="space saved, and what compressing the rest would save")
+    parser.add_argument("--no-estimate", action="store_true", help="with --report: skip the (slow) estimate")
+    parser.add_argument("--compress", action="store_true", help="store existing documents again with the current setting")
+    parser.add_argument("--batch", type=int, default=20, help="documents per transaction with --compress (default 20)")
+    args = parser.parse_args(argv)
+    if not args.report and not args.compress:
+        parser.error("nothing to do: use --report or --compress")
+
+    logconfig.configure_logging()
+    result = compress_existing(args.batch) if args.compress else report(not args.no_estimate)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
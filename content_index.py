@@ -0,0 +1,221 @@
+"""Background indexing of EPUB text, metadata and covers.
+
+One daemon thread polls ``app.pending_content_index()`` for EPUBs whose
+``content_hash`` has not been indexed yet, extracts their chapters, OPF
+metadata and a downscaled cover in a process pool (parsing is CPU-bound and
+must not hold the GIL of the request threads), and writes the result back with
+``app.store_content_index()``. Progress lives in
+the database, so a restart simply resumes with whatever is still pending.
+
+Uploads call :func:`notify` to wake the thread; otherwise it rescans every
+``POLL_SECONDS``.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import app
+import epub
+import metrics
+
+logger = logging.getLogger("localreader.content_index")
+
+ENABLED = os.environ.get("CONTENT_INDEX_ENABLED", "true").strip().lower() in {"1", "true", "yes"}
+# Extraction processes; 0 parses in the indexer thread itself.
+WORKERS = max(0, int(os.environ.get("CONTENT_INDEX_WORKERS", "1")))
+# Longest side of stored covers, in pixels (needs Pillow).
+COVER_MAX_SIZE = int(os.environ.get("COVER_MAX_SIZE", "512"))
+POLL_SECONDS = 60.0
+BATCH = 8
+
+INDEXED_FILES = metrics.counter(
+    "localreader_content_index_files_total",
+    "EPUB files processed by the content indexer.",
+    ("result",),
+)
+EXTRACT_SECONDS = metrics.histogram(
+    "localreader_content_index_extract_seconds",
+    "Time to read and extract the text of one EPUB.",
+)
+
+
+def _init_worker(db_path: str) -> None:
+    app.DB_PATH = db_path
+    try:
+        # Indexing is background work: let request threads win the CPU.
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def _extract(rowid: int, db: str):
+    """Worker: read one blob and return ``(rowid, content_hash, chapters, error, metadata, seconds)``."""
+    start = time.perf_counter()
+    found = app.get_file_blob_by_rowid(rowid, db)
+    if found is None:
+        return rowid, None, None, None, None, time.perf_counter() - start
+    data, content_hash = found
+    try:
+        chapters = epub.extract_chapters(data)
+        error = None if chapters else "No text found"
+    except epub.EpubError as e:
+        chapters, error = [], str(e)[:500]
+    try:
+        metadata = epub.extract_metadata(data)
+    except epub.EpubError:
+        metadata = None
+    if metadata and metadata["cover"]:
+        metadata["cover"] = epub.make_cover_thumbnail(*metadata["cover"], COVER_MAX_SIZE)
+    return rowid, content_hash, chapters, error, metadata, time.perf_counter() - start
+
+
+class ContentIndexer:
+    def __init__(self, workers: int = WORKERS):
+        self._workers = workers
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pool = None
+        # After a worker crash, index the next BATCH files one at a time so the
+        # culprit is found.
+        self._isolate = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="content-indexer", daemon=True)
+        self._thread.start()
+        logger.info("Content indexer started: workers=%d", self._workers)
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _get_pool(self):
+        if self._workers and self._pool is None:
+            # spawn: forking a process that already runs logging/translation
+            # threads can deadlock the child on an inherited lock.
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(app.DB_PATH,),
+            )
+        return self._pool
+
+    def _pool_works(self) -> bool:
+        """Check that a fresh pool can run a trivial task; otherwise stop using processes."""
+        try:
+            self._get_pool().submit(int).result(timeout=60)
+            return True
+        except Exception:
+            logger.error("Content index: worker processes unusable; extracting in the indexer thread")
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            self._workers = 0
+            return False
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                worked = self.run_once()
+            except Exception:
+                logger.exception("Content indexer pass failed")
+                worked = False
+            if not worked:
+                self._wakeup.wait(POLL_SECONDS)
+                self._wakeup.clear()
+
+    def run_once(self) -> bool:
+        """Index one batch. Returns False when there was nothing to do."""
+        # With DB_SHARDS, one batch comes from a single database file.
+        for db in app.database_paths():
+            if app.fill_missing_content_hashes(db=db):
+                return True
+            pending = app.pending_content_index(1 if self._isolate > 0 else BATCH, db=db)
+            if pending:
+                break
+        else:
+            return False
+
+        pool = self._get_pool()
+        if pool is None:
+            results = (_extract(rowid, db) for rowid, _ in pending)
+        else:
+            futures = {pool.submit(_extract, rowid, db): (rowid, content_hash) for rowid, content_hash in pending}
+            results = self._collect(futures, blame=len(pending) == 1)
+
+        for rowid, content_hash, chapters, error, metadata, seconds in results:
+            if self._stopping.is_set():
+                break
+            if content_hash is None:
+                continue
+            EXTRACT_SECONDS.observe(seconds)
+            self._isolate = max(0, self._isolate - 1)
+            if app.store_content_index(rowid, content_hash, chapters, error, metadata, db=db):
+                INDEXED_FILES.inc("error" if error else "indexed")
+                if error:
+                    logger.warning("Content index: file=%s not indexed: %s", rowid, error)
+        return True
+
+    def _collect(self, futures, blame: bool):
+        for future in concurrent.futures.as_completed(futures):
+            rowid, content_hash = futures[future]
+            try:
+                yield future.result()
+            except concurrent.futures.CancelledError:
+                return
+            except concurrent.futures.process.BrokenProcessPool:
+                # A worker died (e.g. OOM on a hostile archive). Alone in its
+                # batch, the file is recorded as failed and not retried until its
+                # content changes; otherwise retry the batch one file at a time.
+                logger.error("Content index: worker crashed (file=%s, isolated=%s)", rowid, blame)
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                if not blame:
+                    self._isolate = len(futures)
+                elif self._pool_works():
+                    yield rowid, content_hash, [], "Extraction crashed", None, 0.0
+                return
+            except Exception as e:
+                logger.exception("Content index: extraction failed for file=%s", rowid)
+                yield rowid, content_hash, [], f"Extraction failed: {e}"[:500], None, 0.0
+
+
+_indexer = None
+_indexer_lock = threading.Lock()
+
+
+def get_indexer() -> ContentIndexer:
+    global _indexer
+    with _indexer_lock:
+        if _indexer is None:
+            _indexer = ContentIndexer()
+        return _indexer
+
+
+def start() -> None:
+    if ENABLED:
+        get_indexer().start()
+
+
+def notify() -> None:
+    if _indexer is not None:
+        _indexer.notify()
+
+
+def stop() -> None:
+    if _indexer is not None:
+        _indexer.stop()
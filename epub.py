@@ -0,0 +1,397 @@
+"""Text and metadata extraction from EPUB files.
+
+:func:`extract_chapters` follows ``META-INF/container.xml`` to the OPF package
+document and returns the text of each spine item in reading order;
+:func:`extract_metadata` returns the OPF metadata, table of contents and cover.
+Archives are untrusted user uploads, so member sizes and the total amount of
+text are capped. Only the stdlib is required; Pillow, when installed, is used to
+downscale covers.
+"""
+import io
+import posixpath
+import re
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from urllib.parse import unquote
+
+try:
+    from PIL import Image
+except ImportError:  # optional: covers are then stored as-is
+    Image = None
+
+MAX_MEMBER_BYTES = 16 * 1024 * 1024
+MAX_TOTAL_TEXT = 32 * 1024 * 1024
+MAX_TOC_ENTRIES = 2000
+# Without Pillow, covers above this size are not kept.
+MAX_RAW_COVER_BYTES = 512 * 1024
+
+_HTML_TYPES = {"application/xhtml+xml", "text/html"}
+_HTML_SUFFIXES = (".xhtml", ".html", ".htm")
+_SKIP_TAGS = {"script", "style", "head", "svg", "math"}
+_HEADING_TAGS = {"h1", "h2", "h3"}
+_BLOCK_TAGS = {
+    "p", "div", "br", "li", "tr", "td", "th", "section", "article", "blockquote",
+    "pre", "h1", "h2", "h3", "h4", "h5", "h6", "dt", "dd", "figcaption", "hr",
+}
+_SPACE_RE = re.compile(r"[ \t\r\f\v\u00a0]+")
+_NEWLINES_RE = re.compile(r"\s*\n\s*")
+
+
+class EpubError(ValueError):
+    pass
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.title = ""
+        self.heading = ""
+        self._skip = 0
+        self._in_title = False
+        self._heading_depth = 0
+        self._heading_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _HEADING_TAGS and not self.heading:
+            self._heading_depth += 1
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        if tag in _SKIP_TAGS and self._skip:
+            self._skip -= 1
+        elif tag in _HEADING_TAGS and self._heading_depth:
+            self._heading_depth -= 1
+            if not self._heading_depth:
+                self.heading = _clean("".join(self._heading_parts)).replace("\n", " ")
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        if self._skip:
+            return
+        self.parts.append(data)
+        if self._heading_depth:
+            self._heading_parts.append(data)
+
+
+def _clean(text: str) -> str:
+    return _NEWLINES_RE.sub("\n", _SPACE_RE.sub(" ", text)).strip()
+
+
+def html_to_text(markup: str) -> tuple[str, str]:
+    """Return ``(title, text)`` for an (X)HTML document."""
+    parser = _TextExtractor()
+    parser.feed(markup)
+    parser.close()
+    title = parser.heading or _clean(parser.title).replace("\n", " ")
+    return title[:300], _clean("".join(parser.parts))
+
+
+def _read_member(zf: zipfile.ZipFile, name: str) -> bytes | None:
+    try:
+        info = zf.getinfo(name)
+    except KeyError:
+        return None
+    if info.file_size > MAX_MEMBER_BYTES:
+        return None
+    try:
+        with zf.open(info) as fh:
+            # file_size comes from the archive itself; never trust it for the read.
+            return fh.read(MAX_MEMBER_BYTES + 1)[:MAX_MEMBER_BYTES]
+    except (zipfile.BadZipFile, zlib.error, OSError, NotImplementedError, RuntimeError):
+        # Corrupt, encrypted or unsupported-compression member.
+        return None
+
+
+def _decode(raw: bytes) -> str:
+    if raw.startswith(b"\xef\xbb\xbf"):
+        return raw[3:].decode("utf-8", "replace")
+    if raw.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return raw.decode("utf-16", "replace")
+    return raw.decode("utf-8", "replace")
+
+
+def _resolve(base: str, href: str) -> str:
+    return posixpath.normpath(posixpath.join(base, unquote(href.split("#", 1)[0])))
+
+
+def _parse_xml(raw: bytes | None):
+    if not raw:
+        return None
+    try:
+        return ET.fromstring(raw)
+    except ET.ParseError:
+        return None
+
+
+class _Package:
+    """The parsed OPF: ``manifest`` maps item id -> (path, media type, properties)."""
+
+    __slots__ = ("path", "root", "manifest")
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.manifest = {}
+        base = posixpath.dirname(path)
+        for item in root.iterfind(".//{*}manifest/{*}item"):
+            href = item.get("href")
+            if item.get("id") and href:
+                self.manifest[item.get("id")] = (
+                    _resolve(base, href),
+                    (item.get("media-type") or "").lower(),
+                    (item.get("properties") or "").split(),
+                )
+
+    def spine_ids(self) -> list[str]:
+        return [ref.get("idref") for ref in self.root.iterfind(".//{*}spine/{*}itemref")]
+
+
+def _read_package(zf: zipfile.ZipFile) -> _Package | None:
+    container = _parse_xml(_read_member(zf, "META-INF/container.xml"))
+    rootfile = container.find(".//{*}rootfile") if container is not None else None
+    opf_path = rootfile.get("full-path") if rootfile is not None else None
+    root = _parse_xml(_read_member(zf, opf_path)) if opf_path else None
+    return _Package(opf_path, root) if root is not None else None
+
+
+def _spine_paths(zf: zipfile.ZipFile, package: _Package | None) -> list[str]:
+    if package is not None:
+        paths = []
+        for idref in package.spine_ids():
+            entry = package.manifest.get(idref)
+            if entry and (entry[1] in _HTML_TYPES or entry[0].lower().endswith(_HTML_SUFFIXES)):
+                if entry[0] not in paths:
+                    paths.append(entry[0])
+        if paths:
+            return paths
+
+    # No usable package document: fall back to every HTML member in name order.
+    return sorted(n for n in zf.namelist() if n.lower().endswith(_HTML_SUFFIXES))
+
+
+def _open(data: bytes) -> zipfile.ZipFile:
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(data))
+    except (zipfile.BadZipFile, ValueError) as e:
+        raise EpubError(f"Not a zip archive: {e}") from e
+    if not zf.namelist():
+        zf.close()
+        raise EpubError("Empty archive")
+    return zf
+
+
+def extract_chapters(data: bytes) -> list[dict]:
+    """Return ``[{"href", "title", "text"}, ...]`` for the spine of an EPUB.
+
+    Raises:
+        EpubError: if ``data`` is not a readable EPUB archive
+    """
+    chapters = []
+    total = 0
+    with _open(data) as zf:
+        for path in _spine_paths(zf, _read_package(zf)):
+            raw = _read_member(zf, path)
+            if not raw:
+                continue
+            title, text = html_to_text(_decode(raw))
+            if not text:
+                continue
+            text = text[: MAX_TOTAL_TEXT - total]
+            chapters.append({"href": path, "title": title, "text": text})
+            total += len(text)
+            if total >= MAX_TOTAL_TEXT:
+                break
+    return chapters
+
+
+class _NavTocParser(HTMLParser):
+    """Collects ``(level, href, title)`` links inside ``<nav epub:type="toc">``."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.entries = []
+        self._nav_depth = 0
+        self._in_toc = False
+        self._ol_depth = 0
+        self._href = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "nav":
+            self._nav_depth += 1
+            if "toc" in (attrs.get("epub:type") or "").split() and not self.entries:
+                self._in_toc = True
+        elif self._in_toc and tag == "ol":
+            self._ol_depth += 1
+        elif self._in_toc and tag == "a":
+            self._href = attrs.get("href") or ""
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag == "nav" and self._nav_depth:
+            self._nav_depth -= 1
+            self._in_toc = False
+        elif self._in_toc and tag == "ol" and self._ol_depth:
+            self._ol_depth -= 1
+        elif self._in_toc and tag == "a" and self._href is not None:
+            self.entries.append((max(1, self._ol_depth), self._href, _clean("".join(self._text))))
+            self._href = None
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+
+def _toc_entry(level, base, href, title):
+    path = _resolve(base, href) if href else ""
+    fragment = href.split("#", 1)[1] if "#" in href else ""
+    return {"level": level, "title": title[:300], "href": path + (f"#{fragment}" if fragment else "")}
+
+
+def _read_toc(zf: zipfile.ZipFile, package: _Package) -> list[dict]:
+    # EPUB 3 navigation document.
+    for path, _, properties in package.manifest.values():
+        if "nav" in properties:
+            raw = _read_member(zf, path)
+            if not raw:
+                break
+            parser = _NavTocParser()
+            parser.feed(_decode(raw))
+            parser.close()
+            base = posixpath.dirname(path)
+            entries = [_toc_entry(level, base, href, title) for level, href, title in parser.entries if title]
+            if entries:
+                return entries[:MAX_TOC_ENTRIES]
+            break
+
+    # EPUB 2 NCX, referenced from <spine toc="...">.
+    spine = package.root.find(".//{*}spine")
+    ncx_id = spine.get("toc") if spine is not None else None
+    entry = package.manifest.get(ncx_id) if ncx_id else None
+    ncx = _parse_xml(_read_member(zf, entry[0])) if entry else None
+    if ncx is None:
+        return []
+    base = posixpath.dirname(entry[0])
+    entries = []
+
+    def walk(parent, level):
+        for point in parent.iterfind("{*}navPoint"):
+            if len(entries) >= MAX_TOC_ENTRIES:
+                return
+            label = point.find("{*}navLabel/{*}text")
+            content = point.find("{*}content")
+            title = _clean(label.text or "") if label is not None else ""
+            if title:
+                entries.append(_toc_entry(level, base, content.get("src", "") if content is not None else "", title))
+            walk(point, level + 1)
+
+    nav_map = ncx.find("{*}navMap")
+    if nav_map is not None:
+        walk(nav_map, 1)
+    return entries
+
+
+def _find_cover(zf: zipfile.ZipFile, package: _Package) -> tuple[bytes, str] | None:
+    candidates = []
+    # EPUB 3: <item properties="cover-image">
+    candidates += [(path, mtype) for path, mtype, props in package.manifest.values() if "cover-image" in props]
+    # EPUB 2: <meta name="cover" content="item-id">
+    for meta in package.root.iterfind(".//{*}metadata/{*}meta"):
+        if meta.get("name") == "cover":
+            entry = package.manifest.get(meta.get("content"))
+            if entry:
+                candidates.append(entry[:2])
+    # Heuristic: an image whose id or path mentions "cover".
+    candidates += [
+        (path, mtype)
+        for item_id, (path, mtype, _) in package.manifest.items()
+        if mtype.startswith("image/") and ("cover" in item_id.lower() or "cover" in path.lower())
+    ]
+    for path, mtype in candidates:
+        if not mtype.startswith("image/"):
+            continue
+        raw = _read_member(zf, path)
+        if raw:
+            return raw, mtype
+    return None
+
+
+def _dc(package: _Package, name: str) -> list[str]:
+    values = []
+    for el in package.root.iterfind(f".//{{*}}metadata/{{*}}{name}"):
+        text = _clean("".join(el.itertext()))
+        if text:
+            values.append(text)
+    return values
+
+
+def extract_metadata(data: bytes) -> dict:
+    """Return OPF metadata, the table of contents and the cover image of an EPUB.
+
+    Keys: ``title``, ``authors`` (list), ``language``, ``publisher``,
+    ``published``, ``description``, ``toc`` (list of ``{"level", "title", "href"}``)
+    and ``cover`` (``(bytes, media_type)`` or None).
+
+    Raises:
+        EpubError: if ``data`` is not a readable EPUB archive
+    """
+    with _open(data) as zf:
+        package = _read_package(zf)
+        if package is None:
+            raise EpubError("No OPF package document")
+
+        def first(name):
+            values = _dc(package, name)
+            return values[0][:500] if values else None
+
+        description = first("description")
+        if description:
+            description = html_to_text(description)[1][:2000]
+        return {
+            "title": first("title"),
+            "authors": [a[:300] for a in _dc(package, "creator")][:20],
+            "language": first("language"),
+            "publisher": first("publisher"),
+            "published": first("date"),
+            "description": description,
+            "toc": _read_toc(zf, package),
+            "cover": _find_cover(zf, package),
+        }
+
+
+def make_cover_thumbnail(data: bytes, media_type: str, max_size: int) -> tuple[bytes, str] | None:
+    """Downscale a cover to fit ``max_size`` pixels as JPEG.
+
+    Without Pillow, small covers are returned unchanged and large ones dropped.
+    """
+    if Image is None:
+        return (data, media_type) if len(data) <= MAX_RAW_COVER_BYTES else None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("RGB", (max_size, max_size))
+            img = img.convert("RGB")
+            img.thumbnail((max_size, max_size))
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=80, optimize=True, progressive=True)
+            return out.getvalue(), "image/jpeg"
+    except Exception:
+        # Pillow raises a wide range of errors on corrupt or hostile images.
+        return None
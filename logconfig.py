@@ -0,0 +1,180 @@
+"""Process-wide logging setup.
+
+Request threads only build a ``LogRecord`` and put it on a queue; a single
+listener thread formats and writes it. Configuration comes from the
+environment:
+
+- ``LOG_LEVEL``: root level for the ``localreader`` loggers (default ``INFO``).
+- ``LOG_LEVELS``: per-logger overrides, e.g. ``localreader.app=WARNING,localreader.server.access=INFO``.
+- ``LOG_SAMPLE``: per-logger keep ratio for high-frequency events, e.g.
+  ``localreader.server.position=0.1``. Child loggers inherit their parent's rate.
+- ``LOG_FORMAT``: ``text`` (default) or ``json``.
+"""
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+import metrics
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_SAMPLE = os.environ.get("LOG_SAMPLE", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").strip().lower()
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+LOG_RECORDS_DROPPED = metrics.counter(
+    "localreader_log_records_sampled_out_total",
+    "Log records dropped by LOG_SAMPLE.",
+    ("logger",),
+)
+
+# Attributes every LogRecord has; anything else came from ``extra=`` and is
+# emitted as a structured field by JsonFormatter.
+_RESERVED_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+def _parse_mapping(spec: str) -> dict[str, str]:
+    out = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip() and value.strip():
+            out[name.strip()] = value.strip()
+    return out
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra=`` fields are kept as top-level keys."""
+
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records from selected loggers (and their children)."""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self._rates = rates
+        self._resolved: dict[str, float] = {}
+
+    def _rate_for(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            probe = name
+            while probe:
+                if probe in self._rates:
+                    rate = self._rates[probe]
+                    break
+                probe = probe.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.inc(record.name)
+        return False
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stock ``prepare()`` renders ``msg % args`` on the calling thread. The
+    queue never leaves this process, so the record can be handed over as-is.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def configure_logging() -> None:
+    """Install the queue-based pipeline. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    sink = logging.StreamHandler(sys.stderr)
+    sink.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+
+    rates = {}
+    for name, value in _parse_mapping(LOG_SAMPLE).items():
+        try:
+            rates[name] = max(0.0, min(1.0, float(value)))
+        except ValueError:
+            pass
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+    for name, level in _parse_mapping(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(getattr(logging, level.upper(), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(log_queue, sink, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+@contextlib.contextmanager
+def paused():
+    """Stop the listener thread around ``os.fork()``.
+
+    A forked child has no threads: without this it would queue records that
+    nothing writes, and a lock the listener held at fork time would never be
+    released. Parent and child each restart their own listener afterwards.
+    """
+    listener = _listener
+    if listener is not None:
+        listener.stop()
+    try:
+        yield
+    finally:
+        if listener is not None:
+            listener.start()
@@ -0,0 +1,463 @@
+"""Background database maintenance: checkpoints, statistics, free-space reclaim.
+
+One daemon thread wakes every ``TICK_SECONDS`` and runs each task whose
+interval has elapsed:
+
+* ``checkpoint`` (every 5 minutes): a PASSIVE WAL checkpoint, or a TRUNCATE
+  one when the server is quiet, so the ``-wal`` file does not stay at its
+  high-water mark.
+* ``analyze`` (daily): ``ANALYZE`` with ``analysis_limit`` so the query
+  planner's statistics follow the data.
+* ``vacuum`` (daily): ``PRAGMA incremental_vacuum`` in small steps until the
+  free list is empty or ``MAINTENANCE_BUDGET_SECONDS`` is used up. Needs
+  ``auto_vacuum=INCREMENTAL``, which new databases get; convert an older one
+  once with ``python maintenance.py --vacuum``.
+* ``tombstones`` (daily): :func:`app.compact_tombstones`.
+* ``blobs`` (daily): delete on-disk document copies (:mod:`blobstore`) that no
+  file references any more, and objects in the blob store (:mod:`storage`) no
+  file has referenced for ``BLOB_STORE_GRACE_DAYS``.
+* ``tts_audio`` (hourly): apply the audio cache's size limits and delete
+  audio files nothing refers to (:mod:`ttscache`).
+* ``backup`` (every ``BACKUP_INTERVAL_HOURS``, off by default): an incremental
+  snapshot with :mod:`backup`.
+
+All but ``checkpoint`` wait for a quiet moment: inside ``MAINTENANCE_WINDOW``
+(if set) and with no request for ``MAINTENANCE_IDLE_SECONDS``. A task that
+could not find one for three intervals runs anyway. Last run times are kept
+in the ``maintenance_state`` table, so restarts do not repeat daily work.
+:func:`stop` ends with ``PRAGMA optimize``.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import app
+import backup
+import blobstore
+import logconfig
+import metrics
+import shared
+import storage
+import ttscache
+
+logger = logging.getLogger("localreader.maintenance")
+
+ENABLED = os.environ.get("MAINTENANCE_ENABLED", "true").strip().lower() in {"1", "true", "yes"}
+# Local time range such as "02:00-05:00" (may wrap midnight); empty means any time.
+MAINTENANCE_WINDOW = os.environ.get("MAINTENANCE_WINDOW", "").strip()
+MAINTENANCE_IDLE_SECONDS = float(os.environ.get("MAINTENANCE_IDLE_SECONDS", "60"))
+MAINTENANCE_BUDGET_SECONDS = float(os.environ.get("MAINTENANCE_BUDGET_SECONDS", "10"))
+BACKUP_INTERVAL_HOURS = float(os.environ.get("BACKUP_INTERVAL_HOURS", "0"))
+TICK_SECONDS = 30.0
+OVERDUE_FACTOR = 3
+ANALYSIS_LIMIT = 1000
+VACUUM_STEP_PAGES = 256
+VACUUM_STEP_SLEEP = 0.05
+
+RUNS = metrics.counter(
+    "localreader_maintenance_runs_total",
+    "Maintenance task runs by result (ok, skipped, error).",
+    ("task", "result"),
+)
+DURATION = metrics.histogram(
+    "localreader_maintenance_duration_seconds",
+    "Wall time of maintenance tasks.",
+    ("task",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+RECLAIMED = metrics.counter(
+    "localreader_maintenance_reclaimed_bytes_total",
+    "Disk space returned by maintenance (WAL truncation, incremental vacuum, blob sweep).",
+    ("task",),
+)
+DB_BYTES = metrics.gauge(
+    "localreader_db_file_bytes",
+    "Size of the database files.",
+    ("file",),
+)
+DB_FREE_BYTES = metrics.gauge(
+    "localreader_db_freelist_bytes",
+    "Unused pages inside the database file.",
+)
+
+shared.write("last_request", time.monotonic())
+
+
+def note_request() -> None:
+    """Called by the server for every request; quiet tasks wait for a pause.
+
+    Kept in shared memory, so with several workers the one running maintenance
+    sees the traffic of all of them.
+    """
+    shared.write("last_request", time.monotonic())
+
+
+def _minutes(hhmm: str) -> int:
+    hours, _, minutes = hhmm.strip().partition(":")
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def _parse_window(spec: str):
+    if not spec:
+        return None
+    try:
+        start, end = spec.split("-")
+        return _minutes(start), _minutes(end)
+    except ValueError:
+        logger.warning("Ignoring invalid MAINTENANCE_WINDOW=%r (expected HH:MM-HH:MM)", spec)
+        return None
+
+
+def _in_window(window, now: float | None = None) -> bool:
+    if window is None:
+        return True
+    t = time.localtime(now)
+    minute = t.tm_hour * 60 + t.tm_min
+    start, end = window
+    return start <= minute < end if start <= end else minute >= start or minute < end
+
+
+def _connect(path: str, timeout: float = 1.0):
+    # Short busy timeout: maintenance yields to request traffic instead of queueing behind it.
+    return sqlite3.connect(path, timeout=timeout, isolation_level=None)
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def refresh_gauges() -> None:
+    # Summed over the catalog and every shard (see app.DB_SHARDS).
+    paths = app.database_paths()
+    DB_BYTES.set(sum(_file_size(p) for p in paths), "db")
+    DB_BYTES.set(sum(_file_size(p + "-wal") for p in paths), "wal")
+    try:
+        free_bytes = 0
+        for path in paths:
+            conn = _connect(path)
+            try:
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            finally:
+                conn.close()
+            free_bytes += free * page_size
+        DB_FREE_BYTES.set(free_bytes)
+    except sqlite3.Error:
+        pass
+
+
+# ---- Tasks: each returns the number of bytes reclaimed ---------------------
+
+
+def checkpoint(quiet: bool = False) -> int:
+    return sum(_checkpoint(path, quiet) for path in app.database_paths())
+
+
+def _checkpoint(path: str, quiet: bool) -> int:
+    conn = _connect(path)
+    try:
+        if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+            return 0
+        before = _file_size(path + "-wal")
+        # TRUNCATE waits for readers and blocks new writers briefly; only when idle.
+        mode = "TRUNCATE" if quiet else "PASSIVE"
+        busy, frames, done = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        conn.close()
+    reclaimed = max(0, before - _file_size(path + "-wal"))
+    logger.debug(
+        "checkpoint: db=%s mode=%s busy=%s frames=%s checkpointed=%s reclaimed=%d",
+        path, mode, busy, frames, done, reclaimed,
+    )
+    return reclaimed
+
+
+def analyze() -> int:
+    for path in app.database_paths():
+        conn = _connect(path, timeout=30)
+        try:
+            # Approximate statistics: bounded cost however large the tables grow.
+            conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+    return 0
+
+
+def incremental_vacuum(budget: float = MAINTENANCE_BUDGET_SECONDS) -> int:
+    deadline = time.monotonic() + budget
+    return sum(_incremental_vacuum(path, deadline) for path in app.database_paths())
+
+
+def _incremental_vacuum(path: str, deadline: float) -> int:
+    conn = _connect(path)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free:
+                logger.info("vacuum: %d free pages in %s; run 'python maintenance.py --vacuum' once to enable incremental vacuum", free, path)
+            return 0
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        freed = 0
+        while time.monotonic() < deadline:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            # Each step is its own short write transaction. executescript, because
+            # execute() steps the pragma once and so frees a single page.
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});")
+            freed += free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            time.sleep(VACUUM_STEP_SLEEP)
+    finally:
+        conn.close()
+    return freed * page_size
+
+
+def compact_tombstones() -> int:
+    app.compact_tombstones()
+    return 0
+
+
+def sweep_blobs() -> int:
+    freed = blobstore.sweep(app.referenced_content_hashes())
+    store = storage.store()
+    if store is not None:
+        # At least an hour: objects are stored before the row referencing them commits.
+        grace = max(3600, storage.BLOB_STORE_GRACE_DAYS * 86400)
+        referenced = app.referenced_object_keys()
+        unreferenced = {key: size for key, size, _ in store.list() if key not in referenced}
+        for key in app.expire_blob_orphans(set(unreferenced), grace):
+            if app.delete_orphan_blob(key, grace):
+                freed += unreferenced[key]
+                logger.info("Deleted stored object: key=%s bytes=%d", key[:16] + key[64:], unreferenced[key])
+    return freed
+
+
+def trim_tts_audio() -> int:
+    if not ttscache.enabled():
+        return 0
+    return ttscache.evict() + ttscache.sweep()
+
+
+def scheduled_backup() -> int:
+    if not backup.job.start(incremental=True):
+        raise _Skip("backup already running")
+    return 0
+
+
+def optimize() -> None:
+    """``PRAGMA optimize``: refresh statistics the planner noticed were stale."""
+    for path in app.database_paths():
+        conn = _connect(path, timeout=5)
+        try:
+            conn.execute("PRAGMA analysis_limit = 400")
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.close()
+
+
+def full_vacuum() -> None:
+    """Rebuild each database file and switch it to incremental auto-vacuum. Blocks writers."""
+    for path in app.database_paths():
+        conn = _connect(path, timeout=30)
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+
+class _Skip(Exception):
+    pass
+
+
+class _Task:
+    __slots__ = ("name", "interval", "quiet", "fn")
+
+    def __init__(self, name, interval, quiet, fn):
+        self.name = name
+        self.interval = interval
+        self.quiet = quiet
+        self.fn = fn
+
+
+def _tasks() -> list[_Task]:
+    tasks = [
+        _Task("checkpoint", 300, False, checkpoint),
+        _Task("analyze", 86400, True, analyze),
+        _Task("vacuum", 86400, True, incremental_vacuum),
+        _Task("tombstones", 86400, True, compact_tombstones),
+        _Task("blobs", 86400, True, sweep_blobs),
+        _Task("tts_audio", 3600, True, trim_tts_audio),
+    ]
+    if BACKUP_INTERVAL_HOURS > 0:
+        tasks.append(_Task("backup", BACKUP_INTERVAL_HOURS * 3600, True, scheduled_backup))
+    return tasks
+
+
+def _load_last_runs() -> dict[str, float]:
+    with sqlite3.connect(app.DB_PATH, timeout=30) as conn:
+        return dict(conn.execute("SELECT task, last_run_at FROM maintenance_state"))
+
+
+def _save_last_run(name: str, when: float) -> None:
+    with sqlite3.connect(app.DB_PATH, timeout=30) as conn:
+        conn.execute(
+            "INSERT INTO maintenance_state (task, last_run_at) VALUES (?, ?) "
+            "ON CONFLICT(task) DO UPDATE SET last_run_at = excluded.last_run_at",
+            (name, when),
+        )
+
+
+def run_task(task: _Task, quiet: bool) -> bool:
+    """Run one task and record its metrics. Returns False if it was skipped or failed."""
+    start = time.perf_counter()
+    try:
+        # Only the checkpoint changes with traffic (TRUNCATE when quiet).
+        reclaimed = task.fn(quiet) if task.fn is checkpoint else task.fn()
+    except _Skip as e:
+        RUNS.inc(task.name, "skipped")
+        logger.info("Maintenance %s skipped: %s", task.name, e)
+        return False
+    except sqlite3.OperationalError as e:
+        if "locked" not in str(e).lower() and "busy" not in str(e).lower():
+            RUNS.inc(task.name, "error")
+            logger.exception("Maintenance %s failed", task.name)
+            return False
+        RUNS.inc(task.name, "skipped")
+        logger.info("Maintenance %s skipped: database busy", task.name)
+        return False
+    except Exception:
+        RUNS.inc(task.name, "error")
+        logger.exception("Maintenance %s failed", task.name)
+        return False
+    seconds = time.perf_counter() - start
+    RUNS.inc(task.name, "ok")
+    DURATION.observe(seconds, task.name)
+    if reclaimed:
+        RECLAIMED.inc(task.name, amount=reclaimed)
+    log = logger.debug if task.name == "checkpoint" else logger.info
+    log("Maintenance %s done: seconds=%.3f reclaimed_bytes=%d", task.name, seconds, reclaimed)
+    return True
+
+
+class Scheduler:
+    def __init__(self):
+        self._tasks = _tasks()
+        self._window = _parse_window(MAINTENANCE_WINDOW)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+        logger.info(
+            "Maintenance scheduler started: window=%s idle=%ss tasks=%s",
+            MAINTENANCE_WINDOW or "any",
+            MAINTENANCE_IDLE_SECONDS,
+            ",".join(t.name for t in self._tasks),
+        )
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def quiet(self) -> bool:
+        idle = time.monotonic() - shared.read("last_request") >= MAINTENANCE_IDLE_SECONDS
+        return idle and _in_window(self._window)
+
+    def _run(self):
+        try:
+            last_runs = _load_last_runs()
+        except sqlite3.Error:
+            logger.exception("Maintenance: cannot read maintenance_state")
+            last_runs = {}
+        refresh_gauges()
+        while not self._stopping.wait(TICK_SECONDS):
+            ran = False
+            for task in self._tasks:
+                if self._stopping.is_set():
+                    break
+                now = time.time()
+                since = now - last_runs.get(task.name, 0.0)
+                if since < task.interval:
+                    continue
+                quiet = self.quiet()
+                if task.quiet and not quiet and since < OVERDUE_FACTOR * task.interval:
+                    continue
+                run_task(task, quiet)
+                # Failures also wait a full interval: no hammering a locked database.
+                last_runs[task.name] = now
+                ran = True
+                if task.quiet:
+                    try:
+                        _save_last_run(task.name, now)
+                    except sqlite3.Error:
+                        logger.warning("Maintenance: could not record last run of %s", task.name)
+            if ran:
+                refresh_gauges()
+
+
+_scheduler = None
+
+
+def start() -> None:
+    global _scheduler
+    if ENABLED and _scheduler is None:
+        _scheduler = Scheduler()
+        _scheduler.start()
+
+
+def stop() -> None:
+    """Stop the scheduler and leave the planner statistics current."""
+    if _scheduler is not None:
+        _scheduler.stop()
+    try:
+        optimize()
+    except sqlite3.Error as e:
+        logger.warning("PRAGMA optimize on shutdown failed: %s", e)
+
+
+def main(argv=None):
+    names = [t.name for t in _tasks()]
+    parser = argparse.ArgumentParser(description="Run LocalReader database maintenance now (safe while server.py runs).")
+    parser.add_argument("tasks", nargs="*", metavar="TASK", help=f"tasks to run: {', '.join(names)} (default: all)")
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="rebuild the database with VACUUM and enable incremental vacuum (blocks writes while it runs)",
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.tasks) - set(names) - {"all"}
+    if unknown:
+        parser.error(f"unknown task(s): {', '.join(sorted(unknown))}")
+    logconfig.configure_logging()
+    app.init_db()
+    if args.vacuum:
+        before = sum(_file_size(p) for p in app.database_paths())
+        start = time.perf_counter()
+        full_vacuum()
+        logger.info(
+            "VACUUM done: seconds=%.1f bytes %d -> %d",
+            time.perf_counter() - start, before, sum(_file_size(p) for p in app.database_paths()),
+        )
+    selected = names if not args.tasks or "all" in args.tasks else args.tasks
+    ok = True
+    for task in _tasks():
+        if task.name in selected:
+            ok = run_task(task, quiet=True) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,274 @@
+"""Local store of Piper voice models.
+
+Voices (``*.onnx`` plus their ``*.onnx.json`` config, tens of MB each) are
+fetched from ``MODEL_UPSTREAM`` (the rhasspy/piper-voices repository by
+default) the first time any device asks for them, checked against the size and
+MD5 listed in the upstream ``voices.json``, and kept under ``MODEL_DIR``. From
+then on every device downloads them from this server, with ``Range`` support
+and the file's SHA-256 as a strong ETag so interrupted downloads resume.
+
+Only files listed in ``voices.json`` can be fetched; the catalog itself is
+refreshed at most every ``MODEL_CATALOG_TTL_HOURS`` and a stale copy is used
+while upstream is unreachable. Callers pass ``fetch=False`` to serve only what
+is already stored (anonymous requests), and fetching stops once MODEL_DIR holds
+``MODEL_DIR_MAX_BYTES``.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import app
+import metrics
+
+logger = logging.getLogger("localreader.models")
+
+MODEL_DIR = os.environ.get("MODEL_DIR") or os.path.join(os.path.dirname(app.DB_PATH) or ".", "models")
+MODEL_UPSTREAM = os.environ.get(
+    "MODEL_UPSTREAM", "https://huggingface.co/rhasspy/piper-voices/resolve/main/"
+).rstrip("/") + "/"
+MODEL_CATALOG_TTL_HOURS = float(os.environ.get("MODEL_CATALOG_TTL_HOURS", "24"))
+MODEL_FETCH_TIMEOUT = int(os.environ.get("MODEL_FETCH_TIMEOUT", "60"))
+MODEL_DIR_MAX_BYTES = int(os.environ.get("MODEL_DIR_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+MODEL_MAX_BYTES = 512 * 1024 * 1024
+CATALOG = "voices.json"
+CHUNK = 1024 * 1024
+# Voice files, unlike the catalog, don't change once published.
+FILE_SUFFIXES = (".onnx", ".onnx.json")
+_INDEX_NAME = ".index.json"
+
+FETCHED = metrics.counter(
+    "localreader_model_fetched_bytes_total",
+    "Model bytes downloaded from MODEL_UPSTREAM.",
+)
+SERVED = metrics.counter(
+    "localreader_model_served_bytes_total",
+    "Model bytes sent to clients.",
+)
+
+
+class ModelError(Exception):
+    pass
+
+
+class NotStored(ModelError):
+    """The file would have to be fetched, and the caller passed ``fetch=False``."""
+
+
+class StoreFull(ModelError):
+    """Fetching the file would take MODEL_DIR past MODEL_DIR_MAX_BYTES."""
+
+
+_lock = threading.Lock()
+# path -> lock, so concurrent requests for one missing file fetch it once.
+_fetch_locks: dict[str, threading.Lock] = {}
+# path -> {"size", "mtime_ns", "sha256"}; persisted in MODEL_DIR/.index.json
+_index: dict[str, dict] | None = None
+# Bytes of downloads in progress, counted against MODEL_DIR_MAX_BYTES.
+_reserved = 0
+
+
+def _local_path(path: str) -> str:
+    return os.path.join(MODEL_DIR, *path.split("/"))
+
+
+def _load_index() -> dict:
+    global _index
+    if _index is None:
+        try:
+            with open(os.path.join(MODEL_DIR, _INDEX_NAME), encoding="utf-8") as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+
+def _save_index() -> None:
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    tmp = os.path.join(MODEL_DIR, f"{_INDEX_NAME}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_index, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(MODEL_DIR, _INDEX_NAME))
+
+
+def _valid_path(path: str) -> bool:
+    parts = path.split("/")
+    return bool(path) and all(p and not p.startswith(".") for p in parts)
+
+
+def stat(path: str) -> dict | None:
+    """{"path", "size", "sha256"} of a stored file, or None if not stored."""
+    if not _valid_path(path):
+        return None
+    try:
+        st = os.stat(_local_path(path))
+    except OSError:
+        return None
+    with _lock:
+        index = _load_index()
+        entry = index.get(path)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return {"path": path, "size": entry["size"], "sha256": entry["sha256"]}
+    # Placed by hand or changed on disk: hash it once.
+    digest = hashlib.sha256()
+    with open(_local_path(path), "rb") as f:
+        while chunk := f.read(CHUNK):
+            digest.update(chunk)
+    with _lock:
+        _load_index()[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest.hexdigest()}
+        _save_index()
+    return {"path": path, "size": st.st_size, "sha256": digest.hexdigest()}
+
+
+def _reserve(path: str, size: int) -> None:
+    global _reserved
+    with _lock:
+        index = _load_index()
+        used = sum(e["size"] for p, e in index.items() if p != path) + _reserved
+        if used + size > MODEL_DIR_MAX_BYTES:
+            raise StoreFull(f"{path}: {used} of {MODEL_DIR_MAX_BYTES} bytes already stored")
+        _reserved += size
+
+
+def _release(size: int) -> None:
+    global _reserved
+    with _lock:
+        _reserved -= size
+
+
+def _download(path: str, expected: dict | None) -> None:
+    """Fetch ``path`` from upstream into MODEL_DIR, verifying it against ``expected``."""
+    reserved = (expected or {}).get("size_bytes") or 0
+    _reserve(path, reserved)
+    try:
+        _fetch(path, expected)
+    finally:
+        _release(reserved)
+
+
+def _fetch(path: str, expected: dict | None) -> None:
+    dest = _local_path(path)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    url = MODEL_UPSTREAM + path
+    started = time.monotonic()
+    md5, sha256, size = hashlib.md5(), hashlib.sha256(), 0
+    try:
+        with urllib.request.urlopen(url, timeout=MODEL_FETCH_TIMEOUT) as resp, open(tmp, "wb") as out:
+            while chunk := resp.read(CHUNK):
+                size += len(chunk)
+                if size > MODEL_MAX_BYTES:
+                    raise ModelError(f"{path} exceeds {MODEL_MAX_BYTES} bytes")
+                md5.update(chunk)
+                sha256.update(chunk)
+                out.write(chunk)
+        FETCHED.inc(amount=size)
+        if expected:
+            if expected.get("size_bytes") not in (None, size):
+                raise ModelError(f"{path}: expected {expected['size_bytes']} bytes, got {size}")
+            if expected.get("md5_digest") not in (None, md5.hexdigest()):
+                raise ModelError(f"{path}: MD5 mismatch")
+        os.replace(tmp, dest)
+    except (OSError, urllib.error.URLError) as e:
+        raise ModelError(f"Fetching {url} failed: {e}") from None
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    st = os.stat(dest)
+    with _lock:
+        _load_index()[path] = {"size": size, "mtime_ns": st.st_mtime_ns, "sha256": sha256.hexdigest()}
+        _save_index()
+    logger.info("Model fetched: path=%s bytes=%d seconds=%.1f", path, size, time.monotonic() - started)
+
+
+def _fetch_lock(path: str) -> threading.Lock:
+    with _lock:
+        return _fetch_locks.setdefault(path, threading.Lock())
+
+
+def catalog(fetch: bool = True) -> dict:
+    """The upstream ``voices.json``, refreshed when older than MODEL_CATALOG_TTL_HOURS."""
+    path = _local_path(CATALOG)
+    if not fetch:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except OSError:
+            raise NotStored(CATALOG) from None
+    with _fetch_lock(CATALOG):
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            age = None
+        if age is None or age > MODEL_CATALOG_TTL_HOURS * 3600:
+            try:
+                _download(CATALOG, None)
+            except ModelError as e:
+                if age is None:
+                    raise
+                logger.warning("Using stale voice catalog: %s", e)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def voice_files(voice_id: str, fetch: bool = True) -> dict:
+    """``{path: {"size_bytes", "md5_digest"}}`` of a voice's model and config."""
+    voice = catalog(fetch).get(voice_id)
+    if not isinstance(voice, dict):
+        raise KeyError(voice_id)
+    files = voice.get("files") or {}
+    return {p: meta for p, meta in files.items() if p.endswith(FILE_SUFFIXES)}
+
+
+def _expected(path: str) -> dict | None:
+    """Catalog entry for ``path``, or None if no voice lists it."""
+    for voice in catalog().values():
+        meta = (voice.get("files") or {}).get(path) if isinstance(voice, dict) else None
+        if meta is not None:
+            return meta
+    return None
+
+
+def ensure(path: str, fetch: bool = True) -> dict | None:
+    """Stat of ``path``, fetching it first if needed. None if it is not a known model file.
+
+    With ``fetch=False`` a file that is not stored raises :class:`NotStored`.
+    """
+    if not _valid_path(path):
+        return None
+    if path == CATALOG:
+        catalog(fetch)
+        return stat(path)
+    found = stat(path)
+    if found is not None:
+        return found
+    if not fetch:
+        raise NotStored(path)
+    if not path.endswith(FILE_SUFFIXES):
+        return None
+    expected = _expected(path)
+    if expected is None:
+        return None
+    with _fetch_lock(path):
+        found = stat(path)
+        if found is None:
+            _download(path, expected)
+            found = stat(path)
+    return found
+
+
+def open_file(path: str):
+    return open(_local_path(path), "rb")
+
+
+def manifest(voice_id: str | None = None, fetch: bool = True) -> list[dict]:
+    """Stored files, or (fetching what is missing) the files of one voice."""
+    if voice_id is not None:
+        return [ensure(p, fetch) for p in sorted(voice_files(voice_id, fetch))]
+    with _lock:
+        paths = sorted(p for p in _load_index() if p != CATALOG)
+    return [s for s in (stat(p) for p in paths) if s is not None]
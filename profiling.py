@@ -0,0 +1,242 @@
+"""Opt-in profiling of live requests.
+
+A request is profiled when ``PROFILE_SAMPLE_RATE`` selects it at random, or
+when an admin sends ``X-Profile: 1``. Two modes are available
+(``PROFILE_MODE``):
+
+- ``sample`` (default): a background thread snapshots the stacks of the
+  threads being profiled every ``PROFILE_SAMPLE_INTERVAL_MS`` and counts
+  collapsed stacks per route (flamegraph.pl / speedscope input). Overhead does
+  not depend on call counts, and concurrent requests are fine.
+- ``cprofile``: deterministic ``cProfile`` over the whole handler. Results are
+  merged per route into one ``pstats`` table. Since Python 3.12 the profiler
+  hook sees every thread, so the calls of concurrent requests would land in
+  the profiled route's stats: a request is only profiled when it is the only
+  one running in the process, and its profile is discarded (counted as
+  ``skipped``) if another request starts meanwhile. Useful on an idle server,
+  with ``X-Profile: 1``; under load few or no requests get profiled.
+
+Aggregates live in memory until :meth:`ProfileStore.reset`.
+"""
+import cProfile
+import collections
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "sample").strip().lower()
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_STACK_DEPTH = int(os.environ.get("PROFILE_MAX_STACK_DEPTH", "64"))
+
+MODES = ("cprofile", "sample")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class ProfileStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict[str, pstats.Stats] = {}
+        self._stacks: dict[str, collections.Counter] = {}
+        self._requests: collections.Counter = collections.Counter()
+        self._skipped: collections.Counter = collections.Counter()
+
+    def add_skipped(self, route: str) -> None:
+        """A request that could not be profiled alone (cprofile mode)."""
+        with self._lock:
+            self._skipped[route] += 1
+
+    def add_cprofile(self, route: str, profiler: cProfile.Profile) -> None:
+        with self._lock:
+            self._requests[route] += 1
+            existing = self._stats.get(route)
+            if existing is None:
+                self._stats[route] = pstats.Stats(profiler)
+            else:
+                existing.add(profiler)
+
+    def add_stacks(self, route: str, stacks: collections.Counter) -> None:
+        with self._lock:
+            self._requests[route] += 1
+            if stacks:
+                self._stacks.setdefault(route, collections.Counter()).update(stacks)
+
+    def summary(self) -> list[dict]:
+        with self._lock:
+            return [
+                {
+                    "route": route,
+                    "requests": self._requests[route],
+                    "pstats": route in self._stats,
+                    "collapsed": route in self._stacks,
+                    "samples": sum(self._stacks[route].values()) if route in self._stacks else 0,
+                    "skipped": self._skipped[route],
+                }
+                for route in sorted({*self._requests, *self._skipped})
+            ]
+
+    def pstats_bytes(self, route: str) -> bytes | None:
+        """Marshalled stats, loadable with ``pstats.Stats(path)``."""
+        with self._lock:
+            stats = self._stats.get(route)
+            return marshal.dumps(stats.stats) if stats is not None else None
+
+    def collapsed_text(self, route: str) -> str | None:
+        with self._lock:
+            stacks = self._stacks.get(route)
+            if stacks is None:
+                return None
+            return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._stacks.clear()
+            self._requests.clear()
+            self._skipped.clear()
+
+
+class _Sampler:
+    """Single daemon thread sampling the stacks of registered threads."""
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._active: dict[int, collections.Counter] = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def register(self, thread_id: int) -> collections.Counter:
+        counter = collections.Counter()
+        with self._lock:
+            self._active[thread_id] = counter
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return counter
+
+    def unregister(self, thread_id: int) -> None:
+        with self._lock:
+            self._active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for thread_id, counter in active.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                labels = []
+                while frame is not None and len(labels) < PROFILE_MAX_STACK_DEPTH:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.reverse()
+                counter[";".join(labels)] += 1
+            time.sleep(self._interval)
+
+
+# Requests running in this process, and whether one started while a cProfile
+# was active (its stats would then include that request's calls).
+_running = 0
+_cprofile_active = False
+_cprofile_overlapped = False
+_running_lock = threading.Lock()
+
+
+def request_started() -> None:
+    global _running, _cprofile_overlapped
+    with _running_lock:
+        _running += 1
+        if _cprofile_active:
+            _cprofile_overlapped = True
+
+
+def request_finished() -> None:
+    global _running
+    with _running_lock:
+        _running -= 1
+
+
+def _start_cprofile() -> bool:
+    """Claim the profiler hook if the calling request is the only one running."""
+    global _cprofile_active, _cprofile_overlapped
+    with _running_lock:
+        if _cprofile_active or _running > 1:
+            return False
+        _cprofile_active = True
+        _cprofile_overlapped = False
+        return True
+
+
+def _stop_cprofile() -> bool:
+    """Release the hook. Returns whether the profile covered this request alone."""
+    global _cprofile_active
+    with _running_lock:
+        _cprofile_active = False
+        return not _cprofile_overlapped
+
+
+class RequestProfile:
+    """Context manager profiling the calling thread for one request.
+
+    Enter it between :func:`request_started` and :func:`request_finished`.
+    """
+
+    __slots__ = ("_route", "_profiler", "_thread_id", "_stacks")
+
+    def __init__(self, route: str):
+        self._route = route
+        self._profiler = None
+        self._thread_id = None
+        self._stacks = None
+
+    def __enter__(self):
+        if PROFILE_MODE == "sample":
+            self._thread_id = threading.get_ident()
+            self._stacks = _sampler.register(self._thread_id)
+        elif _start_cprofile():
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Another profiling tool (e.g. a debugger) already owns the hook.
+                self._profiler = None
+                _stop_cprofile()
+        else:
+            store.add_skipped(self._route)
+        return self
+
+    def __exit__(self, *exc):
+        if self._profiler is not None:
+            self._profiler.disable()
+            if _stop_cprofile():
+                store.add_cprofile(self._route, self._profiler)
+            else:
+                store.add_skipped(self._route)
+        elif self._thread_id is not None:
+            _sampler.unregister(self._thread_id)
+            store.add_stacks(self._route, self._stacks)
+        return False
+
+
+store = ProfileStore()
+_sampler = _Sampler(max(0.001, PROFILE_SAMPLE_INTERVAL_MS / 1000.0))
+
+
+def should_profile(forced: bool = False) -> bool:
+    return forced or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
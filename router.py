@@ -0,0 +1,156 @@
+"""Declarative request router compiled once at import time.
+
+Routes are registered as ``(method, template) -> handler`` with per-route
+options (auth level, body parsing). Templates use ``{name}`` for a single path
+segment and ``{name:path}`` for a parameter that may contain ``/``.
+
+Matching is one dict lookup for literal paths; otherwise one match against a
+single precompiled alternation per method. Alternatives keep registration
+order, so more specific routes must be registered first, as with the old
+``re.match`` chain.
+"""
+import re
+from urllib.parse import parse_qs, unquote
+
+_PARAM_RE = re.compile(r"\{(\w+)(?::(path))?\}")
+
+# Route options
+AUTH_NONE = "none"
+AUTH_OPTIONAL = "optional"
+AUTH_USER = "user"
+AUTH_ADMIN = "admin"
+
+BODY_NONE = None
+BODY_JSON = "json"
+BODY_RAW = "raw"
+
+
+class Route:
+    __slots__ = ("method", "template", "handler", "auth", "body", "param_names", "regex_source")
+
+    def __init__(self, method, template, handler, auth, body):
+        self.method = method
+        self.template = template
+        self.handler = handler
+        self.auth = auth
+        self.body = body
+        self.param_names = []
+
+        pos = 0
+        parts = []
+        for m in _PARAM_RE.finditer(template):
+            parts.append(re.escape(template[pos : m.start()]))
+            self.param_names.append(m.group(1))
+            parts.append("(.+)" if m.group(2) == "path" else "([^/]+)")
+            pos = m.end()
+        parts.append(re.escape(template[pos:]))
+        self.regex_source = "".join(parts)
+
+    @property
+    def is_static(self) -> bool:
+        return not self.param_names
+
+
+class Request:
+    """Per-request data handed to route handlers."""
+
+    __slots__ = ("method", "path", "query_string", "params", "user", "body", "data", "_query")
+
+    def __init__(self, method, path, query_string, params):
+        self.method = method
+        self.path = path
+        self.query_string = query_string
+        self.params = params
+        self.user = None
+        self.body = b""
+        self.data = {}
+        self._query = None
+
+    @property
+    def query(self) -> dict[str, list[str]]:
+        if self._query is None:
+            self._query = parse_qs(self.query_string)
+        return self._query
+
+    def arg(self, name: str, default: str | None = None) -> str | None:
+        values = self.query.get(name)
+        return values[0] if values else default
+
+
+class _MethodTable:
+    __slots__ = ("routes", "regex", "group_routes")
+
+    def __init__(self):
+        self.routes = []
+        self.regex = None
+        self.group_routes = {}
+
+    def compile(self):
+        dynamic = [r for r in self.routes if not r.is_static]
+        if not dynamic:
+            self.regex = None
+            return
+        alternatives = []
+        self.group_routes = {}
+        group = 0
+        for idx, route in enumerate(dynamic):
+            # Each alternative ends with an empty named marker group so
+            # ``lastgroup`` identifies which route matched.
+            marker = f"_r{idx}"
+            alternatives.append(f"{route.regex_source}(?P<{marker}>)")
+            first = group + 1
+            group += len(route.param_names) + 1
+            self.group_routes[marker] = (route, first)
+        self.regex = re.compile("^(?:" + "|".join(alternatives) + ")$")
+
+
+class Router:
+    def __init__(self):
+        self._static: dict[tuple[str, str], Route] = {}
+        self._tables: dict[str, _MethodTable] = {}
+        self._any = _MethodTable()
+        self._any_static: dict[str, Route] = {}
+
+    def add(self, method: str, template: str, handler, *, auth=AUTH_USER, body=BODY_NONE) -> Route:
+        route = Route(method.upper(), template, handler, auth, body)
+        table = self._tables.setdefault(route.method, _MethodTable())
+        table.routes.append(route)
+        self._any.routes.append(route)
+        if route.is_static:
+            self._static.setdefault((route.method, template), route)
+            self._any_static.setdefault(template, route)
+        table.compile()
+        self._any.compile()
+        return route
+
+    def route(self, method: str, template: str, **options):
+        """Decorator form of :meth:`add`; returns the function unchanged."""
+
+        def decorator(fn):
+            self.add(method, template, fn, **options)
+            return fn
+
+        return decorator
+
+    def match(self, method: str | None, path: str):
+        """Return ``(route, params)`` or None. ``method=None`` matches any method."""
+        if method is None:
+            route = self._any_static.get(path)
+            table = self._any
+        else:
+            route = self._static.get((method, path))
+            table = self._tables.get(method)
+        if route is not None:
+            return route, {}
+        if table is None or table.regex is None:
+            return None
+        m = table.regex.match(path)
+        if m is None:
+            return None
+        route, first = table.group_routes[m.lastgroup]
+        groups = m.groups()
+        params = {name: unquote(groups[first - 1 + i]) for i, name in enumerate(route.param_names)}
+        return route, params
+
+    def routes(self) -> list[Route]:
+        return list(self._any.routes)
@@ -0,0 +1,186 @@
+"""A small S3 stand-in for trying ``BLOB_STORE=s3`` without a cloud account.
+
+Serves the requests :class:`storage.S3Store` makes (path-style PUT, GET with
+``Range``, HEAD, DELETE and ListObjectsV2) from files under a directory, and
+checks their SigV4 signatures::
+
+    python s3local.py --dir /tmp/s3 --port 9000 --access-key dev --secret-key dev-secret
+    BLOB_STORE=s3 BLOB_S3_ENDPOINT=http://127.0.0.1:9000 BLOB_S3_BUCKET=localreader \\
+        BLOB_S3_ACCESS_KEY=dev BLOB_S3_SECRET_KEY=dev-secret python server.py
+
+Buckets are created on first write. Not meant to face a network.
+"""
+import argparse
+import hashlib
+import hmac
+import os
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+import storage
+
+LIST_MAX_KEYS = 1000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "s3local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        self._send(status, f"<?xml version='1.0' encoding='UTF-8'?><Error><Code>{code}</Code></Error>".encode())
+
+    def _authorized(self, path, query, payload_hash) -> bool:
+        auth = self.headers.get("Authorization", "")
+        try:
+            fields = dict(part.strip().split("=", 1) for part in auth.split(" ", 1)[1].split(","))
+            names = fields["SignedHeaders"].split(";")
+            access_key, _, region, _, _ = fields["Credential"].split("/")
+        except (IndexError, KeyError, ValueError):
+            return False
+        headers = {name: self.headers.get(name, "") for name in names}
+        expected = storage.sigv4_authorization(
+            self.command, path, query, headers, payload_hash, region, access_key, self.server.secret_key
+        )
+        return access_key == self.server.access_key and hmac.compare_digest(expected, auth)
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query, keep_blank_values=True))
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        payload_hash = self.headers.get("x-amz-content-sha256", "")
+        if payload_hash != hashlib.sha256(body).hexdigest():
+            self._error(400, "XAmzContentSHA256Mismatch")
+            return
+        if not self._authorized(url.path, query, payload_hash):
+            self._error(403, "SignatureDoesNotMatch")
+            return
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+        if not bucket or ".." in key.split("/") or "." in bucket:
+            self._error(400, "InvalidRequest")
+            return
+        root = os.path.join(self.server.directory, bucket)
+        if not key:
+            if self.command == "GET" and query.get("list-type") == "2":
+                self._list(root, query)
+            else:
+                self._error(405, "MethodNotAllowed")
+            return
+        path = os.path.join(root, *key.split("/"))
+        if self.command == "PUT":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.upload"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+            self._send(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        elif self.command == "DELETE":
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._send(204)
+        elif not os.path.isfile(path):
+            self._error(404, "NoSuchKey")
+        else:
+            self._get(path)
+
+    def _get(self, path):
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        spec = self.headers.get("Range", "")
+        if spec.startswith("bytes="):
+            first, _, last = spec[6:].partition("-")
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self._error(416, "InvalidRange")
+                return
+        headers = {"Content-Length": str(end - start + 1), "Content-Type": "application/octet-stream", "Accept-Ranges": "bytes"}
+        if spec:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        self._send(206 if spec else 200, headers=headers)
+        if self.command == "GET":
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(remaining, storage.CHUNK))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+    def _list(self, root, query):
+        prefix = query.get("prefix", "")
+        after = query.get("continuation-token", "")
+        max_keys = min(int(query.get("max-keys", LIST_MAX_KEYS)), LIST_MAX_KEYS)
+        keys = []
+        for dirpath, _, names in os.walk(root):
+            for name in names:
+                if name.endswith(".upload"):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/")
+                if key.startswith(prefix) and key > after:
+                    keys.append(key)
+        keys.sort()
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        items = []
+        for key in page:
+            st = os.stat(os.path.join(root, *key.split("/")))
+            modified = datetime.fromtimestamp(st.st_mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            items.append(f"<Contents><Key>{escape(key)}</Key><LastModified>{modified}</LastModified><Size>{st.st_size}</Size></Contents>")
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        body = (
+            "<?xml version='1.0' encoding='UTF-8'?>"
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{token}{''.join(items)}"
+            "</ListBucketResult>"
+        )
+        self._send(200, body.encode(), {"Content-Type": "application/xml"})
+
+    do_GET = do_PUT = do_HEAD = do_DELETE = _handle
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a directory as a minimal S3-compatible endpoint (for development).")
+    parser.add_argument("--dir", default="s3local-data", help="where buckets and objects are kept")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--access-key", default="dev")
+    parser.add_argument("--secret-key", default="dev-secret")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    server.directory = args.dir
+    server.access_key = args.access_key
+    server.secret_key = args.secret_key
+    server.verbose = args.verbose
+    os.makedirs(args.dir, exist_ok=True)
+    print(f"s3local: serving {args.dir} on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""Load test for the sync server.
+
+Boots ``server.py`` against a throwaway database, seeds it with
+USERS x BOOKS x HIGHLIGHTS, then replays a weighted mix of sync traffic from
+CONCURRENCY client threads. Everything runs on localhost; no network access
+is needed.
+
+Results are printed as a table on stderr and written as JSON (stdout or
+``--output``) so they can be compared between runs:
+
+    python scripts/load-test.py --users 20 --books 30 --highlights 50 \\
+        --concurrency 8 --duration 30 --output bench.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import quote
+
+ROOT = (Path(__file__).resolve().parent / "..").resolve()
+sys.path.insert(0, str(ROOT))
+
+PASSWORD = "load-test-password"
+
+# Relative weights of each operation in the replayed traffic.
+DEFAULT_MIX = "list=10,meta=8,position=45,get_highlights=10,save_highlights=12,download=8,upload=4,login=3"
+
+
+def _parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip():
+            mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _db_size(db_path: Path) -> int:
+    total = 0
+    for suffix in ("", "-wal", "-shm"):
+        p = Path(str(db_path) + suffix)
+        if p.exists():
+            total += p.stat().st_size
+    return total
+
+
+def _file_id(user_idx: int, book_idx: int) -> str:
+    return f"file::book-{user_idx:04d}-{book_idx:04d}.pdf::{1000 + book_idx}::1700000000"
+
+
+def _highlights(count: int, rng: random.Random) -> list[dict]:
+    return [
+        {
+            "sentenceIndex": i * 3,
+            "color": "#ffda76",
+            "text": f"Highlighted sentence {i} " + "lorem ipsum " * rng.randint(2, 12),
+            "comment": "" if rng.random() < 0.7 else f"note {i}",
+        }
+        for i in range(count)
+    ]
+
+
+def _multipart(fields: dict, file_bytes: bytes, filename: str) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for name, value in fields.items():
+        chunks.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        )
+    chunks.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode("utf-8")
+    )
+    chunks.append(file_bytes)
+    chunks.append(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(chunks), f"multipart/form-data; boundary={boundary}"
+
+
+def seed(db_path: Path, users: int, books: int, highlights: int, book_bytes: int, seed_value: int) -> None:
+    os.environ["DB_PATH"] = str(db_path)
+    import app
+
+    app.DB_PATH = str(db_path)
+    app.init_db()
+    rng = random.Random(seed_value)
+    for u in range(users):
+        email = f"user{u:04d}@load.test"
+        app.create_user(email, PASSWORD)
+        for b in range(books):
+            file_id = _file_id(u, b)
+            app.add_file_with_id(file_id, f"Book {b}", rng.randbytes(book_bytes), "pdf", owner_email=email)
+            if highlights:
+                app.update_highlights(file_id, _highlights(highlights, rng), owner_email=email)
+
+
+class Client:
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: bytes | None = None, headers: dict | None = None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            resp = conn.getresponse()
+            data = resp.read()
+            return resp.status, data
+        finally:
+            conn.close()
+
+
+class Worker(threading.Thread):
+    def __init__(self, idx, args, client, tokens, mix, deadline, results, lock):
+        super().__init__(name=f"load-{idx}", daemon=True)
+        self.args = args
+        self.client = client
+        self.tokens = tokens
+        self.ops = list(mix)
+        self.weights = [mix[o] for o in self.ops]
+        self.deadline = deadline
+        self.results = results
+        self.lock = lock
+        self.rng = random.Random(args.seed + idx)
+        self.uploads = 0
+        self.idx = idx
+
+    def _record(self, op: str, elapsed: float, ok: bool):
+        with self.lock:
+            entry = self.results.setdefault(op, {"latencies": [], "errors": 0})
+            entry["latencies"].append(elapsed)
+            if not ok:
+                entry["errors"] += 1
+
+    def _call(self, op: str, method: str, path: str, body=None, headers=None, expect=(200,)):
+        start = time.perf_counter()
+        try:
+            status, _ = self.client.request(method, path, body, headers)
+            ok = status in expect
+        except (OSError, http.client.HTTPException):
+            ok = False
+        self._record(op, time.perf_counter() - start, ok)
+
+    def run(self):
+        budget = self.args.requests
+        while time.monotonic() < self.deadline:
+            if budget is not None:
+                with self.lock:
+                    if self.results.get("_issued", 0) >= budget:
+                        return
+                    self.results["_issued"] = self.results.get("_issued", 0) + 1
+            op = self.rng.choices(self.ops, self.weights)[0]
+            getattr(self, f"op_{op}")()
+
+    def _pick(self):
+        u = self.rng.randrange(self.args.users)
+        b = self.rng.randrange(self.args.books) if self.args.books else 0
+        auth = {"Authorization": f"Bearer {self.tokens[u]}"}
+        return u, b, auth
+
+    def op_list(self):
+        _, _, auth = self._pick()
+        self._call("list", "GET", "/api/files", headers=auth)
+
+    def op_meta(self):
+        u, b, auth = self._pick()
+        self._call("meta", "GET", f"/api/files/{quote(_file_id(u, b), safe='')}", headers=auth)
+
+    def op_position(self):
+        u, b, auth = self._pick()
+        path = f"/api/files/{quote(_file_id(u, b), safe='')}/position"
+        headers = {**auth, "Content-Type": "application/json"}
+        # Clients debounce position updates but still send short bursts while paging.
+        for _ in range(self.args.position_burst):
+            body = json.dumps({"position": {"page": self.rng.randrange(500), "sentence": self.rng.randrange(40)}})
+            self._call("position", "PUT", path, body.encode("utf-8"), headers)
+
+    def op_get_highlights(self):
+        u, b, auth = self._pick()
+        self._call("get_highlights", "GET", f"/api/files/{quote(_file_id(u, b), safe='')}/highlights", headers=auth)
+
+    def op_save_highlights(self):
+        u, b, auth = self._pick()
+        body = json.dumps({"highlights": _highlights(self.args.highlights + 1, self.rng)}).encode("utf-8")
+        path = f"/api/files/{quote(_file_id(u, b), safe='')}/highlights"
+        self._call("save_highlights", "PUT", path, body, {**auth, "Content-Type": "application/json"})
+
+    def op_download(self):
+        u, b, auth = self._pick()
+        self._call("download", "GET", f"/api/files/{quote(_file_id(u, b), safe='')}/download", headers=auth)
+
+    def op_upload(self):
+        u, _, auth = self._pick()
+        self.uploads += 1
+        file_id = f"file::upload-{self.idx}-{self.uploads}.pdf::{self.args.book_bytes}::1700000000"
+        body, content_type = _multipart(
+            {"file_id": file_id, "title": f"Upload {self.uploads}", "format": "pdf"},
+            self.rng.randbytes(self.args.book_bytes),
+            "upload.pdf",
+        )
+        self._call("upload", "POST", "/api/files", body, {**auth, "Content-Type": content_type}, expect=(201,))
+
+    def op_login(self):
+        u = self.rng.randrange(self.args.users)
+        body = json.dumps({"email": f"user{u:04d}@load.test", "password": PASSWORD}).encode("utf-8")
+        self._call("login", "POST", "/api/auth/login", body, {"Content-Type": "application/json"})
+
+
+OPERATIONS = [name[3:] for name in vars(Worker) if name.startswith("op_")]
+
+
+def _summarize(samples: list[float], errors: int, duration: float) -> dict:
+    lat = sorted(samples)
+    n = len(lat)
+    return {
+        "count": n,
+        "errors": errors,
+        "throughput_rps": round(n / duration, 2) if duration else 0.0,
+        "mean_ms": round(sum(lat) / n * 1000, 3) if n else 0.0,
+        "p50_ms": round(_percentile(lat, 50) * 1000, 3),
+        "p95_ms": round(_percentile(lat, 95) * 1000, 3),
+        "p99_ms": round(_percentile(lat, 99) * 1000, 3),
+        "max_ms": round(lat[-1] * 1000, 3) if n else 0.0,
+    }
+
+
+def _wait_for_server(client: Client, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server.py exited early with code {proc.returncode}")
+        try:
+            status, _ = client.request("GET", "/api/ping")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise SystemExit("server.py did not become ready in time")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--books", type=int, default=20, help="books per user")
+    parser.add_argument("--highlights", type=int, default=25, help="highlights per book")
+    parser.add_argument("--book-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of traffic")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many operations")
+    parser.add_argument("--position-burst", type=int, default=5)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted operations (default: {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for server.py (repeatable)")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    args = parser.parse_args(argv)
+
+    mix = _parse_mix(args.mix)
+    if args.books == 0:
+        for op in ("meta", "position", "get_highlights", "save_highlights", "download"):
+            mix.pop(op, None)
+
+    workdir = Path(tempfile.mkdtemp(prefix="localreader-load-"))
+    db_path = workdir / "database.db"
+
+    t0 = time.perf_counter()
+    seed(db_path, args.users, args.books, args.highlights, args.book_bytes, args.seed)
+    seed_seconds = time.perf_counter() - t0
+    db_size_before = _db_size(db_path)
+
+    port = _free_port()
+    env = {
+        **os.environ,
+        "DB_PATH": str(db_path),
+        "HOST": "127.0.0.1",
+        "PORT": str(port),
+        "AUTH_SECRET": "load-test-secret",
+        "TRANSLATE_BACKEND": "stub",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+    for item in args.server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    log_path = workdir / "server.log"
+    with open(log_path, "wb") as log:
+        proc = subprocess.Popen([sys.executable, str(ROOT / "server.py")], cwd=str(workdir), env=env,
+                                stdout=log, stderr=subprocess.STDOUT)
+    client = Client("127.0.0.1", port, args.timeout)
+    try:
+        _wait_for_server(client, proc)
+
+        tokens = []
+        for u in range(args.users):
+            body = json.dumps({"email": f"user{u:04d}@load.test", "password": PASSWORD}).encode("utf-8")
+            status, data = client.request("POST", "/api/auth/login", body, {"Content-Type": "application/json"})
+            if status != 200:
+                raise SystemExit(f"login failed for user {u}: {status}")
+            tokens.append(json.loads(data)["token"])
+
+        results: dict = {}
+        lock = threading.Lock()
+        start = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        workers = [Worker(i, args, client, tokens, mix, deadline, results, lock) for i in range(args.concurrency)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        duration = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    results.pop("_issued", None)
+    all_latencies = [x for r in results.values() for x in r["latencies"]]
+    all_errors = sum(r["errors"] for r in results.values())
+    db_size_after = _db_size(db_path)
+
+    report = {
+        "config": {
+            "users": args.users,
+            "books_per_user": args.books,
+            "highlights_per_book": args.highlights,
+            "book_bytes": args.book_bytes,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "requests": args.requests,
+            "position_burst": args.position_burst,
+            "mix": mix,
+            "seed": args.seed,
+            "server_env": args.server_env,
+        },
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "cpu_count": os.cpu_count(),
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "elapsed_s": round(duration, 3),
+        "overall": _summarize(all_latencies, all_errors, duration),
+        "operations": {op: _summarize(r["latencies"], r["errors"], duration) for op, r in sorted(results.items())},
+        "db": {
+            "size_before_bytes": db_size_before,
+            "size_after_bytes": db_size_after,
+            "growth_bytes": db_size_after - db_size_before,
+        },
+        "workdir": str(workdir) if args.keep else None,
+    }
+
+    rows = [("overall", report["overall"])] + list(report["operations"].items())
+    print(f"{'operation':<16}{'count':>8}{'err':>6}{'rps':>10}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}", file=sys.stderr)
+    for name, r in rows:
+        print(
+            f"{name:<16}{r['count']:>8}{r['errors']:>6}{r['throughput_rps']:>10}"
+            f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}",
+            file=sys.stderr,
+        )
+    print(f"db growth: {report['db']['growth_bytes']} bytes ({db_size_before} -> {db_size_after})", file=sys.stderr)
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(out + "\n", encoding="utf-8")
+    else:
+        print(out)
+
+    if not args.keep:
+        import shutil
+
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if all_errors and all_errors == len(all_latencies) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
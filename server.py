@@ -2,36 +2,159 @@
 import json
 import re
 import os
-import asyncio
-import inspect
 import base64
+import contextlib
 import hashlib
 import hmac
 import secrets
 import smtplib
 import logging
+import signal
+import socket
+import sys
+import threading
+import time
 from email.message import EmailMessage
 from datetime import datetime, timedelta, timezone
 from email.parser import BytesParser
 from email.policy import default
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs, unquote
+import tempfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote
 import app
-
-HOST = "0.0.0.0"
-PORT = 8000
+import archive
+import backup
+import blobstore
+import compression
+import content_index
+import logconfig
+import maintenance
+import metrics
+import models
+import profiling
+import staticfiles
+import storage
+from router import AUTH_ADMIN, AUTH_NONE, AUTH_OPTIONAL, AUTH_USER, BODY_JSON, BODY_RAW, Request, Router
+import tracing
+import translation
+import ttscache
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+# Worker processes sharing the listening socket (POSIX only). 1 serves from a
+# single process; 0 starts one per CPU.
+WORKERS = int(os.environ.get("WORKERS", "1"))
+# On SIGTERM, open connections get this long to finish before the process exits.
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "20"))
 
 
 AUTH_SECRET = os.environ.get("AUTH_SECRET") or secrets.token_urlsafe(32)
 AUTH_TOKEN_TTL_SECONDS = int(os.environ.get("AUTH_TOKEN_TTL_SECONDS", "604800"))  # 7 days
 
+# Signed download URLs (GET /api/files/<id>/download-url) stay valid for 1-2x this.
+BLOB_URL_TTL_SECONDS = max(60, int(os.environ.get("BLOB_URL_TTL_SECONDS", "3600")))
+
+TRANSLATE_MAX_TEXTS = int(os.environ.get("TRANSLATE_MAX_TEXTS", "200"))
 
-LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL, logging.INFO),
-    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+# Optional bearer token for GET /api/metrics (open when unset).
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Accounts allowed to use /api/admin/* and the X-Profile request header.
+ADMIN_EMAILS = frozenset(
+    e.strip().lower() for e in os.environ.get("ADMIN_EMAILS", "").split(",") if e.strip()
 )
+
+
+logconfig.configure_logging()
 logger = logging.getLogger("localreader.server")
+# Separate loggers for per-request chatter so LOG_LEVELS/LOG_SAMPLE can target them.
+access_logger = logging.getLogger("localreader.server.access")
+position_logger = logging.getLogger("localreader.server.position")
+
+
+HTTP_REQUESTS = metrics.counter(
+    "localreader_http_requests_total",
+    "HTTP requests by route template and status code.",
+    ("method", "route", "status"),
+)
+HTTP_DURATION = metrics.histogram(
+    "localreader_http_request_duration_seconds",
+    "HTTP request handling time.",
+    ("method", "route"),
+)
+HTTP_BYTES_IN = metrics.counter(
+    "localreader_http_request_bytes_total",
+    "Request body bytes received.",
+    ("method", "route"),
+)
+HTTP_BYTES_OUT = metrics.counter(
+    "localreader_http_response_bytes_total",
+    "Response bytes sent, headers included.",
+    ("method", "route"),
+)
+HTTP_IN_FLIGHT = metrics.gauge(
+    "localreader_http_requests_in_flight",
+    "Requests currently being handled.",
+)
+
+class _CountingWriter:
+    """Wraps the handler's wfile to count bytes written."""
+
+    __slots__ = ("_raw", "bytes_written")
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.bytes_written = 0
+
+    def write(self, data):
+        n = self._raw.write(data)
+        self.bytes_written += len(data)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+_TOKEN_PARAM_RE = re.compile(r"([?&]t=)[^&\s]+")
+_DEVICE_ID_RE = re.compile(r"[A-Za-z0-9_-]{8,64}")
+
+
+def _fileno(f):
+    """The descriptor of an open local file, or None (SQLite blob, remote or compressed document)."""
+    try:
+        return f.fileno()
+    except (AttributeError, OSError):
+        return None
+
+
+def _parse_range(header: str | None, size: int):
+    """Parse a single-range ``Range: bytes=`` header.
+
+    Returns (offset, length), None to send the whole body (absent, malformed or
+    multi-range headers), or "unsatisfiable".
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    try:
+        if not first:
+            # Suffix range: the last N bytes.
+            n = int(last)
+            if n <= 0 or size == 0:
+                return "unsatisfiable"
+            return max(0, size - n), min(n, size)
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "unsatisfiable"
+    end = min(end, size - 1)
+    return start, end - start + 1
+
+
+def _is_admin(email: str | None) -> bool:
+    return bool(email) and email.strip().lower() in ADMIN_EMAILS
 
 
 def _b64url_encode(raw: bytes) -> str:
@@ -43,22 +166,21 @@ def _b64url_decode(raw: str) -> bytes:
     return base64.urlsafe_b64decode((raw + padding).encode("ascii"))
 
 
-def issue_auth_token(email: str, ttl_seconds: int = AUTH_TOKEN_TTL_SECONDS) -> str:
-    exp = int((datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)).timestamp())
-    payload = json.dumps({"email": email, "exp": exp}, separators=(",", ":")).encode("utf-8")
-    payload_b64 = _b64url_encode(payload)
-    sig = hmac.new(AUTH_SECRET.encode("utf-8"), payload_b64.encode("ascii"), hashlib.sha256).digest()
-    sig_b64 = _b64url_encode(sig)
-    return f"{payload_b64}.{sig_b64}"
+def _sign(payload: dict, purpose: str = "") -> str:
+    """``<payload>.<signature>``, base64url; ``purpose`` keeps token kinds from validating as each other."""
+    payload_b64 = _b64url_encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    sig = hmac.new(AUTH_SECRET.encode("utf-8"), (purpose + payload_b64).encode("ascii"), hashlib.sha256).digest()
+    return f"{payload_b64}.{_b64url_encode(sig)}"
 
 
-def verify_auth_token(token: str) -> str | None:
+def _verify(token: str, purpose: str = "") -> dict | None:
+    """Payload of a token signed by :func:`_sign` for ``purpose``, or None if invalid or expired."""
     if not token or "." not in token:
         return None
     try:
         payload_b64, sig_b64 = token.split(".", 1)
         expected_sig = hmac.new(
-            AUTH_SECRET.encode("utf-8"), payload_b64.encode("ascii"), hashlib.sha256
+            AUTH_SECRET.encode("utf-8"), (purpose + payload_b64).encode("ascii"), hashlib.sha256
         ).digest()
         provided_sig = _b64url_decode(sig_b64)
         if not hmac.compare_digest(expected_sig, provided_sig):
@@ -67,12 +189,41 @@ def verify_auth_token(token: str) -> str | None:
         exp = int(payload.get("exp", 0))
         if exp <= int(datetime.now(timezone.utc).timestamp()):
             return None
-        email = payload.get("email")
-        return email if isinstance(email, str) and email.strip() else None
+        return payload
     except Exception:
         return None
 
 
+def issue_auth_token(email: str, ttl_seconds: int = AUTH_TOKEN_TTL_SECONDS) -> str:
+    exp = int((datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)).timestamp())
+    return _sign({"email": email, "exp": exp})
+
+
+def verify_auth_token(token: str) -> str | None:
+    payload = _verify(token)
+    if payload is None:
+        return None
+    email = payload.get("email")
+    return email if isinstance(email, str) and email.strip() else None
+
+
+def issue_blob_url(content_hash: str, filename: str, ttl_seconds: int = BLOB_URL_TTL_SECONDS) -> tuple[str, int]:
+    """Signed ``/api/blobs/<hash>`` URL for one document's bytes. Returns (url, expiry timestamp).
+
+    The expiry is rounded to a multiple of the TTL (so it is valid for one to
+    two TTLs): every URL minted for a document within one window is the same,
+    and browser or proxy caches keep hitting.
+    """
+    now = int(datetime.now(timezone.utc).timestamp())
+    exp = (now // ttl_seconds + 2) * ttl_seconds
+    token = _sign({"h": content_hash, "n": filename, "exp": exp}, purpose="blob:")
+    return f"/api/blobs/{content_hash}?t={token}", exp
+
+
+def _cover_url(file_id: str, content_hash: str) -> str:
+    return f"/api/files/{quote(file_id, safe='')}/cover?v={content_hash[:16]}"
+
+
 def _parse_multipart_form_data(content_type: str, body: bytes) -> tuple[dict, dict]:
     """Parse multipart/form-data without using deprecated cgi.
 
@@ -140,6 +291,10 @@ def _send_email_smtp(to_email: str, subject: str, body: str) -> None:
         smtp.send_message(msg)
 
 
+ROUTER = Router()
+route = ROUTER.route
+
+
 class APIHandler(BaseHTTPRequestHandler):
     # Read allowed origins from environment variable, fallback to defaults
     ALLOWED_ORIGINS = os.environ.get(
@@ -167,6 +322,23 @@ class APIHandler(BaseHTTPRequestHandler):
     #     self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
     #     self.send_header("Access-Control-Allow-Credentials", "true")
 
+    def setup(self):
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+
+    def send_response_only(self, code, message=None):
+        self._status_code = code
+        super().send_response_only(code, message)
+
+    def end_headers(self):
+        trace = getattr(self, "_trace", None)
+        if trace is not None:
+            self.send_header("X-Request-ID", trace.request_id)
+            self.send_header("Server-Timing", trace.server_timing())
+            self.send_header("Timing-Allow-Origin", self.headers.get("Origin") or "*")
+            self.send_header("Access-Control-Expose-Headers", "X-Request-ID, Server-Timing")
+        super().end_headers()
+
     def _set_cors_headers(self):
         origin = self.headers.get("Origin")
         if origin:
@@ -177,7 +349,7 @@ class APIHandler(BaseHTTPRequestHandler):
         self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
         self.send_header(
             "Access-Control-Allow-Headers",
-            "Content-Type, Authorization"
+            "Content-Type, Authorization, X-Request-ID, X-Profile, If-None-Match, X-Device-Id, Range, If-Range"
         )
         self.send_header("Access-Control-Allow-Credentials", "true")
 
@@ -187,7 +359,8 @@ class APIHandler(BaseHTTPRequestHandler):
         if not auth.startswith("Bearer "):
             return None
         token = auth[len("Bearer ") :].strip()
-        return verify_auth_token(token)
+        with tracing.span("auth"):
+            return verify_auth_token(token)
 
     def _require_auth(self):
         email = self._get_auth_email()
@@ -197,594 +370,1435 @@ class APIHandler(BaseHTTPRequestHandler):
             return None
         return email
     
+    def _require_admin(self):
+        email = self._require_auth()
+        if not email:
+            return None
+        if not _is_admin(email):
+            logger.info("Forbidden admin request: method=%s path=%s email=%s", self.command, self.path, email)
+            self._send_json(403, {"error": "Forbidden"})
+            return None
+        return email
+
     def _send_json(self, status_code, data):
         """Send JSON response."""
         self.send_response(status_code)
         self.send_header("Content-Type", "application/json")
         self._set_cors_headers()
+        with tracing.span("encode"):
+            body = json.dumps(data).encode()
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
-    
-    def _send_error(self, status_code, message):
-        """Send error response."""
-        self._send_json(status_code, {"error": message})
+        with tracing.span("write"):
+            self.wfile.write(body)
     
-    # def do_OPTIONS(self):
-    #     """Handle preflight requests."""
-    #     logger.debug("CORS preflight: path=%s origin=%s", self.path, self.headers.get("Origin", ""))
-    #     self.send_response(200)
-    #     self._set_cors_headers()
-    #     self.end_headers()
-    def do_OPTIONS(self):
-        self.send_response(200)
+    def _not_modified(self, etag: str, cache_control: str) -> bool:
+        """Answer 304 if the request's If-None-Match matches ``etag``."""
+        candidates = [t.strip().removeprefix("W/") for t in self.headers.get("If-None-Match", "").split(",")]
+        if etag not in candidates and "*" not in candidates:
+            return False
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
         self._set_cors_headers()
-        self.send_header("Content-Length", "0")
         self.end_headers()
+        return True
 
-    
-    def do_GET(self):
-        """Handle GET requests."""
-        parsed = urlparse(self.path)
-        path = parsed.path
-
-        logger.debug("GET %s ip=%s", path, self.client_address[0])
-        
-        # GET /api/ping - Simple health check
-        if path == "/api/ping":
-            logger.debug("Ping")
-            self._send_json(200, {"status": "ok", "message": "Server is running"})
-            return
+    def _send_error(self, status_code, message):
+        """Send error response."""
+        self._send_json(status_code, {"error": message})
 
-        # GET /api/auth/me
-        if path == "/api/auth/me":
-            email = self._get_auth_email()
-            if not email:
-                self._send_json(200, {"authenticated": False})
-                return
-            self._send_json(200, {"authenticated": True, "email": email})
+    def _read_body(self) -> bytes:
+        content_length = int(self.headers.get("Content-Length", 0) or 0)
+        return self.rfile.read(content_length) if content_length else b""
+
+    def _dispatch(self):
+        """Match the route, record metrics/trace/profile, run middleware and the handler."""
+        start = time.perf_counter()
+        maintenance.note_request()
+        method = self.command
+        path, _, query_string = self.path.partition("?")
+        query_string = query_string.partition("#")[0]
+
+        found = ROUTER.match(None if method == "OPTIONS" else method, path)
+        if found:
+            route_label = found[0].template
+        elif staticfiles.enabled() and not path.startswith("/api/"):
+            route_label = "static"
+        else:
+            route_label = "other"
+
+        out_start = self.wfile.bytes_written
+        self._status_code = 0
+        self._trace = tracing.start(self.headers.get("X-Request-ID")) if tracing.ENABLED else None
+        profile = None
+        if profiling.PROFILE_SAMPLE_RATE > 0 or "X-Profile" in self.headers:
+            forced = self.headers.get("X-Profile") == "1" and _is_admin(self._get_auth_email())
+            if profiling.should_profile(forced):
+                profile = profiling.RequestProfile(f"{method} {route_label}")
+        HTTP_IN_FLIGHT.inc()
+        profiling.request_started()
+        try:
+            if profile is not None:
+                with profile:
+                    self._run_route(method, path, query_string, found)
+            else:
+                self._run_route(method, path, query_string, found)
+        finally:
+            profiling.request_finished()
+            HTTP_IN_FLIGHT.dec()
+            HTTP_DURATION.observe(time.perf_counter() - start, method, route_label)
+            tracing.finish(self._trace, method, route_label, self._status_code)
+            HTTP_REQUESTS.inc(method, route_label, str(self._status_code))
+            try:
+                bytes_in = int(self.headers.get("Content-Length", 0) or 0)
+            except ValueError:
+                bytes_in = 0
+            if bytes_in:
+                HTTP_BYTES_IN.inc(method, route_label, amount=bytes_in)
+            HTTP_BYTES_OUT.inc(method, route_label, amount=self.wfile.bytes_written - out_start)
+
+    def _run_route(self, method, path, query_string, found):
+        if method == "OPTIONS":
+            self.send_response(200)
+            self._set_cors_headers()
+            self.send_header("Content-Length", "0")
+            self.end_headers()
             return
 
-        # All other API routes require auth
-        user_email = self._require_auth()
-        if not user_email:
+        logger.debug("%s %s ip=%s", method, path, self.client_address[0])
+        if found is None:
+            if method == "GET" and staticfiles.enabled() and not path.startswith("/api/"):
+                self._send_static(path, query_string)
+            else:
+                self._send_error(404, "Not found")
             return
-        
-        # GET /api/files - List all files
-        if path == "/api/files":
-            files = app.get_files(owner_email=user_email)
-            deleted = app.get_deleted_files(owner_email=user_email)
-
-            # Emit tombstones as lightweight entries so other instances can purge local copies.
-            for d in deleted:
-                actual = (d.get("actual_filename") or "").strip()
-                deleted_at = d.get("deleted_at")
-                if not actual:
-                    continue
-                fmt = "epub" if actual.lower().endswith(".epub") else "pdf"
-                files.append(
-                    {
-                        "filename": actual,
-                        "title": actual,
-                        "format": fmt,
-                        "reading_position": None,
-                        "voice": None,
-                        "created_at": deleted_at,
-                        "updated_at": deleted_at,
-                        "position_updated_at": deleted_at,
-                        "highlights_updated_at": deleted_at,
-                        "voice_updated_at": deleted_at,
-                        "deleted": True,
-                        "deleted_at": deleted_at,
-                    }
-                )
 
-            logger.info(
-                "List files: owner=%s count=%d tombstones=%d",
-                user_email,
-                len(files),
-                len(deleted),
-            )
-            self._send_json(200, {"files": files})
-            return
-        
-        # GET /api/files/{file_id}/download
-        match = re.match(r'^/api/files/(.+)/download$', path)
-        if match:
-            file_id = unquote(match.group(1))
-            logger.info("Download request: owner=%s file_id=%s", user_email, file_id)
+        route_def, params = found
+        req = Request(method, path, query_string, params)
 
-            if app.is_file_deleted(file_id, owner_email=user_email):
-                self._send_json(410, {"error": "File deleted", "deleted": True})
+        if route_def.auth == AUTH_OPTIONAL:
+            req.user = self._get_auth_email()
+        elif route_def.auth == AUTH_USER:
+            req.user = self._require_auth()
+            if not req.user:
                 return
-            
-            file_data = app.get_file_blob(file_id, owner_email=user_email)
-            if file_data:
-                # Extract filename from file_id (format: "file::filename::size::timestamp")
-                filename = file_id
-                if file_id.startswith("file::"):
-                    parts = file_id.split("::")
-                    if len(parts) >= 2:
-                        filename = parts[1]  # Get the actual filename
-                
-                self.send_response(200)
-                self.send_header("Content-Type", "application/octet-stream")
-                self.send_header("Content-Disposition", f"attachment; filename=\"{filename}\"")
-                self._set_cors_headers()
-                self.end_headers()
-                self.wfile.write(file_data)
-                logger.info("Download served: owner=%s bytes=%d filename=%s", user_email, len(file_data), filename)
-            else:
-                self._send_error(404, "File not found")
-            return
-        
-        # GET /api/files/{file_id}/highlights
-        match = re.match(r'^/api/files/(.+)/highlights$', path)
-        if match:
-            file_id = unquote(match.group(1))
-            logger.info("Get highlights: owner=%s file_id=%s", user_email, file_id)
-            
-            highlights = app.get_highlights(file_id, owner_email=user_email)
-            if highlights is not None:
-                self._send_json(200, {"highlights": highlights})
-            else:
-                self._send_json(200, {"highlights": []})
-            return
-        
-        # GET /api/files/{file_id}
-        match = re.match(r'^/api/files/(.+)$', path)
-        if match:
-            file_id = unquote(match.group(1))
-            logger.debug("Check file exists: owner=%s file_id=%s", user_email, file_id)
-            
-            # Get file metadata
-            file_data = app.get_file_data(file_id, owner_email=user_email)
-            if file_data:
-                logger.debug("File exists: owner=%s file_id=%s", user_email, file_id)
-                self._send_json(200, {
-                    "exists": True,
-                    "file_id": file_data.get("filename"),
-                    "title": file_data.get("title"),
-                    "format": file_data.get("format"),
-                    "reading_position": file_data.get("reading_position"),
-                    "voice": file_data.get("voice"),
-                    "created_at": file_data.get("created_at"),
-                    "updated_at": file_data.get("updated_at"),
-                    "position_updated_at": file_data.get("position_updated_at"),
-                    "highlights_updated_at": file_data.get("highlights_updated_at"),
-                    "voice_updated_at": file_data.get("voice_updated_at"),
-                })
-            else:
-                logger.debug("File not found: owner=%s file_id=%s", user_email, file_id)
-                if app.is_file_deleted(file_id, owner_email=user_email):
-                    self._send_json(410, {"exists": False, "deleted": True, "file_id": file_id})
-                else:
-                    self._send_json(404, {"exists": False, "file_id": file_id})
-            return
-        
-        self._send_error(404, "Not found")
-    
-    def do_POST(self):
-        """Handle POST requests."""
-        parsed = urlparse(self.path)
-        path = parsed.path
-
-        # POST /api/auth/signup
-        if path == "/api/auth/signup":
-            logger.info("Signup attempt")
+        elif route_def.auth == AUTH_ADMIN:
+            req.user = self._require_admin()
+            if not req.user:
+                return
+
+        if route_def.body is not None:
             try:
-                content_length = int(self.headers.get("Content-Length", 0))
-                body = self.rfile.read(content_length) if content_length else b""
-                data = json.loads(body.decode()) if body else {}
+                with tracing.span("parse"):
+                    req.body = self._read_body()
+                    if route_def.body == BODY_JSON:
+                        req.data = json.loads(req.body.decode()) if req.body else {}
+                        if not isinstance(req.data, dict):
+                            raise ValueError("expected a JSON object")
             except Exception as e:
                 self._send_error(400, f"Invalid JSON: {str(e)}")
                 return
 
-            email = (data.get("email") or "").strip()
-            password = data.get("password") or ""
+        route_def.handler(self, req)
 
-            if not email or not password:
-                self._send_error(400, "Missing 'email' or 'password'")
-                return
+    do_GET = do_POST = do_PUT = do_DELETE = do_OPTIONS = _dispatch
 
-            ok = app.create_user(email, password)
-            if not ok:
-                logger.info("Signup failed: email=%s", (email or "").strip().lower())
-                self._send_error(400, "Signup failed (email may already exist or password too short)")
-                return
+    # ---- Health, metrics, admin -------------------------------------------------
 
-            logger.info("Signup success: email=%s", email.strip().lower())
+    @route("GET", "/api/ping", auth=AUTH_NONE)
+    def _ping(self, req):
+        """GET /api/ping - Simple health check"""
+        logger.debug("Ping")
+        self._send_json(200, {"status": "ok", "message": "Server is running"})
 
-            # Best-effort welcome email (uses SMTP settings; ignored if not configured)
-            try:
-                app_name = os.environ.get("APP_NAME", "LocalReader")
-                _send_email_smtp(
-                    email.strip().lower(),
-                    f"Welcome to {app_name}",
-                    f"Your {app_name} account was created successfully.\n",
-                )
-            except Exception as e:
-                logger.warning("Signup email not sent: email=%s err=%s", email.strip().lower(), e)
+    @route("GET", "/api/metrics", auth=AUTH_NONE)
+    def _metrics(self, req):
+        """GET /api/metrics - Prometheus text exposition"""
+        if METRICS_TOKEN:
+            auth = self.headers.get("Authorization", "")
+            if not hmac.compare_digest(auth.encode("utf-8"), f"Bearer {METRICS_TOKEN}".encode("utf-8")):
+                self._send_error(401, "Unauthorized")
+                return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self._set_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    @route("GET", "/api/admin/profiles", auth=AUTH_ADMIN)
+    def _list_profiles(self, req):
+        """GET /api/admin/profiles - aggregated request profiles"""
+        self._send_json(
+            200,
+            {
+                "mode": profiling.PROFILE_MODE,
+                "sample_rate": profiling.PROFILE_SAMPLE_RATE,
+                "routes": profiling.store.summary(),
+            },
+        )
 
-            token = issue_auth_token(email.strip().lower())
-            self._send_json(201, {"success": True, "token": token})
+    @route("GET", "/api/admin/profiles/download", auth=AUTH_ADMIN)
+    def _download_profile(self, req):
+        """GET /api/admin/profiles/download?route=...&format=pstats|collapsed"""
+        route_name = req.arg("route", "")
+        fmt = req.arg("format", "pstats")
+        if fmt == "pstats":
+            payload = profiling.store.pstats_bytes(route_name)
+            content_type, ext = "application/octet-stream", "pstats"
+        elif fmt == "collapsed":
+            text = profiling.store.collapsed_text(route_name)
+            payload = text.encode("utf-8") if text is not None else None
+            content_type, ext = "text/plain; charset=utf-8", "collapsed.txt"
+        else:
+            self._send_error(400, "format must be 'pstats' or 'collapsed'")
+            return
+        if payload is None:
+            self._send_error(404, "No profile data for route")
+            return
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", route_name).strip("_") or "profile"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Content-Disposition", f'attachment; filename="{safe_name}.{ext}"')
+        self._set_cors_headers()
+        self.end_headers()
+        self.wfile.write(payload)
+
+    @route("DELETE", "/api/admin/profiles", auth=AUTH_ADMIN)
+    def _reset_profiles(self, req):
+        """DELETE /api/admin/profiles - drop aggregated profiles"""
+        profiling.store.reset()
+        self._send_json(200, {"success": True})
+
+    @route("POST", "/api/admin/backup", auth=AUTH_ADMIN, body=BODY_JSON)
+    def _start_backup(self, req):
+        """POST /api/admin/backup {"incremental": bool} - start an online backup"""
+        incremental = bool(req.data.get("incremental"))
+        if not backup.job.start(incremental):
+            self._send_json(409, {"error": "A backup is already running", "running": True})
             return
+        logger.info("Backup requested: by=%s incremental=%s", req.user, incremental)
+        self._send_json(202, {"started": True, "incremental": incremental})
+
+    @route("GET", "/api/admin/backup", auth=AUTH_ADMIN)
+    def _backup_status(self, req):
+        """GET /api/admin/backup - running state, last result and stored backups"""
+        self._send_json(
+            200,
+            {"running": backup.job.running(), "last": backup.job.last, "backups": backup.list_backups()},
+        )
 
-        # POST /api/auth/login
-        if path == "/api/auth/login":
-            logger.info("Login attempt")
-            try:
-                content_length = int(self.headers.get("Content-Length", 0))
-                body = self.rfile.read(content_length) if content_length else b""
-                data = json.loads(body.decode()) if body else {}
-            except Exception as e:
-                self._send_error(400, f"Invalid JSON: {str(e)}")
-                return
+    # ---- Auth ------------------------------------------------------------------
 
-            email = (data.get("email") or "").strip()
-            password = data.get("password") or ""
-            if not email or not password:
-                self._send_error(400, "Missing 'email' or 'password'")
-                return
+    @route("GET", "/api/auth/me", auth=AUTH_OPTIONAL)
+    def _auth_me(self, req):
+        """GET /api/auth/me"""
+        if not req.user:
+            self._send_json(200, {"authenticated": False})
+            return
+        self._send_json(200, {"authenticated": True, "email": req.user})
+
+    @route("POST", "/api/auth/signup", auth=AUTH_NONE, body=BODY_JSON)
+    def _signup(self, req):
+        """POST /api/auth/signup"""
+        logger.info("Signup attempt")
+        data = req.data
+        email = (data.get("email") or "").strip()
+        password = data.get("password") or ""
+
+        if not email or not password:
+            self._send_error(400, "Missing 'email' or 'password'")
+            return
 
-            if not app.verify_user(email, password):
-                logger.info("Login failed: email=%s", email.strip().lower())
-                self._send_error(401, "Invalid credentials")
-                return
+        ok = app.create_user(email, password)
+        if not ok:
+            logger.info("Signup failed: email=%s", (email or "").strip().lower())
+            self._send_error(400, "Signup failed (email may already exist or password too short)")
+            return
 
-            logger.info("Login success: email=%s", email.strip().lower())
+        logger.info("Signup success: email=%s", email.strip().lower())
 
-            token = issue_auth_token(email.strip().lower())
-            self._send_json(200, {"success": True, "token": token})
+        # Best-effort welcome email (uses SMTP settings; ignored if not configured)
+        try:
+            app_name = os.environ.get("APP_NAME", "LocalReader")
+            _send_email_smtp(
+                email.strip().lower(),
+                f"Welcome to {app_name}",
+                f"Your {app_name} account was created successfully.\n",
+            )
+        except Exception as e:
+            logger.warning("Signup email not sent: email=%s err=%s", email.strip().lower(), e)
+
+        token = issue_auth_token(email.strip().lower())
+        self._send_json(201, {"success": True, "token": token})
+
+    @route("POST", "/api/auth/login", auth=AUTH_NONE, body=BODY_JSON)
+    def _login(self, req):
+        """POST /api/auth/login"""
+        logger.info("Login attempt")
+        data = req.data
+        email = (data.get("email") or "").strip()
+        password = data.get("password") or ""
+        if not email or not password:
+            self._send_error(400, "Missing 'email' or 'password'")
             return
 
-        # POST /api/auth/request-password-reset
-        if path == "/api/auth/request-password-reset":
-            logger.info("Password reset request")
-            try:
-                content_length = int(self.headers.get("Content-Length", 0))
-                body = self.rfile.read(content_length) if content_length else b""
-                data = json.loads(body.decode()) if body else {}
-            except Exception as e:
-                self._send_error(400, f"Invalid JSON: {str(e)}")
-                return
+        if not app.verify_user(email, password):
+            logger.info("Login failed: email=%s", email.strip().lower())
+            self._send_error(401, "Invalid credentials")
+            return
 
-            email = (data.get("email") or "").strip().lower()
-            # Always return OK to avoid account enumeration.
-            self._send_json(200, {"success": True})
+        logger.info("Login success: email=%s", email.strip().lower())
 
-            if not email or not app.user_exists(email):
-                return
+        token = issue_auth_token(email.strip().lower())
+        self._send_json(200, {"success": True, "token": token})
 
-            reset_token = secrets.token_urlsafe(32)
-            expires_at = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
-            if not app.create_password_reset(email, reset_token, expires_at):
-                return
+    @route("POST", "/api/auth/request-password-reset", auth=AUTH_NONE, body=BODY_JSON)
+    def _request_password_reset(self, req):
+        """POST /api/auth/request-password-reset"""
+        logger.info("Password reset request")
+        email = (req.data.get("email") or "").strip().lower()
+        # Always return OK to avoid account enumeration.
+        self._send_json(200, {"success": True})
 
-            logger.info("Password reset token created: email=%s", email)
+        if not email or not app.user_exists(email):
+            return
 
-            try:
-                app_name = os.environ.get("APP_NAME", "LocalReader")
-                subject = f"{app_name} password reset"
-                body = (
-                    f"You requested a password reset for {app_name}.\n\n"
-                    f"Reset code: {reset_token}\n\n"
-                    f"This code expires in 1 hour. If you did not request this, you can ignore this email.\n"
-                )
-                _send_email_smtp(email, subject, body)
-            except Exception as e:
-                # Log but do not leak details to the client.
-                logger.warning("Failed to send reset email: email=%s err=%s", email, e)
+        reset_token = secrets.token_urlsafe(32)
+        expires_at = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+        if not app.create_password_reset(email, reset_token, expires_at):
             return
 
-        # POST /api/auth/reset-password
-        if path == "/api/auth/reset-password":
-            logger.info("Password reset attempt")
-            try:
-                content_length = int(self.headers.get("Content-Length", 0))
-                body = self.rfile.read(content_length) if content_length else b""
-                data = json.loads(body.decode()) if body else {}
-            except Exception as e:
-                self._send_error(400, f"Invalid JSON: {str(e)}")
-                return
+        logger.info("Password reset token created: email=%s", email)
 
-            email = (data.get("email") or "").strip().lower()
-            token = (data.get("token") or "").strip()
-            new_password = data.get("newPassword") or ""
+        try:
+            app_name = os.environ.get("APP_NAME", "LocalReader")
+            subject = f"{app_name} password reset"
+            body = (
+                f"You requested a password reset for {app_name}.\n\n"
+                f"Reset code: {reset_token}\n\n"
+                f"This code expires in 1 hour. If you did not request this, you can ignore this email.\n"
+            )
+            _send_email_smtp(email, subject, body)
+        except Exception as e:
+            # Log but do not leak details to the client.
+            logger.warning("Failed to send reset email: email=%s err=%s", email, e)
+
+    @route("POST", "/api/auth/reset-password", auth=AUTH_NONE, body=BODY_JSON)
+    def _reset_password(self, req):
+        """POST /api/auth/reset-password"""
+        logger.info("Password reset attempt")
+        data = req.data
+        email = (data.get("email") or "").strip().lower()
+        token = (data.get("token") or "").strip()
+        new_password = data.get("newPassword") or ""
+
+        if not email or not token or not new_password:
+            self._send_error(400, "Missing 'email', 'token', or 'newPassword'")
+            return
+        if len(new_password) < 8:
+            self._send_error(400, "Password must be at least 8 characters")
+            return
 
-            if not email or not token or not new_password:
-                self._send_error(400, "Missing 'email', 'token', or 'newPassword'")
-                return
-            if len(new_password) < 8:
-                self._send_error(400, "Password must be at least 8 characters")
-                return
+        if not app.consume_password_reset(email, token):
+            logger.info("Password reset failed: email=%s reason=invalid_or_expired", email)
+            self._send_error(400, "Invalid or expired reset token")
+            return
 
-            if not app.consume_password_reset(email, token):
-                logger.info("Password reset failed: email=%s reason=invalid_or_expired", email)
-                self._send_error(400, "Invalid or expired reset token")
-                return
+        if not app.set_user_password(email, new_password):
+            logger.warning("Password reset failed: email=%s reason=db_update_failed", email)
+            self._send_error(400, "Failed to set password")
+            return
 
-            if not app.set_user_password(email, new_password):
-                logger.warning("Password reset failed: email=%s reason=db_update_failed", email)
-                self._send_error(400, "Failed to set password")
-                return
+        logger.info("Password reset success: email=%s", email)
 
-            logger.info("Password reset success: email=%s", email)
+        token_auth = issue_auth_token(email)
+        self._send_json(200, {"success": True, "token": token_auth})
 
-            token_auth = issue_auth_token(email)
-            self._send_json(200, {"success": True, "token": token_auth})
-            return
+    # ---- Translation -----------------------------------------------------------
 
-        # All non-auth routes below require auth
-        user_email = self._require_auth()
-        if not user_email:
-            return
+    @route("POST", "/api/translate", body=BODY_JSON)
+    def _translate(self, req):
+        """POST /api/translate"""
+        user_email = req.user
+        data = req.data
+        logger.info("Translate request: owner=%s", user_email)
 
-        # POST /api/translate
-        if path == "/api/translate":
-            logger.info("Translate request: owner=%s", user_email)
-            try:
-                content_length = int(self.headers.get("Content-Length", 0))
-                body = self.rfile.read(content_length) if content_length else b""
-                data = json.loads(body.decode()) if body else {}
-            except Exception as e:
-                self._send_error(400, f"Invalid JSON: {str(e)}")
-                return
+        target = (data.get("target") or os.environ.get("TRANSLATE_TARGET_LANG") or "pt").strip()
+        texts = data.get("texts")
+        batch = texts is not None
 
+        if batch:
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                self._send_error(400, "'texts' must be a list of strings")
+                return
+            if len(texts) > TRANSLATE_MAX_TEXTS:
+                self._send_error(413, f"Too many texts (max {TRANSLATE_MAX_TEXTS})")
+                return
+            texts = [t.strip() for t in texts]
+        else:
             text = (data.get("text") or "").strip()
-            target = (data.get("target") or os.environ.get("TRANSLATE_TARGET_LANG") or "pt").strip()
-
             if not text:
                 self._send_error(400, "Missing 'text' field")
                 return
+            texts = [text]
 
-            # Basic safety/size cap (Google Translate web endpoints are not designed for huge payloads)
-            if len(text) > 5000:
-                self._send_error(413, "Text too long (max 5000 chars)")
-                return
+        # Basic safety/size cap (Google Translate web endpoints are not designed for huge payloads)
+        if any(len(t) > 5000 for t in texts):
+            self._send_error(413, "Text too long (max 5000 chars)")
+            return
 
-            try:
-                from googletrans import Translator
-
-                async def _do_translate():
-                    translator = Translator()
-                    maybe_result = translator.translate(text, dest=target)
-                    if inspect.isawaitable(maybe_result):
-                        return await maybe_result
-                    return maybe_result
-
-                result = asyncio.run(_do_translate())
-
-                translated = getattr(result, "text", "")
-                detected = getattr(result, "src", None)
-                self._send_json(
-                    200,
-                    {
-                        "translatedText": translated,
-                        "detectedSource": detected,
-                        "target": target,
-                    },
-                )
-                return
-            except ImportError:
-                self._send_error(
-                    501,
-                    "Translation support not installed on server. Install googletrans (googletrans==4.0.0-rc1).",
-                )
-                return
-            except Exception as e:
-                logger.exception("Translation failed: owner=%s", user_email)
-                self._send_error(500, f"Translation failed: {str(e)}")
-                return
-        
-        # POST /api/files
-        if path == "/api/files":
-            logger.info("Upload attempt: owner=%s", user_email)
-            try:
-                content_type = self.headers.get("Content-Type", "")
+        try:
+            results = translation.get_service().translate_many(texts, target)
+        except translation.TranslationUnavailable:
+            self._send_error(
+                501,
+                "Translation support not installed on server. Install googletrans (googletrans==4.0.0-rc1).",
+            )
+            return
+        except Exception as e:
+            logger.exception("Translation failed: owner=%s", user_email)
+            self._send_error(500, f"Translation failed: {str(e)}")
+            return
 
-                if not content_type.startswith("multipart/form-data"):
-                    self._send_error(400, "Expected multipart/form-data")
-                    return
+        if batch:
+            self._send_json(200, {"translations": results, "target": target})
+        else:
+            self._send_json(200, {**results[0], "target": target})
+
+    # ---- Files -----------------------------------------------------------------
+
+    @route("GET", "/api/files")
+    def _list_files(self, req):
+        """GET /api/files - List all files"""
+        user_email = req.user
+        try:
+            since = max(0, int(req.arg("tombstones_since", "0")))
+        except ValueError:
+            self._send_error(400, "'tombstones_since' must be an integer")
+            return
+        files = app.get_files(owner_email=user_email)
+        deleted = app.get_deleted_files(owner_email=user_email, since=since)
+        # A device passing tombstones_since has applied every tombstone up to it.
+        device_id = self.headers.get("X-Device-Id", "").strip()
+        if device_id and "tombstones_since" in req.query and _DEVICE_ID_RE.fullmatch(device_id):
+            app.record_device_ack(user_email, device_id, since)
+        for f in files:
+            f["cover_url"] = _cover_url(f["filename"], f["content_hash"]) if f["has_cover"] else None
+
+        # Emit tombstones as lightweight entries so other instances can purge local copies.
+        for d in deleted:
+            actual = (d.get("actual_filename") or "").strip()
+            deleted_at = d.get("deleted_at")
+            if not actual:
+                continue
+            fmt = "epub" if actual.lower().endswith(".epub") else "pdf"
+            files.append(
+                {
+                    "filename": actual,
+                    "title": actual,
+                    "format": fmt,
+                    "reading_position": None,
+                    "voice": None,
+                    "created_at": deleted_at,
+                    "updated_at": deleted_at,
+                    "position_updated_at": deleted_at,
+                    "highlights_updated_at": deleted_at,
+                    "voice_updated_at": deleted_at,
+                    "deleted": True,
+                    "deleted_at": deleted_at,
+                    "change_seq": d["change_seq"],
+                }
+            )
 
-                content_length = int(self.headers.get("Content-Length", 0))
-                body = self.rfile.read(content_length) if content_length else b""
-                fields, files = _parse_multipart_form_data(content_type, body)
+        logger.info(
+            "List files: owner=%s count=%d tombstones=%d",
+            user_email,
+            len(files),
+            len(deleted),
+        )
+        # Pass back as ?tombstones_since= to only receive newer tombstones.
+        tombstone_seq = max([since] + [d["change_seq"] for d in deleted])
+        self._send_json(200, {"files": files, "tombstone_seq": tombstone_seq})
+
+    @route("POST", "/api/files", body=BODY_RAW)
+    def _upload_file(self, req):
+        """POST /api/files"""
+        user_email = req.user
+        logger.info("Upload attempt: owner=%s", user_email)
+        try:
+            content_type = self.headers.get("Content-Type", "")
+
+            if not content_type.startswith("multipart/form-data"):
+                self._send_error(400, "Expected multipart/form-data")
+                return
+
+            with tracing.span("parse"):
+                fields, files = _parse_multipart_form_data(content_type, req.body)
 
-                file_id = (fields.get("file_id") or "").strip()
-                title = (fields.get("title") or "").strip()
-                format_type = (fields.get("format") or "").strip()
-                voice = (fields.get("voice") or "").strip() or None
+            file_id = (fields.get("file_id") or "").strip()
+            title = (fields.get("title") or "").strip()
+            format_type = (fields.get("format") or "").strip()
+            voice = (fields.get("voice") or "").strip() or None
 
-                file_data = None
-                file_part = files.get("file")
-                if file_part:
-                    file_data = file_part.get("content")
+            file_data = None
+            file_part = files.get("file")
+            if file_part:
+                file_data = file_part.get("content")
 
-                logger.info(
-                    "Upload received: owner=%s file_id=%s format=%s bytes=%d",
-                    user_email,
+            logger.info(
+                "Upload received: owner=%s file_id=%s format=%s bytes=%d",
+                user_email,
+                file_id,
+                format_type,
+                (len(file_data) if file_data else 0),
+            )
+            
+            if not all([file_id, title, format_type, file_data]):
+                self._send_error(400, "Missing required fields: file_id, title, format, file")
+                return
+            
+            try:
+                result_id = app.add_file_with_id(
                     file_id,
+                    title,
+                    file_data,
                     format_type,
-                    (len(file_data) if file_data else 0),
+                    voice,
+                    owner_email=user_email,
                 )
-                
-                if not all([file_id, title, format_type, file_data]):
-                    self._send_error(400, "Missing required fields: file_id, title, format, file")
-                    return
-                
-                try:
-                    result_id = app.add_file_with_id(
-                        file_id,
-                        title,
-                        file_data,
-                        format_type,
-                        voice,
-                        owner_email=user_email,
-                    )
-                except app.FileDeletedError:
-                    logger.info("Upload rejected (tombstoned): owner=%s file_id=%s", user_email, file_id)
-                    self._send_json(410, {"error": "File is marked deleted on server", "deleted": True})
-                    return
-
-                logger.info("Upload stored: owner=%s file_id=%s", user_email, result_id)
-                
-                self._send_json(201, {
-                    "success": True,
-                    "file_id": result_id,
-                    "message": "File uploaded successfully"
-                })
+            except app.FileDeletedError:
+                logger.info("Upload rejected (tombstoned): owner=%s file_id=%s", user_email, file_id)
+                self._send_json(410, {"error": "File is marked deleted on server", "deleted": True})
                 return
-                
-            except Exception as e:
-                logger.exception("Upload failed: owner=%s", user_email)
-                self._send_error(500, f"Upload failed: {str(e)}")
+
+            logger.info("Upload stored: owner=%s file_id=%s", user_email, result_id)
+            if format_type == "epub":
+                content_index.notify()
+            
+            self._send_json(201, {
+                "success": True,
+                "file_id": result_id,
+                "message": "File uploaded successfully"
+            })
+            
+        except Exception as e:
+            logger.exception("Upload failed: owner=%s", user_email)
+            self._send_error(500, f"Upload failed: {str(e)}")
+
+    @route("GET", "/api/highlights/search")
+    def _search_highlights(self, req):
+        """GET /api/highlights/search?q=...&file_id=...&limit=20&offset=0"""
+        user_email = req.user
+        query = (req.arg("q") or "").strip()
+        file_id = (req.arg("file_id") or "").strip() or None
+        try:
+            limit = max(1, min(int(req.arg("limit", "20")), 100))
+            offset = max(0, int(req.arg("offset", "0")))
+        except ValueError:
+            self._send_error(400, "'limit' and 'offset' must be integers")
+            return
+        if not query:
+            self._send_error(400, "Missing 'q' parameter")
+            return
+        if len(query) > 500:
+            self._send_error(413, "Query too long (max 500 chars)")
+            return
+
+        try:
+            results, has_more = app.search_highlights(query, user_email, file_id=file_id, limit=limit, offset=offset)
+        except app.SearchUnavailable:
+            self._send_error(501, "Highlight search not available on this server (SQLite without FTS5)")
+            return
+
+        self._send_json(
+            200,
+            {
+                "results": results,
+                "limit": limit,
+                "offset": offset,
+                "next_offset": offset + limit if has_more else None,
+            },
+        )
+
+    @route("GET", "/api/library/search")
+    def _search_library(self, req):
+        """GET /api/library/search?q=...&limit=20&offset=0"""
+        user_email = req.user
+        query = (req.arg("q") or "").strip()
+        try:
+            limit = max(1, min(int(req.arg("limit", "20")), 100))
+            offset = max(0, int(req.arg("offset", "0")))
+        except ValueError:
+            self._send_error(400, "'limit' and 'offset' must be integers")
+            return
+        if not query:
+            self._send_error(400, "Missing 'q' parameter")
+            return
+        if len(query) > 500:
+            self._send_error(413, "Query too long (max 500 chars)")
+            return
+
+        try:
+            results, has_more = app.search_library(query, user_email, limit=limit, offset=offset)
+        except app.SearchUnavailable:
+            self._send_error(501, "Library search not available on this server (SQLite without FTS5)")
+            return
+
+        self._send_json(
+            200,
+            {
+                "results": results,
+                "limit": limit,
+                "offset": offset,
+                "next_offset": offset + limit if has_more else None,
+                # Books not yet indexed are missing from the results.
+                "index": app.content_index_status(user_email),
+            },
+        )
+
+    @route("GET", "/api/library/export")
+    def _export_library(self, req):
+        """GET /api/library/export - ZIP of every document with a manifest of positions and highlights"""
+        user_email = req.user
+        logger.info("Export request: owner=%s", user_email)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="localreader-library-{stamp}.zip"')
+        self.send_header("Cache-Control", "no-store")
+        self._set_cors_headers()
+        self.end_headers()
+        # No Content-Length: the archive is streamed as it is built and the
+        # end of the response is marked by closing the connection.
+        self.close_connection = True
+        try:
+            with tracing.span("write"):
+                archive.write_export(self.wfile, user_email)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Export aborted by client: owner=%s", user_email)
+        except Exception:
+            # Headers are gone; a truncated archive is what the client sees.
+            logger.exception("Export failed: owner=%s", user_email)
+
+    @route("POST", "/api/library/import")
+    def _import_library(self, req):
+        """POST /api/library/import[?replace=1] - body: a ZIP from /api/library/export"""
+        user_email = req.user
+        replace = req.arg("replace", "") in {"1", "true", "yes"}
+        try:
+            remaining = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._send_error(411, "Content-Length required")
+            return
+
+        # Spool the upload to disk in chunks (zipfile needs to seek) instead of
+        # holding the whole archive in memory.
+        with tempfile.SpooledTemporaryFile(max_size=archive.CHUNK_SIZE * 16) as spool:
+            with tracing.span("parse"):
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, archive.CHUNK_SIZE))
+                    if not chunk:
+                        self._send_error(400, "Incomplete request body")
+                        return
+                    spool.write(chunk)
+                    remaining -= len(chunk)
+                spool.seek(0)
+            try:
+                result = archive.import_archive(spool, user_email, replace=replace)
+            except archive.ArchiveError as e:
+                self._send_error(400, str(e))
                 return
-        
-        self._send_error(404, "Not found")
 
-    def do_DELETE(self):
-        parsed = urlparse(self.path)
-        path = parsed.path
+        if result["imported"] or result["replaced"]:
+            content_index.notify()
+        self._send_json(200, result)
 
-        user_email = self._require_auth()
-        if not user_email:
+    @route("PUT", "/api/tts/audio", body=BODY_RAW)
+    def _put_tts_audio(self, req):
+        """PUT /api/tts/audio?voice=&speed=&text_hash= - body: the sentence's WAV audio"""
+        if not ttscache.enabled():
+            self._send_error(404, "Audio cache disabled")
+            return
+        try:
+            voice, speed = ttscache.key(req.arg("voice"), req.arg("speed"))
+            audio_hash = ttscache.put(req.user, voice, speed, req.arg("text_hash"), req.body)
+        except ttscache.AudioCacheError as e:
+            self._send_error(413 if "too large" in str(e) else 400, str(e))
             return
+        self._send_json(201, {"audio_hash": audio_hash, "size": len(req.body)})
 
-        # DELETE /api/files/{file_id}
-        match = re.match(r'^/api/files/(.+)$', path)
-        if match:
-            file_id = unquote(match.group(1))
-            logger.info("Delete request: owner=%s file_id=%s", user_email, file_id)
+    @route("POST", "/api/tts/audio/lookup", body=BODY_JSON)
+    def _lookup_tts_audio(self, req):
+        """POST /api/tts/audio/lookup - body: {voice, speed, text_hashes: [...]} for the next sentences"""
+        if not ttscache.enabled():
+            self._send_json(200, {"audio": {}})
+            return
+        text_hashes = req.data.get("text_hashes")
+        if not isinstance(text_hashes, list):
+            self._send_error(400, "text_hashes must be a list")
+            return
+        try:
+            voice, speed = ttscache.key(req.data.get("voice"), req.data.get("speed"))
+        except ttscache.AudioCacheError as e:
+            self._send_error(400, str(e))
+            return
+        self._send_json(200, {"audio": ttscache.lookup(req.user, voice, speed, text_hashes)})
+
+    @route("GET", "/api/tts/audio/{audio_hash}")
+    def _get_tts_audio(self, req):
+        """GET /api/tts/audio/{audio_hash} - cached audio by its content hash (immutable)"""
+        f = ttscache.open_audio(req.params["audio_hash"])
+        if f is None:
+            self._send_error(404, "Audio not found")
+            return
+        etag = f'"{req.params["audio_hash"]}"'
+        cache_control = "private, max-age=31536000, immutable"
+        with f:
+            if not self._not_modified(etag, cache_control):
+                self._send_file(f, os.fstat(f.fileno()).st_size, etag, "audio/wav", cache_control)
+
+    def _model_error(self, e):
+        if isinstance(e, models.NotStored):
+            self._send_error(401, "Sign in to download this voice")
+        elif isinstance(e, models.StoreFull):
+            logger.warning("Model store full: %s", e)
+            self._send_error(507, "Model storage is full")
+        else:
+            logger.warning("Model fetch failed: %s", e)
+            self._send_error(502, "Model upstream unavailable")
 
-            ok = app.mark_file_deleted(file_id, owner_email=user_email)
-            if ok:
-                self._send_json(200, {"success": True, "deleted": True})
-            else:
-                self._send_error(400, "Invalid file id")
+    @route("GET", "/api/models/manifest", auth=AUTH_OPTIONAL)
+    def _models_manifest(self, req):
+        """GET /api/models/manifest[?voice=<id>] - stored model files, or one voice's (fetched if missing, signed in)"""
+        voice_id = req.arg("voice")
+        try:
+            files = models.manifest(voice_id, fetch=bool(req.user))
+        except KeyError:
+            self._send_error(404, "Unknown voice")
+            return
+        except models.ModelError as e:
+            self._model_error(e)
+            return
+        for f in files:
+            f["url"] = "/api/models/" + quote(f["path"])
+        self._send_json(200, {"voice": voice_id, "files": files})
+
+    @route("GET", "/api/models/{path:path}", auth=AUTH_OPTIONAL)
+    def _get_model(self, req):
+        """GET /api/models/{path} - a voice model or config, fetched from upstream on first use (signed in)"""
+        path = req.params["path"]
+        try:
+            found = models.ensure(path, fetch=bool(req.user))
+        except models.ModelError as e:
+            self._model_error(e)
+            return
+        if found is None:
+            self._send_error(404, "Model not found")
+            return
+        etag = f'"{found["sha256"]}"'
+        # The catalog changes upstream; published voice files don't.
+        cache_control = "public, max-age=3600" if path == models.CATALOG else "public, max-age=2592000"
+        if self._not_modified(etag, cache_control):
+            return
+        content_type = "application/json" if path.endswith(".json") else "application/octet-stream"
+        with models.open_file(path) as f:
+            sent = self._send_file(f, found["size"], etag, content_type, cache_control)
+        models.SERVED.inc(amount=sent)
+
+    @route("GET", "/api/blobs/{content_hash}", auth=AUTH_NONE)
+    def _get_blob(self, req):
+        """GET /api/blobs/{content_hash}?t=<signature> - document bytes via a signed URL, no session needed"""
+        content_hash = req.params["content_hash"]
+        payload = _verify(req.arg("t", ""), purpose="blob:")
+        if payload is None or payload.get("h") != content_hash:
+            self._send_error(403, "Invalid or expired link")
+            return
+        # Immutable content, capability URL: any cache may keep it until the link expires.
+        max_age = max(0, int(payload["exp"]) - int(datetime.now(timezone.utc).timestamp()))
+        filename = payload.get("n") if isinstance(payload.get("n"), str) else content_hash
+        self._send_document(
+            content_hash,
+            filename,
+            f"public, max-age={max_age}, immutable",
+            lambda: app.open_blob_by_hash(content_hash),
+        )
+
+    @route("GET", "/api/files/{file_id:path}/download-url")
+    def _get_download_url(self, req):
+        """GET /api/files/{file_id}/download-url - mint a signed, expiring URL for the document"""
+        user_email = req.user
+        file_id = req.params["file_id"]
+        if app.is_file_deleted(file_id, owner_email=user_email):
+            self._send_json(410, {"error": "File deleted", "deleted": True})
+            return
+        found = app.get_file_content_info(file_id, owner_email=user_email)
+        if found is None:
+            self._send_error(404, "File not found")
             return
+        content_hash, size = found
+        if not content_hash:
+            # Stored before content hashes existed; the indexer fills them in shortly.
+            self._send_error(409, "Document not ready, retry shortly")
+            return
+        url, exp = issue_blob_url(content_hash, app.extract_actual_filename(file_id))
+        self._send_json(
+            200,
+            {
+                "url": url,
+                "expires_at": datetime.fromtimestamp(exp, timezone.utc).isoformat(),
+                "content_hash": content_hash,
+                "size": size,
+            },
+        )
 
-        self._send_error(404, "Not found")
-    
-    def do_PUT(self):
-        """Handle PUT requests."""
-        parsed = urlparse(self.path)
-        path = parsed.path
+    @route("GET", "/api/files/{file_id:path}/download")
+    def _download_file(self, req):
+        """GET /api/files/{file_id}/download"""
+        user_email = req.user
+        file_id = req.params["file_id"]
+        logger.info("Download request: owner=%s file_id=%s", user_email, file_id)
 
-        user_email = self._require_auth()
-        if not user_email:
+        if app.is_file_deleted(file_id, owner_email=user_email):
+            self._send_json(410, {"error": "File deleted", "deleted": True})
             return
         
-        # Read request body
+        # Extract filename from file_id (format: "file::filename::size::timestamp")
+        filename = file_id
+        if file_id.startswith("file::"):
+            parts = file_id.split("::")
+            if len(parts) >= 2:
+                filename = parts[1]  # Get the actual filename
+
+        found = app.get_file_content_info(file_id, owner_email=user_email)
+        if found is None:
+            self._send_error(404, "File not found")
+            return
+        sent = self._send_document(
+            found[0], filename, "private, no-cache", lambda: app.open_file_blob(file_id, owner_email=user_email)
+        )
+        if sent is None:
+            return
+        logger.info("Download served: owner=%s bytes=%d filename=%s", user_email, sent, filename)
+
+    def _send_document(self, content_hash, filename, cache_control, open_from_db):
+        """Send a document, zero-copy from an on-disk copy when possible.
+
+        ``open_from_db`` returns the ``app.open_file_blob``-style context manager
+        used to read it. Documents stored gzip-compressed go out as stored to
+        clients that accept gzip (whole, no Range). Returns the body bytes
+        sent, or None if the document was not found (error already sent).
+        """
+        etag = f'"{content_hash}"' if content_hash else None
+        gzip_etag = f'"{content_hash}-gzip"' if content_hash else None
+        accepts_gzip = "Range" not in self.headers and "gzip" in staticfiles.accepted_encodings(
+            self.headers.get("Accept-Encoding", "")
+        )
+        if etag and (
+            self._not_modified(etag, cache_control) or (accepts_gzip and self._not_modified(gzip_etag, cache_control))
+        ):
+            return 0
+
+        with contextlib.ExitStack() as stack:
+            blob = None
+            if accepts_gzip:
+                blob = self._open_document(stack, open_from_db, content_hash)
+                if blob is None:
+                    return None
+                if getattr(blob, "codec", None) == "gzip":
+                    size = len(blob.raw)
+                    self._start_download(size, gzip_etag, filename, cache_control, encoding="gzip")
+                    sent = self._send_body(blob.raw, 0, size)
+                    compression.SERVED.inc("gzip", amount=sent)
+                    return sent
+
+            copy = None
+            if content_hash and blobstore.enabled():
+                try:
+                    # Documents in SQLite (or compressed) are copied to BLOB_DIR
+                    # on first download; the blob store has local files of its
+                    # own (or a cache of remote ones).
+                    copy = blobstore.open_copy(content_hash) or blobstore.store_copy(content_hash)
+                except OSError:
+                    logger.exception("Document copy failed: hash=%s", content_hash)
+            if copy is not None:
+                # No database snapshot needed for the copy: don't pin one during a long send.
+                stack.close()
+                blob = None
+                stack.enter_context(copy)
+            else:
+                if blob is None:
+                    blob = self._open_document(stack, open_from_db, content_hash)
+                    if blob is None:
+                        return None
+                if _fileno(blob) is not None:
+                    copy = blob
+
+            size = os.fstat(copy.fileno()).st_size if copy is not None else len(blob)
+            byte_range = self._start_download(size, etag, filename, cache_control)
+            if byte_range is None:
+                return 0
+            sent = self._send_body(copy if copy is not None else blob, *byte_range)
+            if getattr(blob, "codec", None) and copy is None:
+                compression.SERVED.inc("decoded", amount=sent)
+        return sent
+
+    def _open_document(self, stack, open_from_db, content_hash):
+        """Enter ``open_from_db()`` on ``stack``; None when not found or unavailable (error sent)."""
         try:
-            content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode()) if body else {}
-        except Exception as e:
-            self._send_error(400, f"Invalid JSON: {str(e)}")
+            blob = stack.enter_context(open_from_db())
+        except storage.StorageError:
+            logger.exception("Document store unavailable: hash=%s", content_hash)
+            self._send_error(503, "Document storage unavailable, retry shortly")
+            return None
+        if blob is None:
+            self._send_error(404, "File not found")
+        return blob
+
+    def _send_body(self, f, offset, length):
+        """Send ``length`` bytes of ``f`` from ``offset``: sendfile for local files, else chunked reads."""
+        if _fileno(f) is not None:
+            # Zero-copy: the kernel moves the bytes from the page cache to the socket.
+            with tracing.span("write"):
+                sent = blobstore.sendfile(self.connection, f, offset, length)
+            # Bypasses self.wfile: count for the response-bytes metric.
+            self.wfile.bytes_written += sent
+            return sent
+        sent = 0
+        f.seek(offset)
+        with tracing.span("write"):
+            # Chunked reads keep large books out of memory.
+            while sent < length:
+                chunk = f.read(min(length - sent, archive.CHUNK_SIZE))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                sent += len(chunk)
+        blobstore.SERVED.inc("sqlite", amount=sent)
+        return sent
+
+    def _send_static(self, path, query_string):
+        """Serve a frontend file from STATIC_ROOT, precompressed when the client accepts it."""
+        asset = staticfiles.lookup(path)
+        if asset is None:
+            self._send_error(404, "Not found")
+            return
+        cache_control = asset.cache_control
+        if staticfiles.is_versioned_request(query_string):
+            cache_control = staticfiles.IMMUTABLE_CACHE
+        # Ranges are only served on the uncompressed bytes.
+        encoding = None if "Range" in self.headers else staticfiles.choose_encoding(
+            asset, self.headers.get("Accept-Encoding", "")
+        )
+        if encoding:
+            body_path, size = asset.variants[encoding]
+            etag = f'{asset.etag[:-1]}-{encoding}"'
+        else:
+            body_path, size = asset.path, asset.size
+            etag = asset.etag
+        if self._not_modified(etag, cache_control):
             return
-        
-        # PUT /api/files/{file_id}/position
-        match = re.match(r'^/api/files/(.+)/position$', path)
-        if match:
-            file_id = unquote(match.group(1))
-            position = data.get("position")
 
-            logger.info(
-                "Update position: owner=%s file_id=%s has_position=%s",
-                user_email,
-                file_id,
-                position is not None,
-            )
-            
-            if position is None:
-                self._send_error(400, "Missing 'position' field")
-                return
-            
-            success = app.update_position_by_file_id(file_id, str(position), owner_email=user_email)
-            
-            if success:
-                self._send_json(200, {"success": True, "message": "Position updated"})
-            else:
-                self._send_error(404, "File not found")
+        try:
+            f = open(body_path, "rb")
+        except OSError:
+            self._send_error(404, "Not found")
             return
-        
-        # PUT /api/files/{file_id}/voice
-        match = re.match(r'^/api/files/(.+)/voice$', path)
-        if match:
-            file_id = unquote(match.group(1))
-            voice = data.get("voice")
+        with f:
+            sent = self._send_file(f, size, etag, asset.mime, cache_control, encoding, vary=bool(asset.variants))
+        staticfiles.SERVED.inc(encoding or "identity", amount=sent)
+
+    def _send_file(self, f, size, etag, content_type, cache_control, encoding=None, vary=False):
+        """Send an open file with sendfile; Range requests are honoured unless ``encoding`` is set.
+
+        Returns the body bytes sent.
+        """
+        byte_range = self._start_body(size, etag, content_type, cache_control, encoding, vary or bool(encoding))
+        if byte_range is None:
+            return 0
+        with tracing.span("write"):
+            sent = blobstore.sendfile(self.connection, f, *byte_range, record=False)
+        self.wfile.bytes_written += sent
+        return sent
+
+    def _start_download(self, size, etag, filename, cache_control, encoding=None):
+        """Send the status and headers of a (possibly ranged) document download.
+
+        With ``encoding`` (the body is sent as stored, e.g. gzip) Ranges are
+        not honoured. Returns (offset, length) of the body to send, or None
+        when the request was answered here (416).
+        """
+        safe_name = re.sub(r'[\x00-\x1f"\\\\]', "_", filename)
+        # Compressed documents may go out gzip-encoded: caches must key on it.
+        return self._start_body(
+            size,
+            etag,
+            "application/octet-stream",
+            cache_control,
+            encoding,
+            vary=True,
+            extra_headers={"Content-Disposition": f"attachment; filename=\"{safe_name}\""},
+        )
 
-            logger.info(
-                "Update voice: owner=%s file_id=%s has_voice=%s",
-                user_email,
-                file_id,
-                bool(voice),
-            )
-            
-            if not voice:
-                self._send_error(400, "Missing 'voice' field")
-                return
-            
-            success = app.update_voice_by_file_id(file_id, voice, owner_email=user_email)
-            
-            if success:
-                self._send_json(200, {"success": True, "message": "Voice updated"})
+    def _start_body(self, size, etag, content_type, cache_control, encoding=None, vary=False, extra_headers=None):
+        """Send the status and headers of a response whose body is ``size`` bytes.
+
+        Honours a single ``Range`` (checked against ``If-Range``) unless
+        ``encoding`` is set (the body is sent as encoded). Returns (offset,
+        length) of the body to send, or None when the request was answered
+        here (416).
+        """
+        byte_range = None
+        if encoding is None:
+            byte_range = _parse_range(self.headers.get("Range"), size)
+        if byte_range is not None and self.headers.get("If-Range", etag) != etag:
+            # The client's partial copy is of another version: send it all.
+            byte_range = None
+        if byte_range == "unsatisfiable":
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self._set_cors_headers()
+            self.end_headers()
+            return None
+
+        offset, length = byte_range or (0, size)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {offset}-{offset + length - 1}/{size}")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        else:
+            self.send_header("Accept-Ranges", "bytes")
+        if vary:
+            self.send_header("Vary", "Accept-Encoding")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self._set_cors_headers()
+        self.end_headers()
+        return offset, length
+
+    @route("GET", "/api/files/{file_id:path}/metadata")
+    def _get_metadata(self, req):
+        """GET /api/files/{file_id}/metadata - OPF metadata and TOC of an EPUB"""
+        file_id = req.params["file_id"]
+        meta = app.get_file_metadata(file_id, owner_email=req.user)
+        if meta is None:
+            if app.file_exists(file_id, owner_email=req.user):
+                # Not extracted yet (or not an EPUB): nothing to cache.
+                self._send_error(404, "Metadata not available")
             else:
                 self._send_error(404, "File not found")
             return
-        
-        # PUT /api/files/{file_id}/highlights
-        match = re.match(r'^/api/files/(.+)/highlights$', path)
-        if match:
-            file_id = unquote(match.group(1))
-            highlights = data.get("highlights")
 
-            logger.info(
-                "Update highlights: owner=%s file_id=%s count=%d",
-                user_email,
-                file_id,
-                (len(highlights) if isinstance(highlights, list) else 0),
-            )
-            
-            if not isinstance(highlights, list):
-                self._send_error(400, "Missing or invalid 'highlights' field")
-                return
-            
-            count = app.update_highlights(file_id, highlights, owner_email=user_email)
-            logger.info("Highlights updated: owner=%s file_id=%s written=%d", user_email, file_id, count)
-            
+        etag = f'"m-{meta["content_hash"]}"'
+        cache_control = "private, max-age=300"
+        if self._not_modified(etag, cache_control):
+            return
+        meta["cover_url"] = _cover_url(file_id, meta["content_hash"]) if meta["has_cover"] else None
+        body = json.dumps(meta).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
+        self._set_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    @route("GET", "/api/files/{file_id:path}/cover")
+    def _get_cover(self, req):
+        """GET /api/files/{file_id}/cover[?v=<content hash>] - downscaled cover image"""
+        found = app.get_file_cover(req.params["file_id"], owner_email=req.user)
+        if found is None:
+            self._send_error(404, "Cover not available")
+            return
+
+        data, media_type, content_hash = found
+        etag = f'"{content_hash}"'
+        # A URL carrying the content hash never changes meaning; without it the
+        # client must revalidate (cheap: 304 on the ETag).
+        version = req.arg("v")
+        if version and content_hash.startswith(version):
+            cache_control = "private, max-age=31536000, immutable"
+        else:
+            cache_control = "private, no-cache"
+        if self._not_modified(etag, cache_control):
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", media_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
+        self._set_cors_headers()
+        self.end_headers()
+        self.wfile.write(data)
+
+    @route("GET", "/api/files/{file_id:path}/highlights")
+    def _get_highlights(self, req):
+        """GET /api/files/{file_id}/highlights"""
+        user_email = req.user
+        file_id = req.params["file_id"]
+        logger.info("Get highlights: owner=%s file_id=%s", user_email, file_id)
+        
+        highlights = app.get_highlights(file_id, owner_email=user_email)
+        if highlights is not None:
+            self._send_json(200, {"highlights": highlights})
+        else:
+            self._send_json(200, {"highlights": []})
+
+    @route("GET", "/api/files/{file_id:path}")
+    def _get_file(self, req):
+        """GET /api/files/{file_id}"""
+        user_email = req.user
+        file_id = req.params["file_id"]
+        logger.debug("Check file exists: owner=%s file_id=%s", user_email, file_id)
+        
+        # Get file metadata
+        file_data = app.get_file_data(file_id, owner_email=user_email)
+        if file_data:
+            logger.debug("File exists: owner=%s file_id=%s", user_email, file_id)
             self._send_json(200, {
-                "success": True,
-                "message": f"Updated {count} highlights"
+                "exists": True,
+                "file_id": file_data.get("filename"),
+                "title": file_data.get("title"),
+                "format": file_data.get("format"),
+                "reading_position": file_data.get("reading_position"),
+                "voice": file_data.get("voice"),
+                "created_at": file_data.get("created_at"),
+                "updated_at": file_data.get("updated_at"),
+                "position_updated_at": file_data.get("position_updated_at"),
+                "highlights_updated_at": file_data.get("highlights_updated_at"),
+                "voice_updated_at": file_data.get("voice_updated_at"),
             })
+        else:
+            logger.debug("File not found: owner=%s file_id=%s", user_email, file_id)
+            if app.is_file_deleted(file_id, owner_email=user_email):
+                self._send_json(410, {"exists": False, "deleted": True, "file_id": file_id})
+            else:
+                self._send_json(404, {"exists": False, "file_id": file_id})
+
+    @route("DELETE", "/api/files/{file_id:path}")
+    def _delete_file(self, req):
+        """DELETE /api/files/{file_id}"""
+        user_email = req.user
+        file_id = req.params["file_id"]
+        logger.info("Delete request: owner=%s file_id=%s", user_email, file_id)
+
+        ok = app.mark_file_deleted(file_id, owner_email=user_email)
+        if ok:
+            self._send_json(200, {"success": True, "deleted": True})
+        else:
+            self._send_error(400, "Invalid file id")
+
+    @route("PUT", "/api/files/{file_id:path}/position", body=BODY_JSON)
+    def _update_position(self, req):
+        """PUT /api/files/{file_id}/position"""
+        user_email = req.user
+        file_id = req.params["file_id"]
+        position = req.data.get("position")
+
+        position_logger.info(
+            "Update position: owner=%s file_id=%s has_position=%s",
+            user_email,
+            file_id,
+            position is not None,
+        )
+        
+        if position is None:
+            self._send_error(400, "Missing 'position' field")
+            return
+        
+        success = app.update_position_by_file_id(file_id, str(position), owner_email=user_email)
+        
+        if success:
+            self._send_json(200, {"success": True, "message": "Position updated"})
+        else:
+            self._send_error(404, "File not found")
+
+    @route("PUT", "/api/files/{file_id:path}/voice", body=BODY_JSON)
+    def _update_voice(self, req):
+        """PUT /api/files/{file_id}/voice"""
+        user_email = req.user
+        file_id = req.params["file_id"]
+        voice = req.data.get("voice")
+
+        logger.info(
+            "Update voice: owner=%s file_id=%s has_voice=%s",
+            user_email,
+            file_id,
+            bool(voice),
+        )
+        
+        if not voice:
+            self._send_error(400, "Missing 'voice' field")
+            return
+        
+        success = app.update_voice_by_file_id(file_id, voice, owner_email=user_email)
+        
+        if success:
+            self._send_json(200, {"success": True, "message": "Voice updated"})
+        else:
+            self._send_error(404, "File not found")
+
+    @route("PUT", "/api/files/{file_id:path}/highlights", body=BODY_JSON)
+    def _update_highlights(self, req):
+        """PUT /api/files/{file_id}/highlights"""
+        user_email = req.user
+        file_id = req.params["file_id"]
+        highlights = req.data.get("highlights")
+
+        logger.info(
+            "Update highlights: owner=%s file_id=%s count=%d",
+            user_email,
+            file_id,
+            (len(highlights) if isinstance(highlights, list) else 0),
+        )
+        
+        if not isinstance(highlights, list):
+            self._send_error(400, "Missing or invalid 'highlights' field")
             return
         
-        self._send_error(404, "Not found")
+        count = app.update_highlights(file_id, highlights, owner_email=user_email)
+        logger.info("Highlights updated: owner=%s file_id=%s written=%d", user_email, file_id, count)
+        
+        self._send_json(200, {
+            "success": True,
+            "message": f"Updated {count} highlights"
+        })
     
     # NOTE: multipart parsing is handled by email.parser (stdlib) for correctness with binary files.
     
     def log_message(self, format, *args):
-        """Log requests to stdout."""
-        logger.info("HTTP: %s", format % args)
+        """Log requests via the access logger (formatted on the log thread)."""
+        # Signed URLs are credentials: keep their signatures out of the logs.
+        args = tuple(_TOKEN_PARAM_RE.sub(r"\1REDACTED", a) if isinstance(a, str) else a for a in args)
+        access_logger.info("HTTP: " + format, *args)
+
+
+class _Server(ThreadingHTTPServer):
+    """ThreadingHTTPServer that counts open connections so shutdown can wait for them."""
+
+    request_queue_size = 128
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = 0
+        self._idle = threading.Condition()
+
+    def process_request(self, request, client_address):
+        # Counted here, before the handler thread starts, so drain() can't miss it.
+        with self._idle:
+            self.active += 1
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self._idle:
+                self.active -= 1
+                self._idle.notify_all()
+
+    def drain(self, timeout: float) -> int:
+        """Wait up to ``timeout`` seconds for open connections to finish; returns how many are left."""
+        with self._idle:
+            self._idle.wait_for(lambda: not self.active, timeout)
+            return self.active
+
+
+# Set by SIGHUP: after draining, exec a fresh server that takes over the socket.
+_reexec_requested = False
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _request_reexec(signum, frame):
+    global _reexec_requested
+    _reexec_requested = True
+    raise KeyboardInterrupt
+
+
+def _inherited_socket():
+    """The listening socket handed over by systemd socket activation or a previous server, or None."""
+    if os.environ.pop("LISTEN_PID", None) == str(os.getpid()) and int(os.environ.pop("LISTEN_FDS", "0") or 0) >= 1:
+        fd = 3
+    elif "LOCALREADER_LISTEN_FD" in os.environ:
+        fd = int(os.environ.pop("LOCALREADER_LISTEN_FD"))
+    else:
+        return None
+    sock = socket.socket(fileno=fd)
+    os.set_inheritable(fd, False)
+    logger.info("Listening socket inherited: %s", sock.getsockname())
+    return sock
+
+
+def _reexec(sock, env=None):
+    """Replace this process with a fresh server that keeps accepting on ``sock``.
+
+    Connections arriving meanwhile wait in the socket's backlog instead of being
+    refused. The pid stays the same, so container runtimes and systemd don't notice.
+    """
+    os.set_inheritable(sock.fileno(), True)
+    env = dict(os.environ, **(env or {}), LOCALREADER_LISTEN_FD=str(sock.fileno()))
+    logger.info("Re-executing server: pid=%d", os.getpid())
+    logconfig.shutdown_logging()
+    os.execve(sys.executable, [sys.executable, *sys.argv], env)
+
+
+def _flush_database() -> None:
+    """Truncate the WAL so the database file is complete on its own (backups, copies)."""
+    try:
+        reclaimed = maintenance.checkpoint(quiet=True)
+        logger.info("Shutdown: WAL checkpointed, reclaimed=%d", reclaimed)
+    except Exception as e:
+        logger.warning("Shutdown: WAL checkpoint failed: %s", e)
+
+
+def _serve(sock=None, primary=True, worker=False):
+    """Serve until SIGTERM/SIGINT (or SIGHUP), then shut down gracefully.
+
+    ``sock`` is an already listening socket (a supervisor's, or one handed over).
+    Only the primary process runs the background indexer and maintenance, so
+    they never run twice over one database.
+    """
+    # Threaded so a slow upstream translation doesn't stall position/highlight sync.
+    if sock is None:
+        server = _Server((HOST, PORT), APIHandler)
+    else:
+        server = _Server(sock.getsockname()[:2], APIHandler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = sock
+    if primary:
+        content_index.start()
+        maintenance.start()
+    staticfiles.start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    # serve_forever() has returned: nothing new is accepted from here on.
+    reexec = _reexec_requested
+    logger.info("Shutting down server: open connections=%d", server.active)
+    if not reexec:
+        server.socket.close()
+    left = server.drain(SHUTDOWN_DRAIN_SECONDS)
+    if left:
+        logger.warning("Shutdown: %d connections still open after %.0fs", left, SHUTDOWN_DRAIN_SECONDS)
+    translation.get_service().stop()
+    if primary:
+        content_index.stop()
+        maintenance.stop()
+    if not worker:
+        _flush_database()
+    if reexec:
+        _reexec(server.socket)
+
+
+def _supervise(workers: int, sock=None) -> None:
+    """Fork ``workers`` processes accepting on one socket and restart any that die.
+
+    The supervisor itself runs no threads besides the log writer (paused around
+    each fork) and handles no requests. SIGHUP re-executes it with the socket
+    and the running workers; the new supervisor starts fresh workers and only
+    then asks the old ones to drain, so no connection is refused.
+    """
+    if sock is None:
+        sock = socket.create_server((HOST, PORT), backlog=_Server.request_queue_size)
+    children = {}  # pid -> (slot, started)
+    stopping = False
+
+    def spawn(slot):
+        with logconfig.paused():
+            pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, _raise_interrupt)
+            signal.signal(signal.SIGINT, _raise_interrupt)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            code = 0
+            try:
+                _serve(sock, primary=slot == 0, worker=True)
+            except BaseException:
+                logger.exception("Worker %d failed", slot)
+                code = 1
+            finally:
+                logconfig.shutdown_logging()
+                os._exit(code)
+        children[pid] = (slot, time.monotonic())
+        logger.info("Worker %d started: pid=%d", slot, pid)
+
+    def signal_children(pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        signal_children(list(children))
+
+    def reexec(signum, frame):
+        _reexec(sock, {"LOCALREADER_RETIRE_PIDS": ",".join(map(str, children))})
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reexec)
+    for slot in range(workers):
+        spawn(slot)
+    # Workers of the supervisor this one replaced; still our children.
+    retiring = [int(p) for p in os.environ.pop("LOCALREADER_RETIRE_PIDS", "").split(",") if p]
+    signal_children(retiring)
+    while True:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in children:
+            continue
+        slot, started = children.pop(pid)
+        if stopping:
+            continue
+        logger.error("Worker %d (pid %d) exited with status %d; restarting", slot, pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < 5:
+            time.sleep(1)  # crashing on startup: don't spin
+        if not stopping:
+            spawn(slot)
+    logger.info("Shutting down server: workers stopped")
+    _flush_database()
 
 
 def main():
     # Initialize database
     app.init_db()
     logger.info("Database initialized at %s", app.DB_PATH)
-    
-    # Start server
-    server = HTTPServer((HOST, PORT), APIHandler)
-    logger.info("Server running on http://%s:%s", HOST, PORT)
+
+    sock = _inherited_socket()
+    workers = WORKERS or os.cpu_count() or 1
+    if workers > 1 and not hasattr(os, "fork"):
+        logger.warning("WORKERS=%d needs os.fork(); serving from one process", workers)
+        workers = 1
+    logger.info("Server running on http://%s:%s (workers=%d)", HOST, PORT, workers)
     logger.info("CORS allowed origins: %s", ",".join([o.strip() for o in APIHandler.ALLOWED_ORIGINS if o.strip()]))
-    logger.debug("API endpoints: GET /api/files, GET /api/files/{file_id}, GET /api/files/{file_id}/download, GET /api/files/{file_id}/highlights")
-    logger.debug("API endpoints: POST /api/files, DELETE /api/files/{file_id}, PUT /api/files/{file_id}/position|voice|highlights")
-    
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        logger.info("Shutting down server...")
-        server.shutdown()
+    for r in ROUTER.routes():
+        logger.debug("API endpoint: %s %s", r.method, r.template)
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, _request_reexec)
+    if workers == 1:
+        _serve(sock)
+    else:
+        _supervise(workers, sock)
 
 
 if __name__ == "__main__":
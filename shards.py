@@ -0,0 +1,143 @@
+"""Split an existing single-file database into per-owner shards.
+
+With ``DB_SHARDS`` set, each owner's documents, highlights, tombstones, sync
+devices and search index live in a shard file under ``SHARD_DIR``, and
+``DB_PATH`` keeps only the catalog (see ``app.py``). A database that grew up
+unsharded keeps its owners' rows in ``DB_PATH``, where a sharded server does not
+look for them: run this once, with the server stopped, before starting it with
+``DB_SHARDS``::
+
+    DB_SHARDS=16 python shards.py --split
+    python shards.py --status
+
+Each owner is moved in two steps: the rows are copied into the owner's shard
+(replacing whatever an earlier, interrupted run left there) and committed,
+then deleted from ``DB_PATH``. Re-running after a crash finishes the job.
+Row ids are kept, so tombstone sequence numbers devices have acknowledged
+stay valid. Documents without an owner stay in ``DB_PATH``.
+
+The space freed in ``DB_PATH`` is returned by incremental vacuum during
+maintenance, or at once with ``python maintenance.py --vacuum``.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import app
+
+logger = logging.getLogger("localreader.shards")
+
+# Tables holding one owner's rows, by owner_email.
+OWNER_TABLES = ("files", "highlights", "deleted_files", "sync_devices", "book_chapters")
+# Tables keyed by files.id.
+FILE_TABLES = ("content_index_state", "file_metadata")
+
+
+def _columns(conn, schema: str, table: str) -> str:
+    return ", ".join(f'"{r[1]}"' for r in conn.execute(f'PRAGMA {schema}.table_info("{table}")'))
+
+
+def _owners(conn) -> list[str]:
+    owners = set()
+    for table in OWNER_TABLES:
+        owners.update(r[0] for r in conn.execute(f"SELECT DISTINCT owner_email FROM {table} WHERE owner_email IS NOT NULL"))
+    return sorted(o for o in owners if o)
+
+
+def _move_owner(conn, owner_n: str, path: str) -> int:
+    """Copy one owner's rows into the shard at ``path``, then delete them here. Returns files moved."""
+    conn.execute("ATTACH DATABASE ? AS shard", (path,))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            file_ids = "SELECT id FROM main.files WHERE owner_email = ?"
+            for table in FILE_TABLES:
+                cols = _columns(conn, "main", table)
+                conn.execute(f"DELETE FROM shard.{table} WHERE file_id IN (SELECT id FROM shard.files WHERE owner_email = ?)", (owner_n,))
+                conn.execute(
+                    f"INSERT INTO shard.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE file_id IN ({file_ids})",
+                    (owner_n,),
+                )
+            for table in OWNER_TABLES:
+                cols = _columns(conn, "main", table)
+                conn.execute(f"DELETE FROM shard.{table} WHERE owner_email = ?", (owner_n,))
+                conn.execute(
+                    f"INSERT INTO shard.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE owner_email = ?",
+                    (owner_n,),
+                )
+            moved = conn.execute("SELECT COUNT(*) FROM shard.files WHERE owner_email = ?", (owner_n,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("DETACH DATABASE shard")
+
+    # Copied and committed: now drop them here. The files delete trigger also
+    # removes the owner's chapters, index state and metadata.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in OWNER_TABLES:
+            conn.execute(f"DELETE FROM main.{table} WHERE owner_email = ?", (owner_n,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return moved
+
+
+def split() -> dict:
+    """Move every owner's rows from DB_PATH into their shard. Returns counts."""
+    if not app.DB_SHARDS:
+        raise SystemExit("Set DB_SHARDS to the number of shards first (e.g. DB_SHARDS=16)")
+    app.init_db()
+    start = time.perf_counter()
+    conn = sqlite3.connect(app.DB_PATH, timeout=30, isolation_level=None)
+    try:
+        owners = _owners(conn)
+        files = 0
+        for owner_n in owners:
+            path = app._db_path(owner_n)
+            moved = _move_owner(conn, owner_n, path)
+            files += moved
+            logger.info("Owner moved: owner=%s shard=%s files=%d", owner_n, os.path.basename(path), moved)
+    finally:
+        conn.close()
+    result = {"owners": len(owners), "files": files, "seconds": round(time.perf_counter() - start, 3)}
+    logger.info("Split done: owners=%d files=%d seconds=%.1f", len(owners), files, result["seconds"])
+    return result
+
+
+def status() -> dict:
+    """Owners, files and bytes of the catalog and each shard."""
+    with sqlite3.connect(app.DB_PATH, timeout=30) as conn:
+        assigned = dict(conn.execute("SELECT shard, COUNT(*) FROM owner_shards GROUP BY shard").fetchall())
+    out = []
+    for path in [app.DB_PATH, *app.shard_paths()]:
+        with sqlite3.connect(path, timeout=30) as conn:
+            owners = len(_owners(conn))
+            files = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        out.append({"path": path, "owners": owners, "files": files, "bytes": os.path.getsize(path)})
+    return {"shards": app.DB_SHARDS, "assigned_owners": assigned, "databases": out}
+
+
+def main(argv=None):
+    import logconfig
+
+    parser = argparse.ArgumentParser(description="Split the LocalReader database into per-owner shards (stop the server first).")
+    parser.add_argument("--split", action="store_true", help="move every owner's data from DB_PATH into its shard")
+    parser.add_argument("--status", action="store_true", help="show owners, files and size of each database file")
+    args = parser.parse_args(argv)
+    if not args.split and not args.status:
+        parser.error("nothing to do: use --split or --status")
+
+    logconfig.configure_logging()
+    result = split() if args.split else status()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
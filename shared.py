@@ -0,0 +1,38 @@
+"""A few numbers shared by all worker processes (``WORKERS`` > 1).
+
+The values live in an anonymous shared memory mapping created when this module
+is imported, which happens in the server process before it forks its workers,
+so every worker reads and writes the same memory. With a single process they
+are simply module state.
+
+Slots hold 8-byte values written with one aligned store, so readers never see
+a torn value. There is no read-modify-write: writers that need to signal
+"something changed" write a value unique to them (see :func:`new_token`).
+"""
+import itertools
+import mmap
+import os
+import struct
+
+_SLOTS = {
+    # time.monotonic() of the latest request in any worker (maintenance waits for quiet).
+    "last_request": "d",
+    # Changes whenever any worker deletes or compacts tombstones.
+    "tombstones": "q",
+}
+_OFFSETS = {name: i * 8 for i, name in enumerate(_SLOTS)}
+_mem = mmap.mmap(-1, 8 * len(_SLOTS))
+_counter = itertools.count(1)
+
+
+def read(name: str):
+    return struct.unpack_from(_SLOTS[name], _mem, _OFFSETS[name])[0]
+
+
+def write(name: str, value) -> None:
+    struct.pack_into(_SLOTS[name], _mem, _OFFSETS[name], value)
+
+
+def new_token() -> int:
+    """A value no other process (or earlier call) produces: pid in the high bits."""
+    return (os.getpid() << 32) | (next(_counter) & 0xFFFFFFFF)
@@ -49,6 +49,10 @@ export class ServerSync {
             const value = (token || "").toString();
             if (value) localStorage.setItem("localreaderAuthToken", value);
             else localStorage.removeItem("localreaderAuthToken");
+            // Tombstone sequences belong to the previous account.
+            for (const key of Object.keys(localStorage)) {
+                if (key.startsWith("localreaderTombstoneSeq:")) localStorage.removeItem(key);
+            }
         } catch {
             // ignore
         }
@@ -131,10 +135,48 @@ export class ServerSync {
         }
     }
 
+    _getDeviceId() {
+        try {
+            let id = localStorage.getItem("localreaderDeviceId");
+            if (!id) {
+                id = crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+                localStorage.setItem("localreaderDeviceId", id);
+            }
+            return id;
+        } catch {
+            return "";
+        }
+    }
+
     _withAuthHeaders(headers = {}) {
         const token = this._getAuthToken();
         if (!token) return headers;
-        return { ...headers, Authorization: `Bearer ${token}` };
+        const deviceId = this._getDeviceId();
+        return {
+            ...headers,
+            Authorization: `Bearer ${token}`,
+            ...(deviceId ? { "X-Device-Id": deviceId } : {}),
+        };
+    }
+
+    // File listing URL asking only for tombstones newer than the last applied ones.
+    _filesListUrl(serverUrl) {
+        let seq = 0;
+        try {
+            seq = Number(localStorage.getItem(`localreaderTombstoneSeq:${serverUrl}`)) || 0;
+        } catch {
+            // ignore
+        }
+        return `${serverUrl}/api/files?tombstones_since=${seq}`;
+    }
+
+    _setTombstoneSeq(serverUrl, seq) {
+        if (!Number.isFinite(seq)) return;
+        try {
+            localStorage.setItem(`localreaderTombstoneSeq:${serverUrl}`, String(seq));
+        } catch {
+            // ignore
+        }
     }
 
     _fetch(url, options = {}) {
@@ -277,7 +319,7 @@ export class ServerSync {
         if (!serverUrl) return;
 
         try {
-            const response = await this._fetch(`${serverUrl}/api/files`, {
+            const response = await this._fetch(this._filesListUrl(serverUrl), {
                 method: "GET",
                 headers: { "Content-Type": "application/json" },
             });
@@ -297,6 +339,7 @@ export class ServerSync {
                 const docType = t.format === "epub" ? "epub" : "pdf";
                 await this._purgeLocalByActualFilename(actualName, docType);
             }
+            this._setTombstoneSeq(serverUrl, data.tombstone_seq);
 
             const [localPdfKeys, localEpubKeys] = await Promise.all([
                 this.app.progressManager.listSavedPDFs(),
@@ -539,6 +582,63 @@ export class ServerSync {
         }
     }
 
+    // Session headers for requests other modules make to the server (e.g. voice model downloads).
+    authHeaders(headers = {}) {
+        return this._withAuthHeaders(headers);
+    }
+
+    // Shared sentence-audio cache: audio one device synthesized can be reused by another.
+    canShareAudio() {
+        return !!this.getServerUrl() && !!this._getAuthToken();
+    }
+
+    async lookupTtsAudio(voice, speed, textHashes) {
+        const serverUrl = this.getServerUrl();
+        if (!serverUrl || !textHashes.length) return {};
+        try {
+            const response = await this._fetch(`${serverUrl}/api/tts/audio/lookup`, {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ voice, speed, text_hashes: textHashes }),
+            });
+            if (!response.ok) return {};
+            const data = await response.json();
+            return data?.audio || {};
+        } catch (error) {
+            console.warn("[ServerSync] Audio lookup failed:", error);
+            return {};
+        }
+    }
+
+    async fetchTtsAudio(audioHash) {
+        const serverUrl = this.getServerUrl();
+        if (!serverUrl) return null;
+        try {
+            const response = await this._fetch(`${serverUrl}/api/tts/audio/${audioHash}`);
+            return response.ok ? await response.arrayBuffer() : null;
+        } catch (error) {
+            console.warn("[ServerSync] Audio download failed:", error);
+            return null;
+        }
+    }
+
+    async uploadTtsAudio(voice, speed, textHash, wavBlob) {
+        const serverUrl = this.getServerUrl();
+        if (!serverUrl) return false;
+        const params = new URLSearchParams({ voice, speed: String(speed), text_hash: textHash });
+        try {
+            const response = await this._fetch(`${serverUrl}/api/tts/audio?${params}`, {
+                method: "PUT",
+                headers: { "Content-Type": "audio/wav" },
+                body: wavBlob,
+            });
+            return response.ok;
+        } catch (error) {
+            console.warn("[ServerSync] Audio upload failed:", error);
+            return false;
+        }
+    }
+
     async checkFileExists(fileId) {
         const serverUrl = this.getServerUrl();
         if (!serverUrl) return false;
@@ -842,7 +942,7 @@ export class ServerSync {
         }
 
         try {
-            const response = await this._fetch(`${serverUrl}/api/files`, {
+            const response = await this._fetch(this._filesListUrl(serverUrl), {
                 method: "GET",
                 headers: { "Content-Type": "application/json" },
             });
@@ -898,7 +998,7 @@ export class ServerSync {
         // First check if a file with the same actual filename already exists
         const serverUrl = this.getServerUrl();
         try {
-            const response = await this._fetch(`${serverUrl}/api/files`, {
+            const response = await this._fetch(this._filesListUrl(serverUrl), {
                 method: "GET",
                 headers: { "Content-Type": "application/json" },
             });
@@ -1130,7 +1230,7 @@ export class ServerSync {
 
         try {
             // Get list of files from server
-            const response = await this._fetch(`${serverUrl}/api/files`, {
+            const response = await this._fetch(this._filesListUrl(serverUrl), {
                 method: "GET",
                 headers: {
                     "Content-Type": "application/json",
@@ -185,6 +185,118 @@ function loadModel(key) {
         });
     });
 }
+function deleteModel(key) {
+    return openDB().then((db) => {
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction("models", "readwrite");
+            tx.objectStore("models").delete(key);
+            tx.oncomplete = () => resolve();
+            tx.onerror = () => reject(tx.error);
+        });
+    });
+}
+function progressEmitter(onProgress) {
+    let lastPctEmitted = -1;
+    let lastEmitAt = 0;
+    return (pct) => {
+        if (!onProgress) return;
+        const now = performance.now ? performance.now() : Date.now();
+        const pctRounded = Math.max(0, Math.min(100, pct));
+
+        // Throttle UI updates to avoid spamming the message area.
+        const pctFloor = Math.floor(pctRounded);
+        if (pctFloor === lastPctEmitted && now - lastEmitAt < 250) return;
+
+        lastPctEmitted = pctFloor;
+        lastEmitAt = now;
+        onProgress(pctRounded);
+    };
+}
+function concatChunks(chunks, totalBytes) {
+    const out = new Uint8Array(totalBytes);
+    let offset = 0;
+    for (const chunk of chunks) {
+        out.set(chunk, offset);
+        offset += chunk.byteLength;
+    }
+    return out;
+}
+async function sha256Hex(buffer) {
+    const digest = await crypto.subtle.digest("SHA-256", buffer);
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+}
+
+// Downloads from the LocalReader server's model store are saved in parts of
+// this size, so an interrupted download resumes with a Range request.
+const PARTIAL_PART_BYTES = 4 * 1024 * 1024;
+
+async function fetchModelResumable(key, url, expected, emit, baseHeaders = {}) {
+    const etag = `"${expected.sha256}"`;
+    const parts = [];
+    let receivedBytes = 0;
+    const partial = await loadModel(`${key}#partial`);
+    if (partial && partial.etag === etag) {
+        for (let i = 0; i < partial.parts; i++) {
+            const part = await loadModel(`${key}#part${i}`);
+            if (!part) break;
+            parts.push(new Uint8Array(part));
+            receivedBytes += part.byteLength;
+        }
+    }
+
+    const headers = receivedBytes > 0 ? { ...baseHeaders, Range: `bytes=${receivedBytes}-`, "If-Range": etag } : baseHeaders;
+    const response = await fetch(url, { headers });
+    if (!response.ok) throw new Error(`Failed to load model: ${response.status}`);
+    if (response.status !== 206) {
+        // A full body: drop every saved part, including any past what this download will write.
+        if (partial) {
+            for (let i = 0; i < partial.parts; i++) await deleteModel(`${key}#part${i}`);
+            await deleteModel(`${key}#partial`);
+        }
+        parts.length = 0;
+        receivedBytes = 0;
+    } else {
+        console.log(`Resuming model download at ${receivedBytes} bytes.`);
+    }
+
+    const reader = response.body.getReader();
+    let pending = [];
+    let pendingBytes = 0;
+    const savePart = async () => {
+        const part = concatChunks(pending, pendingBytes);
+        await saveModel(`${key}#part${parts.length}`, part.buffer);
+        parts.push(part);
+        await saveModel(`${key}#partial`, { etag, parts: parts.length });
+        pending = [];
+        pendingBytes = 0;
+    };
+
+    emit((receivedBytes / expected.size) * 100);
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        if (value) {
+            pending.push(value);
+            pendingBytes += value.byteLength;
+            receivedBytes += value.byteLength;
+            if (pendingBytes >= PARTIAL_PART_BYTES) await savePart();
+            emit((receivedBytes / expected.size) * 100);
+        }
+    }
+    if (pendingBytes) parts.push(concatChunks(pending, pendingBytes));
+
+    const buffer = concatChunks(parts, receivedBytes).buffer;
+    for (let i = 0; i < parts.length; i++) await deleteModel(`${key}#part${i}`);
+    await deleteModel(`${key}#partial`);
+    if (receivedBytes !== expected.size || (await sha256Hex(buffer)) !== expected.sha256) {
+        throw new Error("Downloaded model failed verification");
+    }
+    emit(100);
+    return buffer;
+}
+
+/* options.expected = { size, sha256 } (from the server's model manifest) enables
+   resumable, verified downloads; options.headers are sent with every request. */
 async function getCachedModel(key, url, options) {
     let buffer = await loadModel(key);
     if (buffer) {
@@ -193,37 +305,30 @@ async function getCachedModel(key, url, options) {
     }
     console.log("Fetching model from network...");
 
-    const response = await fetch(url);
+    const onProgress =
+        typeof options === "function" ? options : options && typeof options.onProgress === "function" ? options.onProgress : null;
+    const emit = progressEmitter(onProgress);
+
+    const headers = (options && options.headers) || {};
+    if (options && options.expected) {
+        buffer = await fetchModelResumable(key, url, options.expected, emit, headers);
+        await saveModel(key, buffer);
+        console.log("Model cached.");
+        return buffer;
+    }
+
+    const response = await fetch(url, { headers });
     if (!response.ok) throw new Error(`Failed to load model: ${response.status}`);
 
     const contentLengthHeader = response.headers.get("Content-Length");
     const totalBytes = contentLengthHeader ? Number(contentLengthHeader) : NaN;
 
-    const onProgress =
-        typeof options === "function" ? options : options && typeof options.onProgress === "function" ? options.onProgress : null;
-
     // If we can stream + know total size, report progress.
     if (response.body && Number.isFinite(totalBytes) && totalBytes > 0) {
         const reader = response.body.getReader();
         const chunks = [];
         let receivedBytes = 0;
 
-        let lastPctEmitted = -1;
-        let lastEmitAt = 0;
-        const emit = (pct) => {
-            if (!onProgress) return;
-            const now = performance.now ? performance.now() : Date.now();
-            const pctRounded = Math.max(0, Math.min(100, pct));
-
-            // Throttle UI updates to avoid spamming the message area.
-            const pctFloor = Math.floor(pctRounded);
-            if (pctFloor === lastPctEmitted && now - lastEmitAt < 250) return;
-
-            lastPctEmitted = pctFloor;
-            lastEmitAt = now;
-            onProgress(pctRounded);
-        };
-
         emit(0);
         while (true) {
             const { done, value } = await reader.read();
@@ -235,13 +340,7 @@ async function getCachedModel(key, url, options) {
             }
         }
 
-        const out = new Uint8Array(receivedBytes);
-        let offset = 0;
-        for (const chunk of chunks) {
-            out.set(chunk, offset);
-            offset += chunk.byteLength;
-        }
-        buffer = out.buffer;
+        buffer = concatChunks(chunks, receivedBytes).buffer;
         emit(100);
     } else {
         if (onProgress) onProgress(0);
@@ -261,14 +360,14 @@ async function loadJSON(key) {
     const jsonString = await loadModel(key);
     return jsonString ? JSON.parse(jsonString) : null;
 }
-async function getCachedJSON(key, url) {
+async function getCachedJSON(key, url, headers = {}) {
     let data = await loadJSON(key);
     if (data) {
         // console.log("Loaded config from cache.");
         return data;
     }
     console.log("Fetching config from network...");
-    const response = await fetch(url);
+    const response = await fetch(url, { headers });
     if (!response.ok) throw new Error(`Failed to load config: ${response.status}`);
     data = await response.json();
     await saveJSON(key, data);
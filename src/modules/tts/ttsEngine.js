@@ -20,6 +20,9 @@ export class TTSEngine {
         this.initializingPromise = null;
         this._renderAheadPages = new Set();
         this._restartAttemptedCount = 0;
+        // `${voice}|${speed}|${textHash}` -> audio hash (or null) from the server's audio cache.
+        this._serverAudio = new Map();
+        this._serverLookup = null;
 
         const scriptSrc = (document.currentScript && document.currentScript.src) || window.location.href;
         const scriptDir = scriptSrc.substring(0, scriptSrc.lastIndexOf("/"));
@@ -50,6 +53,27 @@ export class TTSEngine {
         }
     }
 
+    async _serverModelFiles(voiceId) {
+        const serverSync = this.app.serverSync;
+        if (!serverSync?.isEnabled?.()) return null;
+        const serverUrl = serverSync.getServerUrl();
+        try {
+            // Signed in, the server fetches voices it doesn't have yet; anonymously it only serves stored ones.
+            const headers = serverSync.authHeaders();
+            const res = await fetch(`${serverUrl}/api/models/manifest?voice=${encodeURIComponent(voiceId)}`, { headers });
+            if (!res.ok) throw new Error(`${res.status} ${res.statusText}`);
+            const data = await res.json();
+            const files = {};
+            for (const f of data.files || []) {
+                files[f.path] = { ...f, url: `${serverUrl}${f.url}`, headers };
+            }
+            return files;
+        } catch (err) {
+            console.warn("Server model store unavailable, using Hugging Face:", err);
+            return null;
+        }
+    }
+
     async ensureAudioContext() {
         const { state, config } = this.app;
         if (!state.audioCtx) {
@@ -124,13 +148,26 @@ export class TTSEngine {
                 throw new Error(`Voice ${voiceId} is missing required model or config files.`);
             }
 
-            const MODEL_URL = this.huggingFaceRoot + modelFile;
-            const CONFIG_URL = this.huggingFaceRoot + configFile;
+            let MODEL_URL = this.huggingFaceRoot + modelFile;
+            let CONFIG_URL = this.huggingFaceRoot + configFile;
+            let expected = null;
+            let headers = {};
+
+            // Prefer the sync server's model store: one upstream download per server, resumable and verified.
+            const served = await this._serverModelFiles(voiceId);
+            if (served && served[modelFile] && served[configFile]) {
+                MODEL_URL = served[modelFile].url;
+                CONFIG_URL = served[configFile].url;
+                expected = { size: served[modelFile].size, sha256: served[modelFile].sha256 };
+                headers = served[modelFile].headers;
+            }
 
             const modelBuffer = await getCachedModel(modelFile, MODEL_URL, {
                 onProgress: (pct) => ui.showMessage(`Downloading model: ${pct.toFixed(2)}%`, 1200),
+                expected,
+                headers,
             });
-            const voiceConfig = await getCachedJSON(configFile, CONFIG_URL);
+            const voiceConfig = await getCachedJSON(configFile, CONFIG_URL, headers);
 
             const baseUrl = getWebsiteRoot();
             const ortJsUrl = `${baseUrl}thirdparty/ort/ort.js`;
@@ -253,6 +290,12 @@ export class TTSEngine {
 
         const decoded = await this.safeDecodeAudioData(bufferForDecode.slice(0));
         const effectiveBlob = wavBlob || new Blob([bufferForDecode], { type: "audio/wav" });
+        await this._storeSentenceAudio(sentence, voice, text, effectiveBlob, decoded);
+        this._shareServerAudio(voice, state.CURRENT_SPEED, text, effectiveBlob);
+    }
+
+    async _storeSentenceAudio(sentence, voice, text, effectiveBlob, decoded) {
+        const { state, config } = this.app;
         let wordBoundaries = [];
         if (config.ENABLE_WORD_HIGHLIGHT) {
             const words = text.split(/\s+/).filter(Boolean);
@@ -290,6 +333,79 @@ export class TTSEngine {
         delete sentence._restartAttempted;
     }
 
+    async _textHash(text) {
+        const digest = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(text));
+        return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+    }
+
+    // Look up, in one request, which of these sentences the server already has audio for.
+    async _lookupServerAudio(voice, speed, texts) {
+        const serverSync = this.app.serverSync;
+        const hashes = await Promise.all(texts.map((t) => this._textHash(t)));
+        const wanted = hashes.filter((h) => !this._serverAudio.has(`${voice}|${speed}|${h}`));
+        if (!wanted.length) return;
+        const found = await serverSync.lookupTtsAudio(voice, speed, wanted);
+        for (const h of wanted) {
+            this._serverAudio.set(`${voice}|${speed}|${h}`, found[h]?.audio_hash || null);
+        }
+    }
+
+    _prefetchServerAudio(indices) {
+        const { state } = this.app;
+        if (!this.app.serverSync?.canShareAudio?.()) return;
+        const voice = document.getElementById("voice-select")?.value || this.app.config.DEFAULT_PIPER_VOICE;
+        const texts = [];
+        for (const i of indices) {
+            const s = state.sentences[i];
+            if (!s || !s.isTextToRead || s.audioReady) continue;
+            const sourceText = s.readableText && s.readableText.trim().length ? s.readableText : s.text;
+            if (sourceText && hasUsableSpeechText(sourceText)) texts.push(normalizeText(sourceText));
+        }
+        if (!texts.length) return;
+        this._serverLookup = this._lookupServerAudio(voice, state.CURRENT_SPEED, texts)
+            .catch((err) => console.warn("[TTSEngine] Audio lookup failed", err))
+            .finally(() => {
+                this._serverLookup = null;
+            });
+    }
+
+    // Use audio another device already synthesized for this sentence. Returns true if it did.
+    async _loadServerAudio(sentence, voice, text) {
+        const { state } = this.app;
+        const serverSync = this.app.serverSync;
+        if (!serverSync?.canShareAudio?.()) return false;
+        try {
+            if (this._serverLookup) await this._serverLookup;
+            const speed = state.CURRENT_SPEED;
+            const textHash = await this._textHash(text);
+            const key = `${voice}|${speed}|${textHash}`;
+            if (!this._serverAudio.has(key)) await this._lookupServerAudio(voice, speed, [text]);
+            const audioHash = this._serverAudio.get(key);
+            if (!audioHash) return false;
+            const wavBuffer = await serverSync.fetchTtsAudio(audioHash);
+            if (!wavBuffer) return false;
+            await this.ensureAudioContext();
+            const decoded = await this.safeDecodeAudioData(wavBuffer.slice(0));
+            await this._storeSentenceAudio(sentence, voice, text, new Blob([wavBuffer], { type: "audio/wav" }), decoded);
+            return true;
+        } catch (err) {
+            console.warn("[TTSEngine] Cached audio unusable, synthesizing", err);
+            return false;
+        }
+    }
+
+    _shareServerAudio(voice, speed, text, wavBlob) {
+        const serverSync = this.app.serverSync;
+        if (!serverSync?.canShareAudio?.()) return;
+        this._textHash(text)
+            .then(async (textHash) => {
+                if (await serverSync.uploadTtsAudio(voice, speed, textHash, wavBlob)) {
+                    this._serverAudio.delete(`${voice}|${speed}|${textHash}`);
+                }
+            })
+            .catch((err) => console.warn("[TTSEngine] Audio upload failed", err));
+    }
+
     async synthesizeSequential(idx) {
         const { state, config } = this.app;
         if (!state.generationEnabled) return;
@@ -341,7 +457,9 @@ export class TTSEngine {
         this.app.eventBus.emit(EVENTS.TTS_SYNTHESIS_START, { index: idx });
 
         try {
-            await this.buildPiperAudio(s, voice, norm);
+            if (!(await this._loadServerAudio(s, voice, norm))) {
+                await this.buildPiperAudio(s, voice, norm);
+            }
             this.app.eventBus.emit(EVENTS.TTS_SYNTHESIS_COMPLETE, { index: idx });
         } catch (err) {
             s.audioError = err;
@@ -372,12 +490,19 @@ export class TTSEngine {
     schedulePrefetch() {
         const { state, config } = this.app;
         if (!state.generationEnabled) return;
+        const base = state.currentSentenceIndex;
+        const ahead = [];
+        for (let i = Math.max(base, 0); i <= base + config.PREFETCH_AHEAD && i < state.sentences.length; i++) {
+            ahead.push(i);
+        }
+        // One lookup for the whole window before the queue starts synthesizing it.
+        this._prefetchServerAudio(ahead);
+
         const indices = [];
-        if (state.currentSentenceIndex >= 0) {
-            this.app.ttsQueue.add(state.currentSentenceIndex, true);
-            indices.push(state.currentSentenceIndex);
+        if (base >= 0) {
+            this.app.ttsQueue.add(base, true);
+            indices.push(base);
         }
-        const base = state.currentSentenceIndex;
         for (let i = base + 1; i <= base + config.PREFETCH_AHEAD && i < state.sentences.length; i++) {
             this.app.ttsQueue.add(i);
         }
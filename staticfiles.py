@@ -0,0 +1,287 @@
+"""Serving the PWA frontend from ``STATIC_ROOT``.
+
+Off unless ``STATIC_ROOT`` is set (the frontend is usually hosted elsewhere).
+:func:`start` indexes the servable files under the root and hands the
+compressible ones to a background thread, which writes gzip (and, if the
+``brotli`` module is installed, brotli) variants to ``STATIC_CACHE_DIR``, named
+by content hash so restarts reuse them. Until a variant exists the file is
+served uncompressed.
+
+Every response carries a content-hash ETag. Files whose names carry a hash
+(``piper-o91UDS6e.js``, the font files) or that are requested with ``?v=`` are
+cached as ``immutable``; everything else is revalidated on each load, which is
+a cheap 304. Bodies go out through :func:`blobstore.sendfile`.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+import app
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional: gzip variants only
+    brotli = None
+
+logger = logging.getLogger("localreader.static")
+
+STATIC_ROOT = os.environ.get("STATIC_ROOT", "").strip()
+STATIC_CACHE_DIR = os.environ.get("STATIC_CACHE_DIR") or os.path.join(
+    os.path.dirname(app.DB_PATH) or ".", "static-cache"
+)
+# Smaller files gain nothing from compression.
+MIN_COMPRESS_BYTES = 1024
+# Keep a variant only if it saves at least this fraction.
+MIN_SAVING = 0.1
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# Only these file types are served; anything else under the root (Python
+# sources, .env, the database) is invisible.
+MIME_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".mjs": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".json": "application/json",
+    ".map": "application/json",
+    ".webmanifest": "application/manifest+json",
+    ".wasm": "application/wasm",
+    ".svg": "image/svg+xml",
+    ".txt": "text/plain; charset=utf-8",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+    ".ico": "image/x-icon",
+    ".woff2": "font/woff2",
+    ".woff": "font/woff",
+    ".ttf": "font/ttf",
+}
+_COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".json", ".map", ".webmanifest", ".wasm", ".svg", ".txt", ".ico", ".ttf"}
+# Top-level directories of the repository that are not part of the frontend.
+_SKIP_DIRS = {"data", "research", "scripts", "node_modules"}
+# A hash-like name segment: 8+ characters mixing letters and digits.
+_VERSIONED_RE = re.compile(r"(?:^|[-_.])(?=[A-Za-z0-9_]*\d)(?=[A-Za-z0-9_]*[A-Za-z])[A-Za-z0-9_]{8,}$")
+
+SERVED = metrics.counter(
+    "localreader_static_served_bytes_total",
+    "Static asset bytes sent to clients by content encoding.",
+    ("encoding",),
+)
+
+
+class Asset:
+    __slots__ = ("path", "size", "mtime_ns", "content_hash", "etag", "mime", "cache_control", "variants")
+
+    def __init__(self, path, st, content_hash, ext, versioned):
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.content_hash = content_hash
+        self.etag = f'"{content_hash[:20]}"'
+        self.mime = MIME_TYPES[ext]
+        self.cache_control = IMMUTABLE_CACHE if versioned else REVALIDATE_CACHE
+        # encoding ("br"/"gzip") -> (path, size); filled in by the compressor.
+        self.variants = {}
+
+
+_assets: dict[str, Asset] = {}
+_lock = threading.Lock()
+_queue: queue.Queue = queue.Queue()
+_thread = None
+_root = None
+_excluded: set[str] = set()
+
+
+def enabled() -> bool:
+    return _root is not None
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _servable(rel: str) -> str | None:
+    """Absolute path for the root-relative ``rel`` if it may be served, else None."""
+    parts = rel.split("/")
+    if not rel or any(not p or p.startswith((".", "_")) or p == ".." for p in parts):
+        return None
+    if parts[0] in _SKIP_DIRS or os.path.splitext(parts[-1])[1].lower() not in MIME_TYPES:
+        return None
+    path = os.path.realpath(os.path.join(_root, *parts))
+    if os.path.commonpath([path, _root]) != _root or any(
+        os.path.commonpath([path, d]) == d for d in _excluded
+    ):
+        return None
+    return path if os.path.isfile(path) else None
+
+
+def _index(rel: str, path: str) -> Asset | None:
+    try:
+        st = os.stat(path)
+        content_hash = _hash_file(path)
+    except OSError:
+        return None
+    name, ext = os.path.splitext(os.path.basename(path))
+    asset = Asset(path, st, content_hash, ext.lower(), bool(_VERSIONED_RE.search(name)))
+    with _lock:
+        _assets[rel] = asset
+    if ext.lower() in _COMPRESSIBLE and asset.size >= MIN_COMPRESS_BYTES:
+        _queue.put(asset)
+    return asset
+
+
+def lookup(url_path: str) -> Asset | None:
+    """The asset for a request path (``/`` is ``index.html``), or None."""
+    if _root is None:
+        return None
+    rel = url_path.lstrip("/") or "index.html"
+    if rel.endswith("/"):
+        rel += "index.html"
+    asset = _assets.get(rel)
+    if asset is not None:
+        try:
+            st = os.stat(asset.path)
+        except OSError:
+            with _lock:
+                _assets.pop(rel, None)
+            return None
+        if st.st_size == asset.size and st.st_mtime_ns == asset.mtime_ns:
+            return asset
+    # New or edited since it was indexed.
+    path = _servable(rel)
+    return _index(rel, path) if path else None
+
+
+def is_versioned_request(query_string: str) -> bool:
+    """``?v=...`` marks a URL that changes whenever the file does."""
+    return any(p.startswith("v=") for p in query_string.split("&"))
+
+
+def _variant_path(content_hash: str, suffix: str) -> str:
+    return os.path.join(STATIC_CACHE_DIR, f"{content_hash}.{suffix}")
+
+
+def _compress(asset: Asset) -> None:
+    data = None
+    codecs = [("gzip", "gz", lambda d: gzip.compress(d, 9, mtime=0))]
+    if brotli is not None:
+        codecs.insert(0, ("br", "br", lambda d: brotli.compress(d, quality=11)))
+    for encoding, suffix, fn in codecs:
+        path = _variant_path(asset.content_hash, suffix)
+        if not os.path.exists(path):
+            if data is None:
+                with open(asset.path, "rb") as f:
+                    data = f.read()
+                if hashlib.sha256(data).hexdigest() != asset.content_hash:
+                    return  # edited meanwhile; lookup() re-indexes it
+            packed = fn(data)
+            if len(packed) > asset.size * (1 - MIN_SAVING):
+                packed = b""  # not worth it: an empty marker so it isn't retried
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as out:
+                out.write(packed)
+            os.replace(tmp, path)
+        size = os.path.getsize(path)
+        if size:
+            asset.variants[encoding] = (path, size)
+
+
+def _run() -> None:
+    started, count = 0.0, 0
+    while True:
+        asset = _queue.get()
+        if not count:
+            started = time.monotonic()
+        try:
+            _compress(asset)
+            count += 1
+        except Exception:
+            logger.exception("Precompression failed: %s", asset.path)
+        if _queue.empty() and count:
+            with _lock:
+                assets = list(_assets.values())
+            total = sum(a.size for a in assets)
+            for encoding in ("br", "gzip"):
+                packed = sum(a.variants[encoding][1] if encoding in a.variants else a.size for a in assets)
+                if packed < total:
+                    logger.info("Static assets (%s): %d -> %d bytes", encoding, total, packed)
+            logger.info("Precompressed %d static assets in %.1fs", count, time.monotonic() - started)
+            _prune({a.content_hash for a in assets})
+            count = 0
+
+
+def _prune(live: set[str]) -> None:
+    """Remove variants of files that no longer exist."""
+    for name in os.listdir(STATIC_CACHE_DIR):
+        if name.partition(".")[0] not in live:
+            try:
+                os.unlink(os.path.join(STATIC_CACHE_DIR, name))
+            except OSError:
+                pass
+
+
+def start() -> None:
+    """Index STATIC_ROOT and start precompressing in the background."""
+    global _root, _thread
+    if not STATIC_ROOT or _thread is not None:
+        return
+    root = os.path.realpath(STATIC_ROOT)
+    if not os.path.isdir(root):
+        logger.error("STATIC_ROOT is not a directory, static serving disabled: %s", STATIC_ROOT)
+        return
+    os.makedirs(STATIC_CACHE_DIR, exist_ok=True)
+    # Never serve server state, even when it lives under the root.
+    _excluded.update(
+        os.path.realpath(d) for d in (os.path.dirname(app.DB_PATH) or ".", STATIC_CACHE_DIR)
+    )
+    _excluded.discard(root)
+    _root = root
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith((".", "_"))]
+        for filename in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, "/")
+            path = _servable(rel)
+            if path:
+                _index(rel, path)
+    logger.info(
+        "Serving static files: root=%s assets=%d bytes=%d brotli=%s",
+        root, len(_assets), sum(a.size for a in _assets.values()), brotli is not None,
+    )
+    _thread = threading.Thread(target=_run, name="static-precompress", daemon=True)
+    _thread.start()
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """Content codings an ``Accept-Encoding`` header allows (lowercased, q=0 left out)."""
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in {"0", "0.0", "0.00", "0.000"}:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_encoding(asset: Asset, accept_encoding: str) -> str | None:
+    """Best available variant the client accepts, or None for identity."""
+    if not asset.variants or not accept_encoding:
+        return None
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in ("br", "gzip"):
+        if encoding in asset.variants and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
@@ -0,0 +1,700 @@
+"""Where document bytes live.
+
+By default documents are stored in SQLite (``files.file_data``). With
+``BLOB_STORE`` set they go to a blob store instead, named by their
+``content_hash`` (plus ``.gz`` or ``.xz`` when compressed, see
+compression.py), and the database keeps only their metadata, so the
+document capacity can grow independently of the database:
+
+* ``local``: files under ``BLOB_STORE_DIR``;
+* ``s3``: a bucket on an S3-compatible service (AWS, MinIO, Garage, ...),
+  with requests signed (SigV4) using only the standard library. Reads go
+  through a local disk cache under ``BLOB_STORE_CACHE_DIR``, least recently
+  read evicted first once it exceeds ``BLOB_STORE_CACHE_MAX_BYTES``, so
+  downloads are still sent with ``sendfile``.
+
+Objects are immutable (a hash always names the same bytes) and shared by
+every file with that content. The maintenance sweep deletes an object once no
+file has referenced it for ``BLOB_STORE_GRACE_DAYS``, so restoring a recent
+database backup finds its documents. ``python storage.py --migrate`` moves
+documents already in SQLite to the store; ``python s3local.py`` is a small
+S3 stand-in for trying the ``s3`` store locally.
+"""
+import argparse
+import hashlib
+import hmac
+import http.client
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+import metrics
+
+logger = logging.getLogger("localreader.storage")
+
+# "" keeps documents in SQLite; "local" or "s3".
+BLOB_STORE = os.environ.get("BLOB_STORE", "").strip().lower()
+# Same default directory as app.DB_PATH (app imports this module, so it can't be read from there).
+_DATA_DIR = os.path.dirname(os.environ.get("DB_PATH", "data/database.db")) or "."
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR") or os.path.join(_DATA_DIR, "blob-store")
+BLOB_S3_ENDPOINT = os.environ.get("BLOB_S3_ENDPOINT", "").rstrip("/")
+BLOB_S3_BUCKET = os.environ.get("BLOB_S3_BUCKET", "")
+BLOB_S3_REGION = os.environ.get("BLOB_S3_REGION", "us-east-1")
+BLOB_S3_ACCESS_KEY = os.environ.get("BLOB_S3_ACCESS_KEY", "")
+BLOB_S3_SECRET_KEY = os.environ.get("BLOB_S3_SECRET_KEY", "")
+BLOB_S3_PREFIX = os.environ.get("BLOB_S3_PREFIX", "documents/")
+BLOB_S3_TIMEOUT = int(os.environ.get("BLOB_S3_TIMEOUT", "60"))
+BLOB_STORE_CACHE_DIR = os.environ.get("BLOB_STORE_CACHE_DIR") or os.path.join(_DATA_DIR, "blob-store-cache")
+# 0 disables the cache: every read goes to the bucket.
+BLOB_STORE_CACHE_MAX_BYTES = int(os.environ.get("BLOB_STORE_CACHE_MAX_BYTES", str(4 * 1024**3)))
+BLOB_STORE_GRACE_DAYS = float(os.environ.get("BLOB_STORE_GRACE_DAYS", "30"))
+CHUNK = 1024 * 1024
+# Reading a cached object refreshes its mtime (its LRU position) at most this often.
+TOUCH_INTERVAL = 3600
+
+S3_SECONDS = metrics.histogram(
+    "localreader_blob_store_request_seconds",
+    "Wall time of requests to the S3 blob store by operation.",
+    ("op",),
+)
+CACHE_LOOKUPS = metrics.counter(
+    "localreader_blob_store_cache_lookups_total",
+    "Blob store cache lookups by result (hit, miss).",
+    ("result",),
+)
+CACHE_BYTES = metrics.gauge(
+    "localreader_blob_store_cache_bytes",
+    "Size of the local cache of the S3 blob store.",
+)
+
+
+class StorageError(OSError):
+    pass
+
+
+def valid_hash(value) -> bool:
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def valid_key(value) -> bool:
+    """An object key: a content hash, with a codec suffix (``.gz``, ``.xz``) for compressed documents."""
+    if not isinstance(value, str):
+        return False
+    content_hash, dot, suffix = value.partition(".")
+    return valid_hash(content_hash) and (not dot or (0 < len(suffix) <= 4 and suffix.isalnum()))
+
+
+def _tmp_path(path: str) -> str:
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _scan(directory: str):
+    """Yield (key, path, size, mtime) of every object under a ``ab/<key>`` tree."""
+    try:
+        prefixes = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for prefix in prefixes:
+        d = os.path.join(directory, prefix)
+        if len(prefix) != 2 or not os.path.isdir(d):
+            continue
+        for name in os.listdir(d):
+            if not valid_key(name):
+                continue
+            path = os.path.join(d, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield name, path, st.st_size, st.st_mtime
+
+
+class BlobFile:
+    """A stored object open for reading; ``len()`` is its size, like ``sqlite3.Blob``."""
+
+    def __init__(self, raw, size: int):
+        self._raw = raw
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, n: int = -1) -> bytes:
+        return self._raw.read(n)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._raw.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._raw.tell()
+
+    def fileno(self) -> int:
+        """The descriptor of a local file, for sendfile; remote objects have none (OSError)."""
+        try:
+            return self._raw.fileno()
+        except AttributeError:
+            raise io.UnsupportedOperation("fileno") from None
+
+    def close(self) -> None:
+        self._raw.close()
+
+
+class BlobStore:
+    """Content-addressed object storage: every method takes an object key (see :func:`valid_key`)."""
+
+    name = ""
+
+    def put(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def open(self, key: str) -> BlobFile:
+        """Open an object for reading. Raises FileNotFoundError if it is not stored."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def list(self):
+        """Yield (key, size, mtime) of every stored object."""
+        raise NotImplementedError
+
+    def local_file(self, key: str):
+        """A local file holding the object, open for reading, or None (e.g. not on this disk)."""
+        return None
+
+    def get(self, key: str) -> bytes:
+        with self.open(key) as f:
+            return f.read()
+
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        with self.open(key) as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def stream(self, key: str, offset: int = 0, length: int | None = None, chunk_size: int = CHUNK):
+        """Iterate over ``length`` bytes (default: the rest) of an object from ``offset``."""
+        with self.open(key) as f:
+            remaining = len(f) - offset if length is None else length
+            f.seek(offset)
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+
+class LocalStore(BlobStore):
+    """Objects as files under ``root``, in ``ab/<key>`` subdirectories."""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        if not valid_key(key):
+            raise ValueError("Invalid object key")
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, key, data):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = _tmp_path(path)
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+                # The only copy once the database row commits: make it durable first.
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def open(self, key):
+        f = open(self._path(key), "rb")
+        return BlobFile(f, os.fstat(f.fileno()).st_size)
+
+    def local_file(self, key):
+        try:
+            return open(self._path(key), "rb")
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self):
+        for key, _, size, mtime in _scan(self.root):
+            yield key, size, mtime
+
+
+def sigv4_authorization(method, path, query, headers, payload_hash, region, access_key, secret_key) -> str:
+    """The ``Authorization`` header of an AWS Signature Version 4 request to S3.
+
+    ``path`` is already URI-encoded; ``headers`` (lowercase names) must include
+    ``host``, ``x-amz-date`` and ``x-amz-content-sha256``, and are all signed.
+    """
+    amz_date = headers["x-amz-date"]
+    names = sorted(headers)
+    canonical = "\n".join(
+        [
+            method,
+            path,
+            "&".join(f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted(query.items())),
+            "".join(f"{k}:{' '.join(str(headers[k]).split())}\n" for k in names),
+            ";".join(names),
+            payload_hash,
+        ]
+    )
+    scope = f"{amz_date[:8]}/{region}/s3/aws4_request"
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+    key = ("AWS4" + secret_key).encode()
+    for part in (amz_date[:8], region, "s3", "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+    return f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={';'.join(names)}, Signature={signature}"
+
+
+class _S3Reader:
+    """Sequential reads of one object over a streaming GET; seeking starts a new request."""
+
+    def __init__(self, store, key: str, size: int):
+        self._store = store
+        self._h = key
+        self._size = size
+        self._pos = 0
+        self._stream = None  # (connection, response)
+
+    def read(self, n: int = -1) -> bytes:
+        if self._pos >= self._size:
+            return b""
+        if self._stream is None:
+            self._stream = self._store._get_stream(self._h, self._pos, None)
+        data = self._stream[1].read() if n is None or n < 0 else self._stream[1].read(n)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        pos = {0: 0, 1: self._pos, 2: self._size}[whence] + offset
+        if pos != self._pos:
+            self._drop()
+            self._pos = max(0, pos)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def _drop(self):
+        if self._stream is not None:
+            self._stream[0].close()
+            self._stream = None
+
+    def close(self) -> None:
+        self._drop()
+
+
+class S3Store(BlobStore):
+    """Objects in an S3-compatible bucket (path-style URLs), keyed ``<prefix>ab/<key>``."""
+
+    name = "s3"
+
+    def __init__(self, endpoint, bucket, region, access_key, secret_key, prefix="", timeout=60):
+        url = urlsplit(endpoint)
+        if url.scheme not in ("http", "https") or not url.netloc or not bucket:
+            raise ValueError("BLOB_STORE=s3 needs BLOB_S3_ENDPOINT (http[s]://host[:port]) and BLOB_S3_BUCKET")
+        self._connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self._host = url.netloc
+        self._base = url.path.rstrip("/")
+        self.bucket = bucket
+        self.region = region
+        self.prefix = prefix
+        self.timeout = timeout
+        self._access_key = access_key
+        self._secret_key = secret_key
+        # One keep-alive connection per thread for requests whose body is read at once.
+        self._local = threading.local()
+
+    def _key(self, key: str) -> str:
+        if not valid_key(key):
+            raise ValueError("Invalid object key")
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    def _request(self, op, method, key=None, query=None, headers=None, body=b"", stream=False):
+        """Send one signed request; returns (connection, response, body).
+
+        Unless ``stream`` (or the request failed) the body is read and the
+        thread's connection kept for the next request; a streamed response has
+        a connection of its own, for the caller to close.
+        """
+        path = quote(f"{self._base}/{self.bucket}" + (f"/{key}" if key is not None else ""), safe="/-_.~")
+        query = query or {}
+        target = path + ("?" + "&".join(f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted(query.items())) if query else "")
+        payload_hash = hashlib.sha256(body).hexdigest()
+        start = time.perf_counter()
+        try:
+            for attempt in range(2):
+                conn = None if stream else getattr(self._local, "conn", None)
+                if conn is None:
+                    conn = self._connection_class(self._host, timeout=self.timeout)
+                    if not stream:
+                        self._local.conn = conn
+                signed = {k.lower(): v for k, v in (headers or {}).items()}
+                signed.update(
+                    {
+                        "host": self._host,
+                        "x-amz-date": datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
+                        "x-amz-content-sha256": payload_hash,
+                    }
+                )
+                signed["authorization"] = sigv4_authorization(
+                    method, path, query, signed, payload_hash, self.region, self._access_key, self._secret_key
+                )
+                try:
+                    conn.request(method, target, body=body or None, headers=signed)
+                    resp = conn.getresponse()
+                    data = b"" if stream and resp.status < 300 else resp.read()
+                except (http.client.HTTPException, OSError) as e:
+                    conn.close()
+                    self._local.conn = None
+                    # A kept-alive connection the server has since closed: retry once on a new one.
+                    if attempt == 0:
+                        continue
+                    raise StorageError(f"S3 {method} {key or self.bucket} failed: {e}") from None
+                break
+        finally:
+            S3_SECONDS.observe(time.perf_counter() - start, op)
+        if resp.status == 404 and key is not None:
+            raise FileNotFoundError(f"S3 object not found: {key}")
+        if resp.status >= 300:
+            if stream:
+                conn.close()
+            code = ""
+            try:
+                code = ET.fromstring(data).findtext("Code") or ""
+            except ET.ParseError:
+                pass
+            raise StorageError(f"S3 {method} {key or self.bucket}: HTTP {resp.status} {code}".rstrip())
+        return conn, resp, data
+
+    def _get_stream(self, key, offset, length):
+        headers = {}
+        if offset or length is not None:
+            headers["range"] = f"bytes={offset}-" + ("" if length is None else str(offset + length - 1))
+        conn, resp, _ = self._request("get", "GET", self._key(key), headers=headers, stream=True)
+        return conn, resp
+
+    def put(self, key, data):
+        self._request("put", "PUT", self._key(key), headers={"content-type": "application/octet-stream"}, body=data)
+
+    def get(self, key):
+        return self._request("get", "GET", self._key(key))[2]
+
+    def read_range(self, key, offset, length):
+        if length <= 0:
+            return b""
+        headers = {"range": f"bytes={offset}-{offset + length - 1}"}
+        return self._request("get", "GET", self._key(key), headers=headers)[2]
+
+    def stream(self, key, offset=0, length=None, chunk_size=CHUNK):
+        if length == 0:
+            return
+        conn, resp = self._get_stream(key, offset, length)
+        try:
+            while chunk := resp.read(chunk_size):
+                yield chunk
+        finally:
+            conn.close()
+
+    def size(self, key: str) -> int:
+        resp = self._request("head", "HEAD", self._key(key))[1]
+        return int(resp.getheader("Content-Length", "0"))
+
+    def open(self, key):
+        size = self.size(key)
+        return BlobFile(_S3Reader(self, key, size), size)
+
+    def exists(self, key):
+        try:
+            self.size(key)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, key):
+        self._request("delete", "DELETE", self._key(key))
+
+    def list(self):
+        query = {"list-type": "2", "prefix": self.prefix}
+        while True:
+            root = ET.fromstring(self._request("list", "GET", query=query)[2])
+            # Drop the XML namespace, whichever the service uses.
+            for el in root.iter():
+                el.tag = el.tag.rpartition("}")[2]
+            for item in root.iter("Contents"):
+                key = item.findtext("Key", "").rpartition("/")[2]
+                if valid_key(key):
+                    modified = datetime.fromisoformat(item.findtext("LastModified").replace("Z", "+00:00"))
+                    yield key, int(item.findtext("Size", "0")), modified.timestamp()
+            token = root.findtext("NextContinuationToken")
+            if root.findtext("IsTruncated") != "true" or not token:
+                return
+            query = {**query, "continuation-token": token}
+
+
+class CachedStore(BlobStore):
+    """Read-through local disk cache in front of a remote store.
+
+    Reads copy the whole object into ``directory`` first (so it can be sent
+    with ``sendfile``); writes fill the cache too, as the content indexer reads
+    a new document right after its upload.
+    """
+
+    def __init__(self, store: BlobStore, directory: str, max_bytes: int):
+        self.store = store
+        self.name = store.name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # computed on first use
+        # hash -> lock, so concurrent misses for one object fetch it once.
+        self._fetch_locks: dict[str, threading.Lock] = {}
+
+    def _path(self, key: str) -> str:
+        if not valid_key(key):
+            raise ValueError("Invalid object key")
+        return os.path.join(self.directory, key[:2], key)
+
+    def _add_bytes(self, n: int) -> None:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size, _ in _scan(self.directory))
+            self._total_bytes += n
+            CACHE_BYTES.set(self._total_bytes)
+            over = self._total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def _fill(self, key: str, chunks) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = _tmp_path(path)
+        size = 0
+        try:
+            with open(tmp, "wb") as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        self._add_bytes(size)
+
+    def put(self, key, data):
+        self.store.put(key, data)
+        try:
+            self._fill(key, (data,))
+        except OSError:
+            logger.exception("Caching stored object failed: hash=%s", key[:16])
+
+    def _open_cached(self, key: str):
+        path = self._path(key)
+        f = open(path, "rb")
+        try:
+            if time.time() - os.fstat(f.fileno()).st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            pass
+        return f
+
+    def local_file(self, key):
+        try:
+            f = self._open_cached(key)
+            CACHE_LOOKUPS.inc("hit")
+            return f
+        except FileNotFoundError:
+            pass
+        CACHE_LOOKUPS.inc("miss")
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+        with fetch_lock:
+            try:
+                return self._open_cached(key)
+            except FileNotFoundError:
+                pass
+            started = time.monotonic()
+            try:
+                self._fill(key, self.store.stream(key))
+            except FileNotFoundError:
+                return None
+            finally:
+                with self._lock:
+                    self._fetch_locks.pop(key, None)
+            logger.info("Cached stored object: hash=%s seconds=%.2f", key[:16], time.monotonic() - started)
+            return self._open_cached(key)
+
+    def open(self, key):
+        f = self.local_file(key)
+        if f is None:
+            raise FileNotFoundError(f"Object not stored: {key}")
+        return BlobFile(f, os.fstat(f.fileno()).st_size)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key)) or self.store.exists(key)
+
+    def delete(self, key):
+        try:
+            size = os.path.getsize(self._path(key))
+            os.unlink(self._path(key))
+            self._add_bytes(-size)
+        except FileNotFoundError:
+            pass
+        self.store.delete(key)
+
+    def list(self):
+        return self.store.list()
+
+    def evict(self) -> int:
+        """Delete least recently read objects until the cache fits. Returns bytes freed."""
+        entries = sorted(_scan(self.directory), key=lambda e: e[3])
+        total = sum(e[2] for e in entries)
+        # Keep headroom so the next few fills don't trigger another full scan.
+        target = self.max_bytes * 0.9
+        freed = 0
+        for _, path, size, _ in entries:
+            if total - freed <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            freed += size
+        with self._lock:
+            self._total_bytes = total - freed
+            CACHE_BYTES.set(self._total_bytes)
+        if freed:
+            logger.info("Evicted cached objects: bytes=%d remaining=%d", freed, total - freed)
+        return freed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(BLOB_STORE)
+
+
+def store() -> BlobStore | None:
+    """The configured blob store, or None when documents stay in SQLite."""
+    global _store
+    if not BLOB_STORE:
+        return None
+    with _store_lock:
+        if _store is None:
+            if BLOB_STORE == "local":
+                _store = LocalStore(BLOB_STORE_DIR)
+            elif BLOB_STORE == "s3":
+                s3 = S3Store(
+                    BLOB_S3_ENDPOINT,
+                    BLOB_S3_BUCKET,
+                    BLOB_S3_REGION,
+                    BLOB_S3_ACCESS_KEY,
+                    BLOB_S3_SECRET_KEY,
+                    BLOB_S3_PREFIX,
+                    BLOB_S3_TIMEOUT,
+                )
+                _store = CachedStore(s3, BLOB_STORE_CACHE_DIR, BLOB_STORE_CACHE_MAX_BYTES) if BLOB_STORE_CACHE_MAX_BYTES > 0 else s3
+            else:
+                raise ValueError(f"Unknown BLOB_STORE {BLOB_STORE!r} (use local or s3)")
+        return _store
+
+
+def migrate(batch: int = 20) -> dict:
+    """Move every document stored in SQLite to the blob store. Returns counts."""
+    import app  # not at the top: app imports this module
+
+    if store() is None:
+        raise SystemExit("Set BLOB_STORE first (local or s3)")
+    app.init_db()
+    start = time.perf_counter()
+    files = size = 0
+    for path in app.database_paths():
+        count = 0
+        while True:
+            moved = app.move_to_blob_store(batch, db=path)
+            if not moved:
+                break
+            count += len(moved)
+            size += sum(moved)
+        files += count
+        logger.info("Database migrated: path=%s files=%d", path, count)
+    result = {"files": files, "bytes": size, "seconds": round(time.perf_counter() - start, 3)}
+    logger.info("Migration done: files=%d bytes=%d seconds=%.1f", files, size, result["seconds"])
+    return result
+
+
+def status() -> dict:
+    """Documents (and bytes) in SQLite and in the blob store, and what the store holds."""
+    import app
+
+    out = {"blob_store": BLOB_STORE or None, "databases": []}
+    for path in app.database_paths():
+        with sqlite3.connect(path, timeout=30) as conn:
+            rows = conn.execute(
+                "SELECT blob_store, COUNT(*), SUM(COALESCE(blob_size, length(file_data))) FROM files GROUP BY blob_store"
+            ).fetchall()
+        out["databases"].append(
+            {"path": path, **{(name or "sqlite"): {"files": n, "bytes": b or 0} for name, n, b in rows}}
+        )
+    s = store()
+    if s is not None:
+        objects = list(s.list())
+        out["objects"] = {"count": len(objects), "bytes": sum(size for _, size, _ in objects)}
+    return out
+
+
+def main(argv=None):
+    import logconfig
+
+    parser = argparse.ArgumentParser(description="Move LocalReader documents from SQLite to the blob store (BLOB_STORE).")
+    parser.add_argument("--migrate", action="store_true", help="move every document stored in SQLite to the blob store")
+    parser.add_argument("--status", action="store_true", help="show where documents are stored")
+    parser.add_argument("--batch", type=int, default=20, help="documents moved per transaction (default 20)")
+    args = parser.parse_args(argv)
+    if not args.migrate and not args.status:
+        parser.error("nothing to do: use --migrate or --status")
+
+    logconfig.configure_logging()
+    result = migrate(args.batch) if args.migrate else status()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Request-scoped timing spans.
+
+``APIHandler`` starts a :class:`Trace` per request when ``TRACE_ENABLED`` is
+set; code anywhere below it (including ``app.py``) wraps phases in
+``with tracing.span("name"):``. Spans with the same name are summed. The
+breakdown is sent back as a ``Server-Timing`` header and logged for requests
+slower than ``TRACE_SLOW_MS``.
+
+When tracing is disabled :func:`span` is a ContextVar lookup returning a shared
+no-op context manager.
+"""
+import contextvars
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger("localreader.trace")
+
+ENABLED = os.environ.get("TRACE_ENABLED", "false").strip().lower() in {"1", "true", "yes"}
+SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "500"))
+
+_current: contextvars.ContextVar = contextvars.ContextVar("localreader_trace", default=None)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("_trace", "_name", "_start")
+
+    def __init__(self, trace, name):
+        self._trace = trace
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._trace.add(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class Trace:
+    __slots__ = ("request_id", "start", "phases", "_token")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        # name -> [total seconds, count], in first-seen order
+        self.phases: dict[str, list] = {}
+        self._token = None
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.phases.get(name)
+        if entry is None:
+            self.phases[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={total * 1000:.2f}" for name, (total, _) in self.phases.items()]
+        parts.append(f"app;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+    def breakdown(self) -> str:
+        parts = []
+        for name, (total, count) in self.phases.items():
+            part = f"{name}={total * 1000:.1f}ms"
+            if count > 1:
+                part += f"(x{count})"
+            parts.append(part)
+        return " ".join(parts)
+
+
+def span(name: str):
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name)
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+def start(request_id: str | None = None) -> Trace | None:
+    """Begin a trace for the calling thread's request; returns None when disabled."""
+    if not ENABLED:
+        return None
+    rid = (request_id or "").strip()[:64] or uuid.uuid4().hex[:16]
+    trace = Trace(rid)
+    trace._token = _current.set(trace)
+    return trace
+
+
+def finish(trace: Trace | None, method: str, route: str, status) -> None:
+    if trace is None:
+        return
+    total_ms = trace.elapsed() * 1000
+    if trace._token is not None:
+        _current.reset(trace._token)
+        trace._token = None
+    if total_ms >= SLOW_MS:
+        logger.warning(
+            "Slow request: id=%s %s %s status=%s total=%.1fms %s",
+            trace.request_id,
+            method,
+            route,
+            status,
+            total_ms,
+            trace.breakdown(),
+        )
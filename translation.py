@@ -0,0 +1,256 @@
+"""Long-lived translation service backing ``POST /api/translate``.
+
+A single event loop runs on a daemon thread and owns one backend instance (and
+therefore one upstream HTTP client) for the lifetime of the process. Request
+handler threads submit work through :meth:`TranslationService.translate_many`;
+concurrent requests for the same ``(target, text)`` share one in-flight future,
+and everything submitted within a short window is grouped per target language
+into batched upstream calls.
+"""
+import asyncio
+import importlib
+import inspect
+import logging
+import os
+import threading
+
+logger = logging.getLogger("localreader.translate")
+
+TRANSLATE_BACKEND = os.environ.get("TRANSLATE_BACKEND", "googletrans").strip() or "googletrans"
+TRANSLATE_TIMEOUT_SECONDS = float(os.environ.get("TRANSLATE_TIMEOUT_SECONDS", "30"))
+TRANSLATE_BATCH_WINDOW_MS = float(os.environ.get("TRANSLATE_BATCH_WINDOW_MS", "15"))
+TRANSLATE_BATCH_MAX_CHARS = int(os.environ.get("TRANSLATE_BATCH_MAX_CHARS", "4500"))
+TRANSLATE_BATCH_MAX_ITEMS = int(os.environ.get("TRANSLATE_BATCH_MAX_ITEMS", "64"))
+
+
+class TranslationUnavailable(RuntimeError):
+    """The configured backend cannot be used (e.g. its package is not installed)."""
+
+
+class GoogleTransBackend:
+    """Backend using the ``googletrans`` package.
+
+    Works with both the synchronous 4.0.0-rc1 API and the newer async one. Sync
+    calls are pushed to the loop's default executor so they don't stall other
+    batches. Several sentences are sent as one newline-joined request and split
+    back apart; if the upstream reply doesn't line up, each text is retried on
+    its own.
+    """
+
+    name = "googletrans"
+
+    def __init__(self):
+        from googletrans import Translator
+
+        self._translator = Translator()
+
+    async def _call(self, text, target):
+        fn = self._translator.translate
+        if inspect.iscoroutinefunction(fn):
+            return await fn(text, dest=target)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, lambda: fn(text, dest=target))
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def translate(self, texts, target):
+        if len(texts) > 1 and not any("\n" in t for t in texts):
+            result = await self._call("\n".join(texts), target)
+            parts = (getattr(result, "text", "") or "").split("\n")
+            if len(parts) == len(texts):
+                detected = getattr(result, "src", None)
+                return [(part, detected) for part in parts]
+            logger.debug("Batch split mismatch: sent=%d got=%d; retrying per text", len(texts), len(parts))
+
+        out = []
+        for text in texts:
+            result = await self._call(text, target)
+            out.append((getattr(result, "text", ""), getattr(result, "src", None)))
+        return out
+
+
+class StubBackend:
+    """Offline backend that tags each text with the target language.
+
+    Useful for local development and load tests where no network is available.
+    """
+
+    name = "stub"
+
+    async def translate(self, texts, target):
+        return [(f"[{target}] {text}", "auto") for text in texts]
+
+
+BACKENDS = {
+    GoogleTransBackend.name: GoogleTransBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def _resolve_backend_factory(spec: str):
+    """Return a backend class from a registered name or a ``module:Class`` path."""
+    if spec in BACKENDS:
+        return BACKENDS[spec]
+    if ":" in spec:
+        module_name, attr = spec.split(":", 1)
+        return getattr(importlib.import_module(module_name), attr)
+    raise ValueError(f"Unknown translation backend: {spec}")
+
+
+class TranslationService:
+    def __init__(
+        self,
+        backend_factory,
+        batch_window_ms: float = TRANSLATE_BATCH_WINDOW_MS,
+        batch_max_chars: int = TRANSLATE_BATCH_MAX_CHARS,
+        batch_max_items: int = TRANSLATE_BATCH_MAX_ITEMS,
+    ):
+        self._backend_factory = backend_factory
+        self._batch_window = max(0.0, batch_window_ms) / 1000.0
+        self._batch_max_chars = max(1, batch_max_chars)
+        self._batch_max_items = max(1, batch_max_items)
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # Only touched from the loop thread.
+        self._backend = None
+        self._backend_lock = None
+        self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+        self._pending: dict[str, list[tuple[str, asyncio.Future]]] = {}
+        self._flush_handle = None
+
+    def start(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                self._backend_lock = asyncio.Lock()
+                ready.set()
+                loop.run_forever()
+                loop.close()
+
+            self._thread = threading.Thread(target=_run, name="translate-loop", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            logger.info("Translation service started: backend=%s", getattr(self._backend_factory, "name", self._backend_factory))
+
+    def stop(self, timeout: float = 5.0):
+        with self._start_lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+    def translate_many(self, texts: list[str], target: str, timeout: float = TRANSLATE_TIMEOUT_SECONDS) -> list[dict]:
+        """Translate ``texts`` into ``target``; blocks the calling thread.
+
+        Returns one ``{"translatedText", "detectedSource"}`` dict per input, in order.
+        Raises :class:`TranslationUnavailable` if the backend cannot be created.
+        """
+        self.start()
+        cf = asyncio.run_coroutine_threadsafe(self._translate_many(list(texts), target), self._loop)
+        try:
+            results = cf.result(timeout)
+        except TimeoutError:
+            cf.cancel()
+            raise
+        return [{"translatedText": text, "detectedSource": detected} for text, detected in results]
+
+    def translate(self, text: str, target: str, timeout: float = TRANSLATE_TIMEOUT_SECONDS) -> dict:
+        return self.translate_many([text], target, timeout=timeout)[0]
+
+    async def _get_backend(self):
+        if self._backend is not None:
+            return self._backend
+        async with self._backend_lock:
+            if self._backend is None:
+                try:
+                    self._backend = self._backend_factory()
+                except ImportError as e:
+                    raise TranslationUnavailable(str(e)) from e
+            return self._backend
+
+    async def _translate_many(self, texts, target):
+        futures = [self._submit(text, target) for text in texts]
+        # Shield shared futures so one caller timing out doesn't cancel the
+        # work other coalesced callers are waiting on.
+        return await asyncio.gather(*(asyncio.shield(f) for f in futures))
+
+    def _submit(self, text, target) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if not text:
+            fut = loop.create_future()
+            fut.set_result(("", None))
+            return fut
+
+        key = (target, text)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            return fut
+
+        fut = loop.create_future()
+        self._inflight[key] = fut
+        self._pending.setdefault(target, []).append((text, fut))
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._batch_window, self._flush)
+        return fut
+
+    def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        loop = asyncio.get_running_loop()
+        for target, items in pending.items():
+            batch, batch_chars = [], 0
+            for item in items:
+                n = len(item[0])
+                if batch and (len(batch) >= self._batch_max_items or batch_chars + n > self._batch_max_chars):
+                    loop.create_task(self._run_batch(target, batch))
+                    batch, batch_chars = [], 0
+                batch.append(item)
+                batch_chars += n + 1
+            if batch:
+                loop.create_task(self._run_batch(target, batch))
+
+    async def _run_batch(self, target, items):
+        texts = [text for text, _ in items]
+        try:
+            backend = await self._get_backend()
+            results = await backend.translate(texts, target)
+            if len(results) != len(items):
+                raise RuntimeError(f"Backend returned {len(results)} results for {len(items)} texts")
+            logger.debug("Translated batch: target=%s size=%d", target, len(items))
+            for (_, fut), result in zip(items, results):
+                if not fut.done():
+                    fut.set_result(result)
+        except Exception as e:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            for text in texts:
+                self._inflight.pop((target, text), None)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> TranslationService:
+    """Return the process-wide service, creating it from ``TRANSLATE_BACKEND`` on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = TranslationService(_resolve_backend_factory(TRANSLATE_BACKEND))
+    return _service
@@ -0,0 +1,178 @@
+"""Shared cache of synthesized sentence audio.
+
+Devices upload the WAV Piper produced for a sentence, keyed by voice, speed
+and the SHA-256 of the sentence's normalized text; another device (or the
+same one later) looks the next sentences up in one request and downloads the
+audio instead of synthesizing it again. Audio files are stored once under
+``TTS_CACHE_DIR``, named by their own SHA-256, and are immutable; the entries
+pointing at them live in the ``tts_audio`` table.
+
+The cache is bounded per user (``TTS_CACHE_USER_MAX_BYTES``, counting the
+audio that user uploaded) and in total (``TTS_CACHE_MAX_BYTES``); the least
+recently used entries go first. With ``TTS_CACHE_SHARED`` (the default) users
+reuse each other's audio; otherwise lookups only see their own.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+import app
+import metrics
+
+logger = logging.getLogger("localreader.ttscache")
+
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR") or os.path.join(os.path.dirname(app.DB_PATH) or ".", "tts-cache")
+# 0 disables the cache.
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(1024**3)))
+TTS_CACHE_USER_MAX_BYTES = int(os.environ.get("TTS_CACHE_USER_MAX_BYTES", str(256 * 1024**2)))
+TTS_CACHE_SHARED = os.environ.get("TTS_CACHE_SHARED", "true").strip().lower() in {"1", "true", "yes"}
+MAX_AUDIO_BYTES = 8 * 1024 * 1024
+LOOKUP_MAX = 64
+
+_VOICE_RE = re.compile(r"^[A-Za-z0-9_.-]{1,100}$")
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+HITS = metrics.counter(
+    "localreader_tts_cache_lookups_total",
+    "Sentences looked up in the audio cache by result (hit, miss).",
+    ("result",),
+)
+STORED = metrics.counter(
+    "localreader_tts_cache_stored_bytes_total",
+    "Audio bytes uploaded to the cache.",
+)
+EVICTED = metrics.counter(
+    "localreader_tts_cache_evicted_bytes_total",
+    "Audio file bytes deleted by eviction.",
+)
+
+_lock = threading.Lock()
+_added_since_evict = 0
+
+
+class AudioCacheError(ValueError):
+    pass
+
+
+def enabled() -> bool:
+    return TTS_CACHE_MAX_BYTES > 0
+
+
+def valid_hash(value) -> bool:
+    return isinstance(value, str) and bool(_HASH_RE.match(value))
+
+
+def key(voice, speed) -> tuple[str, str]:
+    """Validated ``(voice, speed)``; speed is canonicalized (``1``, ``1.25``)."""
+    if not isinstance(voice, str) or not _VOICE_RE.match(voice):
+        raise AudioCacheError("Invalid voice")
+    try:
+        speed_value = float(speed)
+    except (TypeError, ValueError):
+        raise AudioCacheError("Invalid speed") from None
+    if not 0.1 <= speed_value <= 10:
+        raise AudioCacheError("Invalid speed")
+    return voice, f"{speed_value:g}"
+
+
+def _path(audio_hash: str) -> str:
+    return os.path.join(TTS_CACHE_DIR, audio_hash[:2], audio_hash)
+
+
+def put(owner_email: str, voice: str, speed: str, text_hash: str, data: bytes) -> str:
+    """Store one sentence's WAV audio. Returns its audio hash."""
+    if not valid_hash(text_hash):
+        raise AudioCacheError("Invalid text_hash")
+    if len(data) > MAX_AUDIO_BYTES:
+        raise AudioCacheError("Audio too large")
+    if len(data) < 44 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise AudioCacheError("Audio must be a WAV file")
+    audio_hash = hashlib.sha256(data).hexdigest()
+    path = _path(audio_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    app.store_tts_audio(owner_email, voice, speed, text_hash, audio_hash, len(data))
+    STORED.inc(amount=len(data))
+    _maybe_evict(len(data))
+    return audio_hash
+
+
+def lookup(owner_email: str, voice: str, speed: str, text_hashes: list) -> dict:
+    """``{text_hash: {"audio_hash", "size"}}`` for the sentences already cached."""
+    wanted = [h for h in dict.fromkeys(text_hashes) if valid_hash(h)][:LOOKUP_MAX]
+    found = app.lookup_tts_audio(None if TTS_CACHE_SHARED else owner_email, voice, speed, wanted)
+    HITS.inc("hit", amount=len(found))
+    HITS.inc("miss", amount=len(wanted) - len(found))
+    return {h: {"audio_hash": a, "size": size} for h, (a, size) in found.items()}
+
+
+def open_audio(audio_hash: str):
+    """Open a stored audio file, or return None."""
+    if not valid_hash(audio_hash):
+        return None
+    try:
+        return open(_path(audio_hash), "rb")
+    except FileNotFoundError:
+        return None
+
+
+def _maybe_evict(added: int) -> None:
+    """Evict once uploads since the last eviction could have crossed a limit."""
+    global _added_since_evict
+    threshold = min(TTS_CACHE_MAX_BYTES * 0.05, TTS_CACHE_USER_MAX_BYTES * 0.1 or TTS_CACHE_MAX_BYTES)
+    with _lock:
+        _added_since_evict += added
+        if _added_since_evict < threshold:
+            return
+        _added_since_evict = 0
+    evict()
+
+
+def sweep() -> int:
+    """Delete audio files no entry refers to (e.g. left by a failed upload). Returns bytes freed."""
+    referenced = app.referenced_tts_audio()
+    cutoff = time.time() - 3600  # don't race uploads in progress
+    freed = 0
+    try:
+        prefixes = os.listdir(TTS_CACHE_DIR)
+    except FileNotFoundError:
+        return 0
+    for prefix in prefixes:
+        d = os.path.join(TTS_CACHE_DIR, prefix)
+        if len(prefix) != 2 or not os.path.isdir(d):
+            continue
+        for name in os.listdir(d):
+            path = os.path.join(d, name)
+            try:
+                st = os.stat(path)
+                if name.partition(".")[0] in referenced or st.st_mtime > cutoff:
+                    continue
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            freed += st.st_size
+    return freed
+
+
+def evict() -> int:
+    """Apply the size limits and delete unreferenced audio files. Returns bytes freed."""
+    freed = 0
+    for audio_hash in app.evict_tts_audio(TTS_CACHE_MAX_BYTES, TTS_CACHE_USER_MAX_BYTES):
+        path = _path(audio_hash)
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        freed += size
+    if freed:
+        EVICTED.inc(amount=freed)
+        logger.info("Evicted cached audio: bytes=%d", freed)
+    return freed